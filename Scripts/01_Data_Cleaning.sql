@@ -93,6 +93,7 @@ INSERT INTO fr_meteofrance
 		FROM './Data/Raw/European Alps Snow Depth Observations Data/date_monthly_FR_METEROFRANCE.csv'
 		DELIMITER ',' CSV HEADER;
 -- Repeat the above steps for other providers, e.g., AT_HZB, CH_METEOSWISS, etc.
+-- (python -m Scripts.ingest loads every provider file and writes monthly_snowpack.csv / weather_stations_list.csv in one command)
 
 -- Insert data from MeteoFrance into monthly_snowpack table
 -- This assumes that the weather_stations table has been populated with the corresponding station names
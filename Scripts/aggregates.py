@@ -0,0 +1,189 @@
+# 03_Statistical_Testing
+
+# Aggregated trends over grouping sets
+#
+# The country-month, country, month and elevation band-month trends of
+# notebook 03 (mk_country_month, mk_country, mk_month, mk_elevation) are one
+# computation over different keys: per group and year, the median hnsum
+# across the group's station-months (years with fewer than
+# MIN_STATIONS_PER_YEAR stations dropped), then Mann–Kendall / Hamed–Rao and
+# Sen's slope of that yearly series. Here every breakdown is a GroupingSet of
+# one engine.
+#
+# snow_recordings is sorted by hnsum once. A grouping set factorizes its keys
+# (each column once, shared between sets) into a (group, year) cell code and
+# stable-sorts those integers, which keeps the shared value order inside
+# every cell, so cell medians are read at run offsets without another pass
+# over the values. The yearly series of every set are then packed into one
+# padded batch and tested together (Scripts/mann_kendall.py).
+#
+# Given the snow cube (Scripts/cube.py), sets keyed by station attributes and
+# month (country-month, country, month, elevation band-month) read their
+# series from the cube's axis reductions instead; sets the cube cannot
+# express (e.g. provider) keep the sorted path.
+#
+# A new breakdown (e.g. provider x month) is one more GROUPING_SETS entry.
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from Scripts.cube import cube_series
+from Scripts.mann_kendall import MIN_YEARS, mk_test_batch
+from Scripts.segments import Segments
+
+# Minimum number of stations per year
+MIN_STATIONS_PER_YEAR = 10  # coverage guardrail
+
+
+@dataclass(frozen=True)
+class GroupingSet:
+    """Key columns of one aggregated trend table (the yearly series are per keys + year)."""
+    keys: tuple
+    coverage_range: bool = False        # stations min / max per year on "insufficient" records
+
+
+# Aggregated trend tables of notebook 03 (Scripts.trends.OUTPUTS names)
+GROUPING_SETS = {
+    'country_month_macro': GroupingSet(('country', 'country_abr', 'month', 'month_name'), coverage_range=True),
+    'country_macro': GroupingSet(('country', 'country_abr'), coverage_range=True),
+    'month_macro': GroupingSet(('month', 'month_name')),
+    'elevation_macro': GroupingSet(('month', 'month_name', 'elevation_band')),
+}
+
+
+# Yearly series
+
+def _dense(cell: np.ndarray, size: int) -> np.ndarray:
+    """
+    Cell codes renumbered 0..k-1 in the same order; as uint16 when k allows,
+    which numpy's stable argsort sorts by radix in linear time.
+    """
+    if cell.size == 0 or size > 50 * cell.size + 1_000_000:             # sparse cell space: sort the codes as they are
+        return cell
+    present = np.zeros(size, dtype=bool)
+    present[cell] = True
+    dense = (np.cumsum(present) - 1)[cell]
+    return dense.astype(np.uint16) if present.sum() <= np.iinfo(np.uint16).max + 1 else dense
+
+
+def aggregate_series(snow_recordings: pd.DataFrame, sets: dict = GROUPING_SETS,
+                     min_stations: int = MIN_STATIONS_PER_YEAR, cube=None) -> dict:
+    """
+    Yearly median across stations for every grouping set, limited to
+    well-covered years: set name -> (keys..., year, n_stations, hn_mean),
+    sorted by keys then year. With a snow cube, every set it can express is
+    an axis reduction over it (Scripts.cube.cube_series).
+    """
+    series = {}
+    if cube is not None:
+        for name, spec in sets.items():
+            frame = cube_series(cube, spec.keys, min_stations)
+            if frame is not None:
+                series[name] = frame
+    if len(series) == len(sets):
+        return series
+
+    values = pd.to_numeric(snow_recordings['hnsum'], errors='coerce').to_numpy(dtype=float)
+    by_value = np.argsort(values, kind='stable')                # NaN last; shared by every set
+    values = values[by_value]
+
+    factorized = {}
+
+    def codes(column):
+        if column not in factorized:
+            column_codes, uniques = pd.factorize(snow_recordings[column], sort=True)
+            factorized[column] = (column_codes[by_value].astype(np.int64), uniques)
+        return factorized[column]
+
+    station, stations = codes('station_id')
+    for name, spec in sets.items():
+        if name in series:
+            continue
+        parts = [codes(key) for key in spec.keys] + [codes('year')]
+        dims = [max(len(uniques), 1) for _, uniques in parts]
+        rows = np.logical_and.reduce([part_codes >= 0 for part_codes, _ in parts])     # groupby drops missing keys
+        cell = np.ravel_multi_index([part_codes[rows] for part_codes, _ in parts], dims)
+
+        order = np.argsort(_dense(cell, np.prod(dims)), kind='stable')     # cells contiguous, values still ascending
+        cell, cell_values, cell_station = cell[order], values[rows][order], station[rows][order]
+        starts = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]]) if cell.size else np.empty(0, dtype=np.int64)
+
+        n = np.add.reduceat(np.isfinite(cell_values), starts) if cell.size else np.empty(0, dtype=np.int64)
+        lo = starts + np.maximum(n - 1, 0) // 2
+        hi = np.minimum(starts + n // 2, max(cell.size - 1, 0))
+        median = np.where(n > 0, (cell_values[lo] + cell_values[hi]) / 2, np.nan) if cell.size else np.empty(0)
+
+        pairs = np.sort(cell * len(stations) + cell_station)                # (cell, station), same cell runs
+        first = np.r_[True, pairs[1:] != pairs[:-1]] if pairs.size else np.empty(0, dtype=bool)
+        n_stations = np.add.reduceat(first, starts) if cell.size else np.empty(0, dtype=np.int64)
+
+        keep = n_stations >= min_stations
+        positions = np.unravel_index(cell[starts][keep], dims)
+        frame = pd.DataFrame({key: uniques.take(position) for key, (_, uniques), position
+                              in zip(list(spec.keys) + ['year'], parts, positions)})
+        frame['n_stations'] = n_stations[keep].astype('int64')
+        frame['hn_mean'] = median[keep]
+        series[name] = frame
+    return {name: series[name] for name in sets}
+
+
+# Trends
+
+def aggregate_trends(series: dict, sets: dict = GROUPING_SETS, min_years: int = MIN_YEARS) -> dict:
+    """
+    MK / Hamed–Rao and Sen's slope of every yearly series of every set,
+    tested in one batch; set name -> one row per group. As in notebook 03, a
+    correction that is not finite is reported as it is (variant 'hamed_rao',
+    p NaN) rather than replaced by the original test. Series with fewer than
+    min_years finite years get an "insufficient" record.
+    """
+    packed = []
+    for name, spec in sets.items():
+        segments = Segments(series[name], list(spec.keys))
+        ok = np.isfinite(segments.values('hn_mean'))            # MK runs on the finite years, in year order
+        packed.append((name, spec, segments, ok, segments.sum(ok).astype(np.int64)))
+
+    n_all = np.concatenate([n for *_, n in packed]) if packed else np.empty(0, dtype=np.int64)
+    Y = np.full((len(n_all), int(n_all.max()) if n_all.size else 0), np.nan)
+    start = 0
+    for _, _, segments, ok, n in packed:
+        offsets = np.r_[0, np.cumsum(n)[:-1]].astype(np.int64)
+        position = np.arange(int(n.sum())) - np.repeat(offsets, n)
+        Y[start + segments.ids[ok], position] = segments.values('hn_mean')[ok]
+        start += len(n)
+
+    test = n_all >= min_years
+    result = {key: np.full(len(n_all), np.nan) for key in ('p', 'tau', 'slope')}
+    trend = np.full(len(n_all), None, dtype=object)
+    variant = np.full(len(n_all), 'insufficient', dtype=object)
+    if test.any():
+        tested = mk_test_batch(Y[test][:, :int(n_all[test].max())], n_all[test], fallback=False)
+        for key in result:
+            result[key][test] = tested[key].to_numpy(dtype=float)
+        trend[test] = tested['trend'].to_numpy()
+        variant[test] = tested['variant'].to_numpy()
+
+    tables, start = {}, 0
+    for name, spec, segments, ok, n in packed:
+        rows = slice(start, start + len(n))
+        start += len(n)
+        stations = np.where(ok, segments.values('n_stations'), np.nan)
+        median = np.floor(segments.median(stations))
+        insufficient = ~test[rows]
+
+        table = segments.groups()
+        table['n_years'] = n
+        table['median_stations_per_year'] = median.astype('int64') if np.isfinite(median).all() else median
+        if spec.coverage_range and insufficient.any():
+            table['stations_min_per_year'] = np.where(insufficient, segments.min(stations), np.nan)
+            table['stations_max_per_year'] = np.where(insufficient, segments.max(stations), np.nan)
+        table['trend'] = pd.Series(trend[rows], dtype='str')
+        table['p'] = result['p'][rows]
+        table['tau'] = result['tau'][rows]
+        table['slope_per_year'] = result['slope'][rows]                 # cm/year
+        table['slope_per_decade'] = result['slope'][rows] * 10          # cm/decade
+        table['variant'] = pd.Series(variant[rows], dtype='str')
+        tables[name] = table
+    return tables
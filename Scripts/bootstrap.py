@@ -0,0 +1,202 @@
+# 03_Statistical_Testing
+
+# Bootstrap confidence intervals for the aggregated trend slopes
+#
+# The country, month and elevation band-month trends of notebook 03 are Sen's
+# slopes of a yearly median across stations. Their uncertainty comes mostly
+# from which stations happen to report, so every aggregate is resampled by
+# drawing its stations with replacement, rebuilding the yearly medians (same
+# coverage guardrail, MIN_STATIONS_PER_YEAR) and re-estimating the slope.
+# Optionally, each resampled series also has its Sen residuals redrawn in
+# moving blocks of years, to account for serial dependence.
+#
+# Resamples are evaluated in batches on the snow cube (Scripts/cube.py): a
+# resample is a vector of draw counts per station, each year's values are
+# sorted once and the medians of every resample are weighted medians read off
+# cumulative counts; the slopes of every resample then go through the batched
+# Theil–Sen kernel at once. Each aggregate gets its own RNG stream spawned
+# from one seed, so results do not depend on the number of workers.
+#
+#   python -m Scripts.trends --bootstrap 2000 --workers 8
+
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from Scripts.functions import get_country_abr, get_month_name
+from Scripts.mann_kendall import MIN_YEARS
+from Scripts.theil_sen import theil_sen_batch
+
+# Resamples per aggregate, and percentile interval coverage
+N_BOOT = 2000
+CONFIDENCE = 0.95
+
+# Upper bound on draw weights held per batch (resamples x stations x months)
+MAX_BATCH_CELLS = 20_000_000
+
+# CI columns added next to each table's slope columns
+CI_COLUMNS = ['slope_per_year_ci_low', 'slope_per_year_ci_high',
+              'slope_per_decade_ci_low', 'slope_per_decade_ci_high', 'n_boot']
+
+
+# Kernels
+
+def weighted_median(sorted_values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Median of the multiset holding sorted_values[j] weights[r, j] times, per
+    row r of weights (NaN where a row has no weight).
+    """
+    cumulative = np.cumsum(weights, axis=1)
+    k = cumulative[:, -1]
+    lo = (cumulative > ((k - 1) // 2)[:, None]).argmax(axis=1)        # positions (k-1)//2 and k//2
+    hi = (cumulative > (k // 2)[:, None]).argmax(axis=1)
+    return np.where(k > 0, (sorted_values[lo] + sorted_values[hi]) / 2, np.nan)
+
+
+def left_align(series: np.ndarray) -> tuple:
+    """(padded batch, valid counts): the finite values of each row moved to the front, in order."""
+    finite = np.isfinite(series)
+    order = np.argsort(~finite, axis=1, kind='stable')
+    return np.take_along_axis(series, order, axis=1), finite.sum(axis=1)
+
+
+def resampled_series(values: np.ndarray, valid: np.ndarray, weights: np.ndarray, min_stations: int) -> np.ndarray:
+    """
+    Yearly median across resampled stations of a (stations x years x months)
+    block. weights (resamples x stations) counts how often each station was
+    drawn, so a year's median is a weighted median over its values sorted
+    once, never over gathered copies. Years covered by fewer than
+    min_stations drawn stations are NaN.
+    """
+    S, Y, M = values.shape
+    A = np.where(valid, values, np.nan).transpose(1, 0, 2).reshape(Y, S * M)
+    station = np.repeat(np.arange(S), M)
+    counts = weights @ valid.any(axis=2)                    # drawn stations reporting per year
+
+    series = np.full((len(weights), Y), np.nan)
+    for y in range(Y):
+        finite = np.flatnonzero(np.isfinite(A[y]))
+        if finite.size:
+            order = finite[np.argsort(A[y, finite], kind='stable')]
+            series[:, y] = weighted_median(A[y, order], weights[:, station[order]])
+    return np.where(counts >= min_stations, series, np.nan)
+
+
+def block_residuals(Y: np.ndarray, n: np.ndarray, fit: dict, block_length: int, rng) -> np.ndarray:
+    """Sen fit of each row plus its residuals redrawn in moving blocks of block_length years."""
+    b, L = Y.shape
+    step = np.arange(L, dtype=float)
+    trend = fit['intercept'][:, None] + fit['slope'][:, None] * step
+    resid = Y - trend
+
+    n_blocks = -(-L // block_length)
+    max_start = np.maximum(n - block_length + 1, 1)
+    starts = np.floor(rng.random((b, n_blocks)) * max_start[:, None]).astype(np.int64)
+    pos = (starts[:, :, None] + np.arange(block_length)).reshape(b, -1)[:, :L]
+    pos = np.minimum(pos, np.maximum(n - 1, 0)[:, None])
+    drawn = trend + np.take_along_axis(resid, pos, axis=1)
+    return np.where(step < n[:, None], drawn, np.nan)
+
+
+def bootstrap_slopes(values: np.ndarray, valid: np.ndarray, n_boot: int, rng, min_stations: int,
+                     block_length: int | None = None, min_years: int = MIN_YEARS) -> np.ndarray:
+    """
+    Sen's slope (per year step, as pymannkendall reports it) of n_boot
+    station-resampled yearly median series of one aggregate; NaN where a
+    resample keeps fewer than min_years years.
+    """
+    S, Y, M = values.shape
+    slopes = np.full(n_boot, np.nan)
+    if S == 0 or Y == 0:
+        return slopes
+
+    batch = max(1, MAX_BATCH_CELLS // (S * M))
+    for start in range(0, n_boot, batch):
+        b = min(batch, n_boot - start)
+        weights = rng.multinomial(S, np.full(S, 1 / S), size=b)      # S stations drawn with replacement
+        series, n = left_align(resampled_series(values, valid, weights, min_stations))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)     # rows without values
+            fit = theil_sen_batch(series, n=n)
+            if block_length:
+                series = block_residuals(series, n, fit, block_length, rng)
+                fit = theil_sen_batch(series, n=n)
+        slopes[start:start + b] = np.where(n >= min_years, fit['slope'], np.nan)
+    return slopes
+
+
+def _bootstrap_job(job: tuple) -> np.ndarray:
+    """Worker: (values, valid, n_boot, seed sequence, min_stations, block_length, min_years)."""
+    values, valid, n_boot, seed, min_stations, block_length, min_years = job
+    return bootstrap_slopes(values, valid, n_boot, np.random.default_rng(seed), min_stations, block_length, min_years)
+
+
+# Aggregates
+
+def aggregate_cells(cube) -> list:
+    """
+    (table name, keys, station rows, month positions) of every aggregate of
+    the country, month and elevation band-month trend tables.
+    """
+    cells = []
+    all_stations = np.ones(len(cube.stations), dtype=bool)
+    all_months = np.arange(len(cube.months))
+
+    codes, countries = cube.codes('country')
+    for g, country in enumerate(countries):
+        cells.append(('country_macro', {'country': country, 'country_abr': get_country_abr(country)},
+                      codes == g, all_months))
+
+    for m, month in enumerate(cube.months):
+        cells.append(('month_macro', {'month': int(month), 'month_name': get_month_name(month)},
+                      all_stations, np.array([m])))
+
+    codes, bands = cube.codes('elevation_band')
+    for m, month in enumerate(cube.months):
+        for g, band in enumerate(bands):
+            cells.append(('elevation_macro', {'month': int(month), 'month_name': get_month_name(month),
+                                              'elevation_band': band},
+                          codes == g, np.array([m])))
+    return cells
+
+
+def bootstrap_ci(cube, n_boot: int = N_BOOT, min_stations: int = 10, block_length: int | None = None,
+                 confidence: float = CONFIDENCE, seed: int = 0, workers: int = 1) -> dict:
+    """
+    Percentile confidence intervals of every aggregated slope; returns
+    table name -> DataFrame of the table's keys plus CI_COLUMNS.
+    """
+    values, valid = np.asarray(cube.values, dtype=float), np.asarray(cube.valid)
+    cells = aggregate_cells(cube)
+    seeds = np.random.SeedSequence(seed).spawn(len(cells))          # one stream per aggregate
+    jobs = [(values[rows][:, :, months], valid[rows][:, :, months], n_boot, cell_seed,
+             min_stations, block_length, MIN_YEARS)
+            for (_, _, rows, months), cell_seed in zip(cells, seeds)]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            draws = list(pool.map(_bootstrap_job, jobs))
+    else:
+        draws = [_bootstrap_job(job) for job in jobs]
+
+    tail = 100 * (1 - confidence) / 2
+    rows = {}
+    for (table, keys, _, _), slopes in zip(cells, draws):
+        ok = slopes[np.isfinite(slopes)]
+        low, high = np.percentile(ok, [tail, 100 - tail]) if ok.size else (np.nan, np.nan)
+        rows.setdefault(table, []).append({**keys,
+                                           'slope_per_year_ci_low': low, 'slope_per_year_ci_high': high,
+                                           'slope_per_decade_ci_low': low * 10, 'slope_per_decade_ci_high': high * 10,
+                                           'n_boot': int(ok.size)})
+    return {table: pd.DataFrame(records) for table, records in rows.items()}
+
+
+def add_bootstrap_ci(tables: dict, cube, **kwargs) -> dict:
+    """tables with the CI columns of bootstrap_ci joined onto each aggregated trend table."""
+    for table, ci in bootstrap_ci(cube, **kwargs).items():
+        keys = [c for c in ci.columns if c not in CI_COLUMNS]
+        base = tables[table].drop(columns=[c for c in CI_COLUMNS if c in tables[table]])
+        tables[table] = base.merge(ci, on=keys, how='left')
+    return tables
@@ -0,0 +1,312 @@
+# 03_Statistical_Testing
+
+# Dense snow cube
+#
+# snow_recordings as a dense station x year x month array with a validity
+# mask (True where the station has a record for that year-month), plus one
+# attribute array per station (country, elevation band, coordinates). The
+# cube is built in one pass - station / year / month positions are looked up
+# and every record scattered into place - and saved as a memory-mapped .npy
+# pair (values, valid) next to a station table and a small JSON header.
+#
+# The aggregated yearly series (median hnsum and station count per group of
+# stations, year and month - or year, over all months) are axis reductions
+# over the cube: stations are grouped by the codes of their attributes and
+# the median of each group is read at group offsets, for every year-month at
+# once, rather than from a groupby pass over the long table.
+#
+# The bootstrap of the aggregated trends (Scripts/bootstrap.py) resamples
+# stations as draws over the cube's station axis. Scripts.trends reuses the
+# saved cube while its header records the SHA-256 of the current
+# snow_recordings.csv, and rebuilds and saves it otherwise.
+#
+#   python -m Scripts.cube          # build Data/Cleaned/.cache/snow_cube.*
+
+import argparse
+import json
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+from Scripts.data_cache import file_sha256
+from Scripts.functions import get_country_abr, get_month_name
+
+# Files
+SNOW_RECORDINGS_PATH = 'Data/Cleaned/snow_recordings.csv'
+CUBE_DIR = 'Data/Cleaned/.cache'
+CUBE_NAME = 'snow_cube'
+
+# Station attribute columns kept in the cube (when present in snow_recordings)
+STATION_ATTRIBUTES = ['country', 'elevation_band', 'longitude', 'latitude']
+
+# Label columns derived from a station attribute or the month axis: column -> (source, label function)
+DERIVED_KEYS = {
+    'country_abr': ('country', get_country_abr),
+    'month_name': ('month', get_month_name),
+}
+
+
+@dataclass
+class SnowCube:
+    """
+    values[s, y, m]: hnsum of station s in years[y], months[m] (NaN if none)
+    valid[s, y, m]: the station has a record for that year-month
+    stations: one row per station (station_id + STATION_ATTRIBUTES), in cube order
+    duplicates: records sharing a cell with another (their median is stored)
+    """
+    values: np.ndarray
+    valid: np.ndarray
+    stations: pd.DataFrame
+    years: np.ndarray
+    months: np.ndarray
+    duplicates: int = 0
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    def codes(self, attribute: str) -> tuple:
+        """(per-station integer codes, labels) of a categorical station attribute; -1 = missing."""
+        return pd.factorize(self.stations[attribute], sort=True)
+
+
+# Build
+
+def _station_coordinates(stations: pd.DataFrame) -> pd.DataFrame:
+    """longitude / latitude from a WKT POINT geometry when the columns are absent."""
+    if {'longitude', 'latitude'} <= set(stations.columns) or 'geometry' not in stations:
+        return stations
+    xy = stations['geometry'].astype(str).str.extract(r'POINT\s*\(\s*(\S+)\s+(\S+)\s*\)').astype(float)
+    return stations.assign(longitude=xy[0].to_numpy(), latitude=xy[1].to_numpy())
+
+
+def build_cube(snow_recordings: pd.DataFrame, dtype=np.float64) -> SnowCube:
+    """Scatter snow_recordings (station_id, year, month, hnsum + station attributes) into a SnowCube."""
+    station_index, station_ids = pd.factorize(snow_recordings['station_id'], sort=True)
+    year = snow_recordings['year'].to_numpy()
+    years = np.arange(year.min(), year.max() + 1) if len(year) else np.array([], dtype=int)
+    months = np.unique(snow_recordings['month'].to_numpy())
+    year_index = year - (years[0] if len(years) else 0)
+    month_index = np.searchsorted(months, snow_recordings['month'].to_numpy())
+
+    shape = (len(station_ids), len(years), len(months))
+    cell = np.ravel_multi_index((station_index, year_index, month_index), shape)
+    hnsum = snow_recordings['hnsum'].to_numpy(dtype=float)
+
+    values = np.full(int(np.prod(shape)), np.nan)
+    valid = np.zeros(values.size, dtype=bool)
+    counts = np.bincount(cell, minlength=values.size)
+    values[cell] = hnsum
+    valid[cell] = True
+
+    duplicated = counts[cell] > 1
+    if duplicated.any():                                # median of the records sharing a cell
+        medians = pd.Series(hnsum[duplicated]).groupby(cell[duplicated]).median()
+        values[medians.index.to_numpy()] = medians.to_numpy()
+
+    # Station attributes (first record of each station)
+    present = [c for c in STATION_ATTRIBUTES + ['geometry'] if c in snow_recordings]
+    first = np.unique(station_index, return_index=True)[1]
+    stations = snow_recordings.iloc[first][present].reset_index(drop=True)
+    stations.insert(0, 'station_id', np.asarray(station_ids))
+    stations = _station_coordinates(stations)
+    stations = stations[['station_id'] + [c for c in STATION_ATTRIBUTES if c in stations]]
+
+    return SnowCube(values.reshape(shape).astype(dtype, copy=False), valid.reshape(shape),
+                    stations, years, months, int(duplicated.sum()))
+
+
+# Storage
+
+def save_cube(cube: SnowCube, directory: Path = REPO_ROOT / CUBE_DIR, name: str = CUBE_NAME,
+              source: Path | None = None) -> Path:
+    """Write <name>.values.npy, <name>.valid.npy, <name>.stations.csv and <name>.json to directory."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    np.save(directory / f'{name}.values.npy', np.ascontiguousarray(cube.values))
+    np.save(directory / f'{name}.valid.npy', np.ascontiguousarray(cube.valid))
+    cube.stations.to_csv(directory / f'{name}.stations.csv', index=False)
+    header = {
+        'years': [int(y) for y in cube.years],
+        'months': [int(m) for m in cube.months],
+        'duplicates': cube.duplicates,
+        'source_sha256': file_sha256(source) if source is not None else None,
+    }
+    header_path = directory / f'{name}.json'
+    header_path.write_text(json.dumps(header, indent=2))
+    return header_path
+
+
+def load_cube(directory: Path = REPO_ROOT / CUBE_DIR, name: str = CUBE_NAME, mmap_mode: str | None = 'r') -> SnowCube:
+    """A saved cube; values / valid are memory-mapped by default."""
+    directory = Path(directory)
+    header = json.loads((directory / f'{name}.json').read_text())
+    return SnowCube(np.load(directory / f'{name}.values.npy', mmap_mode=mmap_mode),
+                    np.load(directory / f'{name}.valid.npy', mmap_mode=mmap_mode),
+                    pd.read_csv(directory / f'{name}.stations.csv'),
+                    np.asarray(header['years']), np.asarray(header['months']),
+                    header['duplicates'])
+
+
+def is_current(directory: Path, source: Path, name: str = CUBE_NAME) -> bool:
+    """True when a saved cube was built from the current contents of `source`."""
+    header_path = Path(directory) / f'{name}.json'
+    if not header_path.exists():
+        return False
+    return json.loads(header_path.read_text()).get('source_sha256') == file_sha256(source)
+
+
+def cached_cube(snow_recordings: pd.DataFrame, source: Path, directory: Path = REPO_ROOT / CUBE_DIR,
+                name: str = CUBE_NAME) -> SnowCube:
+    """The saved cube when it was built from `source`; otherwise built from snow_recordings and saved."""
+    if is_current(directory, source, name):
+        try:
+            return load_cube(directory, name)
+        except (OSError, ValueError):
+            pass                                            # unreadable cube files: rebuild
+    cube = build_cube(snow_recordings)
+    try:
+        save_cube(cube, directory, name, source)
+    except OSError:
+        pass                                                # read-only checkout: build again next time
+    return cube
+
+
+# Reductions
+
+def _group_medians(values: np.ndarray, codes: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Median of the finite values of every (row, group) of a 2-D array whose
+    columns belong to groups `codes` (-1: left out); NaN for groups without a
+    finite value. Columns are gathered group by group, each group's block is
+    sorted along its rows (NaN last) and the middle pair is read at the
+    offsets of its finite count - one sort per group, covering every row.
+    """
+    columns = np.flatnonzero(codes >= 0)
+    columns = columns[np.argsort(codes[columns], kind='stable')]
+    sizes = np.bincount(codes[columns], minlength=n_groups)
+    ends = np.cumsum(sizes)
+    medians = np.full((values.shape[0], n_groups), np.nan)
+
+    for group in np.flatnonzero(sizes):
+        block = np.sort(values[:, columns[ends[group] - sizes[group]:ends[group]]], axis=1)
+        n = np.isfinite(block).sum(axis=1)
+        lo = np.maximum(n - 1, 0) // 2
+        hi = np.minimum(n // 2, block.shape[1] - 1)
+        middle = (np.take_along_axis(block, lo[:, None], axis=1) + np.take_along_axis(block, hi[:, None], axis=1)) / 2
+        medians[:, group] = np.where(n > 0, middle[:, 0], np.nan)
+    return medians
+
+
+def _group_counts(valid: np.ndarray, codes: np.ndarray, n_groups: int) -> np.ndarray:
+    """Sum of `valid` over the stations (axis 0) of every group of `codes` (-1: left out)."""
+    stations = np.flatnonzero(codes >= 0)
+    stations = stations[np.argsort(codes[stations], kind='stable')]
+    sizes = np.bincount(codes[stations], minlength=n_groups)
+    counts = np.zeros((n_groups,) + valid.shape[1:], dtype=np.int64)
+    present = np.flatnonzero(sizes)
+    if present.size:
+        counts[present] = np.add.reduceat(valid[stations], (np.cumsum(sizes) - sizes)[present], axis=0)
+    return counts
+
+
+def group_median(cube: SnowCube, attributes=(), over_months: bool = False) -> tuple:
+    """
+    (median hnsum, station count, labels) per group of stations and year-month
+    - (group, year, month) arrays - or per group and year with over_months,
+    where a station counts once per year. Groups are the combinations of the
+    station attributes' labels (one group of every station without
+    attributes); labels holds one array per attribute, indexed by group.
+    """
+    values, valid = np.asarray(cube.values, dtype=float), np.asarray(cube.valid)
+    n_stations, n_years, n_months = values.shape
+
+    factorized = [cube.codes(attribute) for attribute in attributes]
+    dims = [max(len(uniques), 1) for _, uniques in factorized]
+    codes = np.zeros(n_stations, dtype=np.int64)
+    if factorized:
+        missing = np.logical_or.reduce([attribute_codes < 0 for attribute_codes, _ in factorized])
+        codes = np.ravel_multi_index([np.maximum(attribute_codes, 0) for attribute_codes, _ in factorized], dims)
+        codes[missing] = -1                                         # groupby drops missing keys
+    n_groups = int(np.prod(dims))
+    positions = np.unravel_index(np.arange(n_groups), dims) if factorized else ()
+    labels = [uniques.take(position) if len(uniques) else uniques
+              for (_, uniques), position in zip(factorized, positions)]
+
+    masked = np.where(valid, values, np.nan)
+    if over_months:                                                 # rows: years, columns: station-months
+        rows = masked.transpose(1, 0, 2).reshape(n_years, n_stations * n_months)
+        median = _group_medians(rows, np.repeat(codes, n_months), n_groups).T
+        count = _group_counts(valid.any(axis=2), codes, n_groups)
+    else:                                                           # rows: year-months, columns: stations
+        rows = masked.reshape(n_stations, n_years * n_months).T
+        median = _group_medians(rows, codes, n_groups).T.reshape(n_groups, n_years, n_months)
+        count = _group_counts(valid, codes, n_groups)
+    return median, count, labels
+
+
+def cube_series(cube: SnowCube, keys, min_stations: int) -> pd.DataFrame | None:
+    """
+    Yearly series of one grouping set as axis reductions over the cube, in
+    the layout of Scripts.aggregates.aggregate_series (keys..., year,
+    n_stations, hn_mean; sorted by keys then year, years with fewer than
+    min_stations stations dropped). None when a key is neither 'month', a
+    station attribute of the cube nor a DERIVED_KEYS label of one of the
+    keys, or when records share a cell (the cube holds their median, the
+    long table every record).
+    """
+    keys = list(keys)
+    attributes = [key for key in keys if key != 'month' and key not in DERIVED_KEYS]
+    if (cube.duplicates or any(attribute not in cube.stations for attribute in attributes)
+            or any(DERIVED_KEYS[key][0] not in keys for key in keys if key in DERIVED_KEYS)):
+        return None
+
+    by_month = 'month' in keys
+    median, count, labels = group_median(cube, attributes, over_months=not by_month)
+    grid = np.meshgrid(*[np.arange(size) for size in median.shape], indexing='ij')
+    cells = (count.ravel() >= min_stations) & (count.ravel() > 0)
+    group = grid[0].ravel()[cells]
+
+    frame = pd.DataFrame({attribute: labels[i].take(group) for i, attribute in enumerate(attributes)})
+    if by_month:
+        frame['month'] = cube.months[grid[2].ravel()[cells]]
+    for key in keys:
+        if key in DERIVED_KEYS:
+            source, label = DERIVED_KEYS[key]
+            frame[key] = frame[source].map(label)
+    frame = frame[keys]
+    frame['year'] = cube.years[grid[1].ravel()[cells]]
+    frame['n_stations'] = count.ravel()[cells].astype('int64')
+    frame['hn_mean'] = median.ravel()[cells]
+
+    frame = frame[frame[keys].notna().all(axis=1)]
+    order = np.lexsort([pd.factorize(frame[column], sort=True)[0] for column in reversed(keys + ['year'])])
+    return frame.iloc[order].reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m Scripts.cube',
+                                     description='Build the dense station x year x month snow cube.')
+    parser.add_argument('--input', type=Path, default=REPO_ROOT / SNOW_RECORDINGS_PATH,
+                        help='snow_recordings.csv written by notebook 02')
+    parser.add_argument('--out', type=Path, default=REPO_ROOT / CUBE_DIR,
+                        help='directory the cube files are written to')
+    args = parser.parse_args(argv)
+
+    cube = build_cube(pd.read_csv(args.input))
+    save_cube(cube, args.out, source=args.input)
+    print(f'Snow cube (stations x years x months): {cube.shape} \n'
+          f'Valid cells: {int(cube.valid.sum()):,} of {cube.valid.size:,} \n'
+          f'Records sharing a cell: {cube.duplicates:,} \n'
+          f'Cube Exported To: {args.out}')
+
+
+if __name__ == '__main__':
+    main()
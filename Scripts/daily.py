@@ -0,0 +1,249 @@
+# 01_Data_Cleaning
+
+# Daily -> monthly aggregation
+#
+# The data_daily_*.csv provider files (daily HN new snow and HS snow depth)
+# are reduced to the monthly provider schema (HNsum, HSmean, HSmax, SCD1 ...
+# SCD100) so they can fill gaps in the data_monthly_*.csv series. Files are
+# streamed in chunks; every chunk is reduced to partial sums / counts / maxima
+# per (Name, year, month), and only the station-month still open at the end of
+# a chunk is carried into the next one, so memory depends on the chunk size,
+# not the file size. If a file is not grouped by station, station-months seen
+# in more than one flush are combined in a final pass over the (monthly-sized)
+# partials.
+#
+#   python -m Scripts.daily --workers 5
+
+import argparse
+import calendar
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+from Scripts.ingest import RAW_DIR, CHUNK_ROWS, HNSUM_DECIMALS, read_schema_csv
+from Scripts.metrics import log_spans, stage
+
+# Files
+DAILY_PATTERN = 'data_daily_*.csv'
+MONTHLY_FROM_DAILY_DIR = 'Data/Cleaned/Monthly_From_Daily'
+
+# Daily provider schema (lower-case column name -> dtype)
+DAILY_SCHEMA = {
+    'name': 'string',
+    'date': 'string',
+    'hn': 'float64',
+    'hs': 'float64',
+}
+
+# Snow cover duration thresholds (cm): SCD<t> counts days with HS >= t, SCD1gt days with HS > 1
+SCD_THRESHOLDS = (1, 10, 20, 30, 50, 100)
+
+# Missing days tolerated before a month's HN / HS metrics are left empty
+MAX_MISSING_DAYS = 0
+
+# Output columns, as in the data_monthly_*.csv provider files
+MONTHLY_COLUMNS = (['Name', 'year', 'month', 'HNsum', 'HSmean', 'HSmax', 'SCD1', 'SCD1gt']
+                   + [f'SCD{t}' for t in SCD_THRESHOLDS[1:]])
+
+KEYS = ['name', 'year', 'month']
+
+# Partial state per station-month: column -> combining reduction
+PARTIALS = {
+    'hn_sum': 'sum', 'hn_days': 'sum',
+    'hs_sum': 'sum', 'hs_days': 'sum', 'hs_max': 'max',
+    'scd1gt': 'sum',
+    **{f'scd{t}': 'sum' for t in SCD_THRESHOLDS},
+}
+
+
+def provider_of(path: Path) -> str:
+    """Provider code of a daily file: data_daily_IT_BZ.csv -> IT_BZ"""
+    return path.stem.removeprefix('data_daily_')
+
+
+# Reductions
+
+def reduce_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Partial sums / day counts / maxima per (name, year, month) of one daily chunk."""
+    date = pd.to_datetime(chunk['date'], format='ISO8601')
+    hn, hs = chunk['hn'], chunk['hs']
+    has_hs = hs.notna()
+
+    rows = pd.DataFrame({
+        'name': chunk['name'].to_numpy(),
+        'year': date.dt.year.astype('int16').to_numpy(),
+        'month': date.dt.month.astype('int8').to_numpy(),
+        'hn_sum': hn.fillna(0).to_numpy(),
+        'hn_days': hn.notna().astype('int16').to_numpy(),
+        'hs_sum': hs.fillna(0).to_numpy(),
+        'hs_days': has_hs.astype('int16').to_numpy(),
+        'hs_max': hs.to_numpy(),
+        'scd1gt': (hs > 1).astype('int16').to_numpy(),
+        **{f'scd{t}': (hs >= t).astype('int16').to_numpy() for t in SCD_THRESHOLDS},
+    })
+    rows = rows[rows['name'].notna()]
+    return combine(rows)
+
+
+def combine(partials: pd.DataFrame) -> pd.DataFrame:
+    """Merge partial rows of the same station-month (sums add, maxima max)."""
+    return partials.groupby(KEYS, sort=False, as_index=False).agg(PARTIALS)
+
+
+def finalize(partials: pd.DataFrame, max_missing_days: int = MAX_MISSING_DAYS) -> pd.DataFrame:
+    """Monthly provider-schema metrics from combined partials."""
+    days = np.array([calendar.monthrange(int(y), int(m))[1]
+                     for y, m in zip(partials['year'], partials['month'])], dtype='int16')
+    hn_ok = partials['hn_days'].to_numpy() >= days - max_missing_days
+    hs_ok = partials['hs_days'].to_numpy() >= days - max_missing_days
+
+    monthly = pd.DataFrame({
+        'Name': partials['name'].to_numpy(),
+        'year': partials['year'].to_numpy(),
+        'month': partials['month'].to_numpy(),
+        'HNsum': np.where(hn_ok, partials['hn_sum'], np.nan).round(HNSUM_DECIMALS),
+        'HSmean': np.where(hs_ok, partials['hs_sum'] / partials['hs_days'].clip(lower=1), np.nan).round(HNSUM_DECIMALS),
+        'HSmax': np.where(hs_ok, partials['hs_max'], np.nan),
+        'SCD1': np.where(hs_ok, partials['scd1'], np.nan),
+        'SCD1gt': np.where(hs_ok, partials['scd1gt'], np.nan),
+        **{f'SCD{t}': np.where(hs_ok, partials[f'scd{t}'], np.nan) for t in SCD_THRESHOLDS[1:]},
+    })
+    return monthly[MONTHLY_COLUMNS]
+
+
+# Providers
+
+def aggregate_daily(path: Path, out_path: Path, chunk_rows: int = CHUNK_ROWS,
+                    max_missing_days: int = MAX_MISSING_DAYS) -> dict:
+    """
+    Stream one data_daily_*.csv into a monthly provider-schema CSV. Returns
+    the daily row count, station-month count and whether a merge pass was needed.
+    """
+    rows = 0
+    carry = None                    # station-month still open at the end of the last chunk
+    last_flushed = {}               # name -> last flushed (year, month)
+    regrouped = False
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=out_path.parent) as tmp:
+        part_path = Path(tmp) / f'{path.stem}.part'
+        with open(part_path, 'w', newline='') as part:
+            for chunk in read_schema_csv(path, DAILY_SCHEMA, chunksize=chunk_rows):
+                rows += len(chunk)
+                partials = reduce_chunk(chunk)
+                if carry is not None:
+                    partials = combine(pd.concat([carry, partials], ignore_index=True))
+                if partials.empty:
+                    continue
+
+                # The chunk's last station-month may continue in the next chunk
+                last_name = chunk['name'].dropna().iloc[-1] if chunk['name'].notna().any() else None
+                open_row = np.zeros(len(partials), dtype=bool)
+                if last_name is not None:
+                    last_date = pd.to_datetime(chunk.loc[chunk['name'] == last_name, 'date'].iloc[-1], format='ISO8601')
+                    open_row = ((partials['name'] == last_name) & (partials['year'] == last_date.year)
+                                & (partials['month'] == last_date.month)).to_numpy()
+                carry, flush = partials[open_row], partials[~open_row]
+
+                for name, year, month in zip(flush['name'], flush['year'], flush['month']):
+                    if name in last_flushed and last_flushed[name] >= (year, month):
+                        regrouped = True            # station or month not contiguous in the file
+                    last_flushed[name] = max(last_flushed.get(name, (year, month)), (year, month))
+                flush.to_csv(part, header=False, index=False)
+
+            if carry is not None and len(carry):
+                carry.to_csv(part, header=False, index=False)
+
+        partials = pd.read_csv(part_path, names=KEYS + list(PARTIALS),
+                               dtype={'name': 'string', 'year': 'int16', 'month': 'int8'},
+                               keep_default_na=False, na_values=[''])
+        if regrouped:
+            partials = combine(partials)
+        partials = partials.sort_values(KEYS, kind='stable')
+
+        monthly = finalize(partials, max_missing_days)
+        tmp_out = Path(tmp) / out_path.name
+        monthly.to_csv(tmp_out, index=False)
+        os.replace(tmp_out, out_path)
+
+    return {'file': path.name, 'rows': rows, 'station_months': len(monthly), 'regrouped': regrouped}
+
+
+def _aggregate_job(job: tuple) -> dict:
+    """Worker: (daily file, output file, chunk rows, missing days)."""
+    return aggregate_daily(*job)
+
+
+def fill_gaps(monthly: pd.DataFrame, from_daily: pd.DataFrame, column: str = 'hnsum') -> pd.DataFrame:
+    """
+    Monthly provider rows with `column` completed from daily-derived rows:
+    missing values are filled and station-months absent from `monthly` added.
+    Both frames need name / year / month keys (any header case).
+    """
+    monthly = monthly.rename(columns={c: c.lower() for c in monthly.columns})
+    from_daily = from_daily.rename(columns={c: c.lower() for c in from_daily.columns})[KEYS + [column]]
+
+    merged = monthly.merge(from_daily, on=KEYS, how='outer', suffixes=('', '_daily'), sort=True)
+    merged[column] = merged[column].fillna(merged.pop(f'{column}_daily'))
+    return merged
+
+
+def run(raw_dir: Path = REPO_ROOT / RAW_DIR, out_dir: Path = REPO_ROOT / MONTHLY_FROM_DAILY_DIR,
+        workers: int = 1, chunk_rows: int = CHUNK_ROWS, max_missing_days: int = MAX_MISSING_DAYS) -> list:
+    """Aggregate every daily provider file; returns one report per file."""
+    timings = {}
+    raw_dir, out_dir = Path(raw_dir), Path(out_dir)
+    files = sorted(raw_dir.glob(DAILY_PATTERN))
+    if not files:
+        raise FileNotFoundError(f'No {DAILY_PATTERN} files in {raw_dir}')
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    jobs = [(path, out_dir / f'data_monthly_from_daily_{provider_of(path)}.csv', chunk_rows, max_missing_days)
+            for path in files]
+    with stage(f'daily files ({len(files)} files, {workers} workers)', timings):
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                reports = list(pool.map(_aggregate_job, jobs))
+        else:
+            reports = [_aggregate_job(job) for job in jobs]
+
+    for report in reports:
+        print(f'{report["file"]:<36}{report["rows"]:>12,} days -> {report["station_months"]:>9,} station-months')
+    print(f'\nCSVs Exported To: {out_dir}')
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m Scripts.daily',
+                                     description='Aggregate every data_daily_*.csv to the monthly provider schema.')
+    parser.add_argument('--raw', type=Path, default=REPO_ROOT / RAW_DIR,
+                        help='folder holding the data_daily_*.csv files')
+    parser.add_argument('--out', type=Path, default=REPO_ROOT / MONTHLY_FROM_DAILY_DIR,
+                        help='directory the monthly-from-daily CSVs are written to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='daily files aggregated in parallel (default: all cores)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help='rows per streamed chunk')
+    parser.add_argument('--max-missing-days', type=int, default=MAX_MISSING_DAYS,
+                        help='missing days tolerated before a month is left empty')
+    parser.add_argument('--span-log', type=Path, default=None,
+                        help='append every stage as a JSON line (timing span) to this file')
+    args = parser.parse_args(argv)
+
+    if args.span_log:
+        log_spans(args.span_log)
+
+    run(args.raw, args.out, max(args.workers, 1), max(args.chunk_rows, 1), max(args.max_missing_days, 0))
+
+
+if __name__ == '__main__':
+    main()
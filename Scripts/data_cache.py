@@ -0,0 +1,266 @@
+# Dataset cache
+
+# Columnar sidecars for the project CSVs
+#
+# The first read of a CSV stores the parsed table as an uncompressed Arrow IPC
+# file in a `.cache/` folder next to it. Later reads memory-map that file, so
+# dtypes are fixed by the first parse and nothing is re-parsed: numeric and
+# string columns of the returned frame are zero-copy, read-only views of the
+# mapped file, whose pages every process reading it shares (boolean columns and
+# filtered rows are copies). A sidecar is
+# used only while its recorded source size / mtime (or, when those moved, the
+# source SHA-256) and read_csv options still match; otherwise the CSV is read
+# and the sidecar rebuilt. When only the mtime moved (checkout, touch, LFS
+# smudge) and the hash still matches, the new mtime is recorded in a small key
+# file next to the sidecar, so later reads are back on the size / mtime check.
+# Without pyarrow every read falls back to the CSV.
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from Scripts.metrics import BYTES_READ, CACHE_REQUESTS
+
+CACHE_DIR_NAME = '.cache'
+CACHE_SUFFIX = '.arrow'
+KEY_SUFFIX = '.key'         # source mtime re-validated by hash since the sidecar was written
+CACHE_VERSION = '1'
+
+# Metadata key holding the cache key in the Arrow schema
+META_KEY = b'snowpack_cache'
+
+# Row predicate operators: (column, op, value)
+FILTER_OPS = ('==', '!=', '<', '<=', '>', '>=', 'in', 'not in')
+
+
+# Cache key
+
+def cache_path(csv_path: Path) -> Path:
+    """Sidecar location of a CSV: <dir>/.cache/<name>.arrow"""
+    csv_path = Path(csv_path)
+    return csv_path.parent / CACHE_DIR_NAME / (csv_path.name + CACHE_SUFFIX)
+
+
+def key_path(csv_path: Path) -> Path:
+    """Re-validated mtime of a sidecar's source: <dir>/.cache/<name>.arrow.key"""
+    target = cache_path(csv_path)
+    return target.with_name(target.name + KEY_SUFFIX)
+
+
+def file_sha256(path: Path, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file_obj:
+        for block in iter(lambda: file_obj.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _options_key(read_kwargs: dict) -> str | None:
+    """Stable text form of the read_csv options (None if not serialisable)."""
+    try:
+        return json.dumps(read_kwargs, sort_keys=True)
+    except TypeError:
+        return None
+
+
+def source_key(csv_path: Path, read_kwargs: dict, sha256: str | None = None) -> dict:
+    """Cache key of a CSV: size, mtime, content hash and read options."""
+    stat = os.stat(csv_path)
+    return {
+        'version': CACHE_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': sha256 or file_sha256(csv_path),
+        'options': _options_key(read_kwargs),
+    }
+
+
+def _stored_key(schema) -> dict | None:
+    """Cache key recorded in a sidecar's schema metadata."""
+    metadata = schema.metadata
+    if not metadata or META_KEY not in metadata:
+        return None
+    return json.loads(metadata[META_KEY])
+
+
+def _revalidated(stored: dict, csv_path: Path, stat) -> bool:
+    """True when the key file says the CSV at its current size / mtime hashed to the stored sha256."""
+    try:
+        key = json.loads(key_path(csv_path).read_text())
+    except (OSError, ValueError):
+        return False
+    return (key.get('sha256') == stored.get('sha256') and key.get('size') == stat.st_size
+            and key.get('mtime_ns') == stat.st_mtime_ns)
+
+
+def _record_revalidation(stored: dict, csv_path: Path, stat) -> None:
+    """Remember that the CSV's current mtime hashed to the stored sha256 (best effort, atomic)."""
+    target = key_path(csv_path)
+    tmp = target.with_name(f'{target.name}.{os.getpid()}.tmp')
+    try:
+        tmp.write_text(json.dumps({'sha256': stored.get('sha256'), 'size': stat.st_size,
+                                   'mtime_ns': stat.st_mtime_ns}))
+        os.replace(tmp, target)
+    except OSError:
+        pass                                                # read-only checkout: hash again next time
+
+
+def is_fresh(stored: dict | None, csv_path: Path, read_kwargs: dict) -> bool:
+    """
+    True when a sidecar's key still describes the CSV. Size / mtime are checked
+    first; the content hash is only computed when the mtime moved (e.g. a fresh
+    checkout of identical data), and a match records the new mtime.
+    """
+    if not stored:
+        return False
+    stat = os.stat(csv_path)
+    if (stored.get('version') != CACHE_VERSION
+            or stored.get('options') != _options_key(read_kwargs)
+            or stored.get('size') != stat.st_size):
+        return False
+    if stored.get('mtime_ns') == stat.st_mtime_ns or _revalidated(stored, csv_path, stat):
+        return True
+    if stored.get('sha256') != file_sha256(csv_path):
+        return False
+    _record_revalidation(stored, csv_path, stat)
+    return True
+
+
+# Row predicates
+
+def _check_filters(filters) -> list:
+    filters = list(filters or [])
+    for column, op, _ in filters:
+        if op not in FILTER_OPS:
+            raise ValueError(f'Unsupported filter operator {op!r} for column {column!r}; use one of {FILTER_OPS}')
+    return filters
+
+
+def filter_frame(df: pd.DataFrame, filters) -> pd.DataFrame:
+    """Apply (column, op, value) predicates to a DataFrame (all must hold)."""
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in _check_filters(filters):
+        col = df[column]
+        if op == 'in':
+            mask &= col.isin(value)
+        elif op == 'not in':
+            mask &= ~col.isin(value)
+        else:
+            mask &= {'==': col.eq, '!=': col.ne, '<': col.lt,
+                     '<=': col.le, '>': col.gt, '>=': col.ge}[op](value)
+    return df[mask]
+
+
+def _filter_expression(filters):
+    """The same predicates as a pyarrow compute expression."""
+    import pyarrow.compute as pc
+
+    expression = None
+    for column, op, value in _check_filters(filters):
+        field = pc.field(column)
+        if op in ('in', 'not in'):
+            term = field.isin(list(value))
+            term = ~term if op == 'not in' else term
+        else:
+            term = {'==': field == value, '!=': field != value, '<': field < value,
+                    '<=': field <= value, '>': field > value, '>=': field >= value}[op]
+        expression = term if expression is None else expression & term
+    return expression
+
+
+# Read / write
+
+def write_cache(df: pd.DataFrame, csv_path: Path, key: dict) -> Path:
+    """Write `df` as the CSV's sidecar (atomically, so concurrent readers never see a partial file)."""
+    import pyarrow as pa
+
+    target = cache_path(csv_path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[META_KEY] = json.dumps(key).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    tmp = target.with_name(f'{target.name}.{os.getpid()}.tmp')
+    with pa.OSFile(str(tmp), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, target)
+    return target
+
+
+def read_cache(csv_path: Path, read_kwargs: dict, columns=None, filters=None) -> pd.DataFrame | None:
+    """
+    Memory-mapped read of a fresh sidecar; None when missing or stale. Only
+    the buffers of the projected and filtered columns are counted as read.
+    """
+    import pyarrow as pa
+
+    target = cache_path(csv_path)
+    if not target.exists():
+        return None
+
+    try:
+        source = pa.memory_map(str(target), 'r')
+        reader = pa.ipc.open_file(source)
+        if not is_fresh(_stored_key(reader.schema), csv_path, read_kwargs):
+            return None
+        table = reader.read_all()
+    except (OSError, pa.ArrowInvalid, ValueError):
+        return None                                         # unreadable sidecar: rebuild
+
+    read = list(columns) if columns is not None else table.column_names
+    touched = list(dict.fromkeys(read + [column for column, _, _ in filters or []]))
+    BYTES_READ.inc(table.select(touched).nbytes, source='arrow')
+
+    if filters:
+        table = table.filter(_filter_expression(filters))
+    if columns is not None:
+        table = table.select(read)
+    return table.to_pandas(split_blocks=True, self_destruct=True)        # one block per column: no consolidation copy
+
+
+def read_csv_cached(csv_path: Path, columns=None, filters=None, **read_kwargs) -> pd.DataFrame:
+    """
+    pd.read_csv backed by the Arrow sidecar cache.
+
+    columns: optional column projection (applied after parsing, so the sidecar
+             always holds the full table).
+    filters: optional row predicates, list of (column, op, value) with op in
+             FILTER_OPS, combined with AND.
+    """
+    csv_path = Path(csv_path)
+    _check_filters(filters)
+    cacheable = _options_key(read_kwargs) is not None
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        cacheable = False
+
+    if cacheable:
+        df = read_cache(csv_path, read_kwargs, columns, filters)
+        CACHE_REQUESTS.inc(cache='arrow_sidecar', result='miss' if df is None else 'hit')
+        if df is not None:
+            return df
+
+    # Stale or missing: parse the CSV and rebuild the sidecar
+    sha256 = file_sha256(csv_path) if cacheable else None
+    df = pd.read_csv(csv_path, **read_kwargs)
+    BYTES_READ.inc(os.stat(csv_path).st_size, source='csv')
+    if cacheable:
+        try:
+            write_cache(df, csv_path, source_key(csv_path, read_kwargs, sha256))
+        except (OSError, TypeError, ValueError):
+            pass                                            # read-only checkout / untypable column: serve from CSV
+
+    if filters:
+        df = filter_frame(df, filters).reset_index(drop=True)
+    if columns is not None:
+        df = df[list(columns)]
+    return df
@@ -3,17 +3,121 @@
 
 # 03_Visualisations
 
+# Figure payload
+#
+# Station clouds are drawn as WebGL scatters, heatmap cell labels are the
+# heatmap's own texttemplate, and point layers larger than MAX_POINTS are
+# thinned per group before they are drawn: 1-D layers (violins) keep rows at
+# evenly spaced ranks, so the distribution keeps its shape, quartiles and
+# extremes; 2-D clouds keep one station per occupied cell of a grid over the
+# plot area, so outliers and the cloud outline stay visible. `payload_report`
+# gives the serialized size of a figure.
+
+MAX_POINTS = 2500       # points per figure before decimation (None = keep all)
+
+
+def _budgets(sizes, max_points):
+    """Points kept per group: max_points shared in proportion to group size."""
+    import numpy as np
+
+    sizes = np.asarray(sizes, dtype=float)
+    return np.maximum(np.floor(max_points * sizes / max(sizes.sum(), 1)), 1).astype(int)
+
+
+def decimate(frame, columns, max_points=MAX_POINTS, by=None):
+    """
+    At most ~max_points rows of frame, taken per `by` group: by rank of one
+    column, or one row per occupied grid cell of two columns.
+    """
+    import numpy as np
+
+    columns = [columns] if isinstance(columns, str) else list(columns)
+    if max_points is None or len(frame) <= max_points:
+        return frame
+
+    groups = [g for _, g in frame.groupby(by, sort=False, observed=True)] if by is not None else [frame]
+    kept = []
+    for group, budget in zip(groups, _budgets([len(g) for g in groups], max_points)):
+        group = group.dropna(subset=columns)
+        if len(group) <= budget:
+            kept.append(group)
+        elif len(columns) == 1:
+            ranks = np.unique(np.linspace(0, len(group) - 1, budget).round().astype(int))
+            order = np.argsort(group[columns[0]].to_numpy(), kind='stable')
+            kept.append(group.iloc[np.sort(order[ranks])])
+        else:
+            scaled = [(v - v.min()) / (np.ptp(v) or 1.0) for v in (group[c].to_numpy(dtype=float) for c in columns)]
+
+            def first_per_cell(bins):
+                cells = 0
+                for values in scaled:
+                    cells = cells * bins + np.minimum((values * bins).astype(int), bins - 1)
+                return np.unique(cells, return_index=True)[1]
+
+            # Finest grid that still keeps no more than the budget
+            bins = max(int(np.sqrt(budget)), 1)
+            rows = first_per_cell(bins)
+            while bins < len(group):
+                finer = first_per_cell(int(bins * 1.25) + 1)
+                if len(finer) > budget:
+                    break
+                rows, bins = finer, int(bins * 1.25) + 1
+            kept.append(group.iloc[np.sort(rows)])
+    return frame.loc[np.concatenate([g.index.to_numpy() for g in kept])] if kept else frame.iloc[:0]
+
+
+def decimation_note(shown, total):
+    """Annotation (as a dict) of a figure whose points were thinned; None when all are shown."""
+    if shown < total:
+        return dict(text=f'{shown:,} of {total:,} points shown', showarrow=False,
+                    xref='paper', yref='paper', x=1, y=-0.12, xanchor='right',
+                    font=dict(size=10, color='grey'))
+    return None
+
+
+def _note_decimated(fig, shown, total):
+    """Annotate a figure whose points were thinned."""
+    note = decimation_note(shown, total)
+    if note:
+        fig.add_annotation(**note)
+
+
+def payload_report(fig):
+    """Serialized size (bytes), trace count and plotted points of a figure (or its dict)."""
+    import base64
+    import numpy as np
+    import plotly.io as pio
+
+    def size(values):
+        if isinstance(values, dict) and 'bdata' in values:     # base64 typed array
+            if values.get('shape'):
+                return int(np.prod([int(n) for n in str(values['shape']).split(',')]))
+            return len(base64.b64decode(values['bdata'])) // np.dtype(values['dtype']).itemsize
+        return int(np.size(values))
+
+    data = fig.to_plotly_json() if hasattr(fig, 'to_plotly_json') else fig
+    points = 0
+    for trace in data.get('data', []):
+        for key in ('z', 'y', 'x'):
+            if trace.get(key) is not None:
+                points += size(trace[key])
+                break
+    return {'bytes': len(pio.to_json(data).encode()), 'traces': len(data.get('data', [])), 'points': points}
+
 
 
 # Country_Trends_Figure
 
-def country_trends_fig(per_station,avg_country, show: bool = False):
+def country_trends_fig(per_station,avg_country, show: bool = False, alpha: float = 0.05,
+                       max_points=MAX_POINTS):
     import plotly.graph_objects as go
     import plotly.express as px
     from plotly.subplots import make_subplots   
     import numpy as np
     
     countries = sorted(per_station['country'].unique())
+    total = len(per_station)
+    per_station = decimate(per_station, ['median_slope_theil_per_decade', 'p_combined'], max_points, by='country')
     palette   = px.colors.qualitative.Set1  # pick any qualitative palette you like
     color_map = {c: palette[i % len(palette)] for i, c in enumerate(countries)}
 
@@ -28,9 +132,9 @@ def country_trends_fig(per_station,avg_country, show: bool = False):
         avg = avg_country[avg_country['country'] == c]
         col = color_map[c]
 
-        # Left panel: station points
+        # Left panel: station points (WebGL)
         fig.add_trace(
-            go.Scatter(
+            go.Scattergl(
                 x=psc['median_slope_theil_per_decade'],
                 y=psc['p_combined'],
                 mode="markers",
@@ -78,9 +182,9 @@ def country_trends_fig(per_station,avg_country, show: bool = False):
             row=1, col=2
         )
 
-    # Guides: p=0.05 and zero slope on both subplots
+    # Guides: p=alpha and zero slope on both subplots
     for col in (1, 2):
-        fig.add_hline(y=0.05, line_dash="dash", line_color="red", row=1, col=col)
+        fig.add_hline(y=alpha, line_dash="dash", line_color="red", row=1, col=col)
         fig.add_vline(x=0.0, line_dash="dash", line_color="blue", row=1, col=col)
 
     # Nice defaults
@@ -94,6 +198,7 @@ def country_trends_fig(per_station,avg_country, show: bool = False):
     fig.update_xaxes(title_text="Slope (cm/decade)", row=1, col=1)
     fig.update_xaxes(title_text="Slope (cm/decade)", row=1, col=2)
     fig.update_yaxes(title_text="p-value (two-sided)")
+    _note_decimated(fig, len(per_station), total)
     
     if show:   # optional convenience
         fig.show()
@@ -104,7 +209,7 @@ def country_trends_fig(per_station,avg_country, show: bool = False):
 
 # Month_Trends_Figure
 
-def month_trends_fig(typical_station_month,avg_month, show: bool = False):
+def month_trends_fig(typical_station_month,avg_month, show: bool = False, max_points=MAX_POINTS):
     import plotly.graph_objects as go
     from plotly.subplots import make_subplots
     import pandas as pd
@@ -119,6 +224,8 @@ def month_trends_fig(typical_station_month,avg_month, show: bool = False):
         typical_station_month['month_name'], categories=order, ordered=True)
     avg_month['month_name'] = pd.Categorical(avg_month['month_name'], categories=order, ordered=True)
     months = list(order)
+    total = len(typical_station_month)
+    typical_station_month = decimate(typical_station_month, ['slope_sen_per_decade', 'p'], max_points, by='month_name')
 
     # Consistent coloring
     palette   = px.colors.qualitative.Set2  # pick any qualitative palette you like
@@ -138,9 +245,9 @@ def month_trends_fig(typical_station_month,avg_month, show: bool = False):
         avg = avg_month[avg_month['month_name'] == m]
         col = color_map[m]
 
-        # Left panel: station points
+        # Left panel: station points (WebGL)
         fig.add_trace(
-            go.Scatter(
+            go.Scattergl(
                 x=tsm['slope_sen_per_decade'],
                 y=tsm['p'],
                 mode="markers",
@@ -207,6 +314,7 @@ def month_trends_fig(typical_station_month,avg_month, show: bool = False):
     fig.update_xaxes(title_text="Slope (cm/decade)", row=1, col=1)
     fig.update_xaxes(title_text="Slope (cm/decade)", row=1, col=2)
     fig.update_yaxes(title_text="p-value (two-sided)")
+    _note_decimated(fig, len(typical_station_month), total)
 
     if show:   # optional convenience
         fig.show()
@@ -253,7 +361,8 @@ def country_coverage(avg_country_month, show: bool = False):
 
 
 
-def country_station_slope_distrib(typical_station_month,avg_country_month, show: bool = False):
+def country_station_slope_distrib(typical_station_month,avg_country_month, show: bool = False,
+                                  max_points=MAX_POINTS):
     import plotly.express as px
     import math
     import plotly.graph_objects as go
@@ -268,8 +377,8 @@ def country_station_slope_distrib(typical_station_month,avg_country_month, show:
     # One row per station-month with columns: country, slope_sen_per_decade, p
     station = typical_station_month  # if present
 
-    # Round values for chart
-    station_rounded = station.round(4)
+    # Round values for chart (thinned by rank per country above max_points)
+    station_rounded = decimate(station, 'slope_sen_per_decade', max_points, by='country').round(4)
 
     fig = px.violin(station_rounded, x='country', y='slope_sen_per_decade', color='country',color_discrete_map=color_map,
                     box=True, points='all', hover_data=['p','station_id','month_name'], height=500,
@@ -294,6 +403,7 @@ def country_station_slope_distrib(typical_station_month,avg_country_month, show:
 
     fig.update_layout(title='Distribution of station slopes by country',
                     yaxis_title='Slope (cm/decade)', xaxis_title='')
+    _note_decimated(fig, len(station_rounded), len(station))
     if show:   
         fig.show()
 
@@ -304,7 +414,7 @@ def country_station_slope_distrib(typical_station_month,avg_country_month, show:
 
 
 # Distribution of station slopes by month
-def month_station_slope_distrib(typical_station_month,avg_month, show: bool = False):
+def month_station_slope_distrib(typical_station_month,avg_month, show: bool = False, max_points=MAX_POINTS):
     import plotly.express as px
     import math
     import plotly.graph_objects as go
@@ -327,8 +437,8 @@ def month_station_slope_distrib(typical_station_month,avg_month, show: bool = Fa
     # One row per station-month with columns: country, slope_sen_per_decade, p
     station = typical_station_month  # if present
 
-    # Round values for chart
-    station_rounded = station.round(4)
+    # Round values for chart (thinned by rank per month above max_points)
+    station_rounded = decimate(station, 'slope_theil_per_decade', max_points, by='month_name').round(4)
 
     fig = px.violin(station_rounded, x='month_name', y='slope_theil_per_decade', color='month_name',color_discrete_map=color_map,
                     box=True, points='all', hover_data=['p','station_id','country'], height=500,
@@ -353,6 +463,7 @@ def month_station_slope_distrib(typical_station_month,avg_month, show: bool = Fa
 
     fig.update_layout(title='Distribution of station slopes by month',
                     yaxis_title='Slope (cm/decade)', xaxis_title='')
+    _note_decimated(fig, len(station_rounded), len(station))
     if show:   
         fig.show()
 
@@ -360,17 +471,17 @@ def month_station_slope_distrib(typical_station_month,avg_month, show: bool = Fa
 
 
 def country_month_heat(avg_country_month, typical_country_month, show: bool = False,
-                       annotate_percent: bool = True):
+                       annotate_percent: bool = True, alpha: float = 0.05, months=None):
     import numpy as np
     import pandas as pd
     import plotly.graph_objects as go
 
     # Month order (seasonal)
-    order = ['Nov','Dec','Jan','Feb','Mar','Apr','May']
+    order = list(months) if months is not None else ['Nov','Dec','Jan','Feb','Mar','Apr','May']
 
     # Merge macro p and make a flag for the black dot
     sig = avg_country_month.loc[:, ['country','month_name','p']].copy()
-    sig['sig'] = sig['p'] <= 0.05
+    sig['sig'] = sig['p'] <= alpha
 
     H = typical_country_month.merge(sig, on=['country','month_name'], how='left')
 
@@ -383,7 +494,8 @@ def country_month_heat(avg_country_month, typical_country_month, show: bool = Fa
              .reindex(columns=order))
     
     N = (H.pivot_table(index='country', columns='month_name',
-                       values='num_stations'))
+                       values='num_stations')
+           .reindex(columns=order))                 # same columns as PCT for the customdata stack
 
     # -- Heatmap with custom hover that includes percent_sig
     fig = go.Figure(go.Heatmap(
@@ -415,27 +527,20 @@ def country_month_heat(avg_country_month, typical_country_month, show: bool = Fa
 )
 
 
-    # OPTIONAL: print the percent in each cell (e.g., "42%")
+    # OPTIONAL: print the percent in each cell (e.g., "42%") through the heatmap's
+    # own texttemplate; the font colour contrasts with each cell automatically
     if annotate_percent:
-        for cy in Z.index:
-            for mx in Z.columns:
-                pct = PCT.loc[cy, mx]
-                if pd.notna(pct):
-                    # choose text color against the background: light cells => black, dark => white
-                    zval = Z.loc[cy, mx]
-                    font_color = 'white' if abs(zval) >= 1.5 else 'black'
-                    fig.add_trace(go.Scatter(
-                        x=[mx], y=[cy], mode='text',
-                        text=[f"{pct:.0f}%"],
-                        textfont=dict(color=font_color, size=12),
-                        showlegend=False, hoverinfo='skip'
-                    ))
+        fig.data[0].update(
+            text=PCT.reindex(index=Z.index).map(lambda pct: f"{pct:.0f}%" if pd.notna(pct) else '').to_numpy(),
+            texttemplate='%{text}',
+            textfont=dict(size=12),
+        )
 
     fig.update_layout(
         title=dict(
         text=(
             "Median station Theil–Sen slope by country × month"
-            "<br><sup>Labels show % of station–month series with MK p ≤ 0.05; "
+            f"<br><sup>Labels show % of station–month series with MK p ≤ {alpha:g}; "
             "</sup>"
         ),
         x=0.5, xanchor='center'
@@ -453,13 +558,13 @@ def country_month_heat(avg_country_month, typical_country_month, show: bool = Fa
 
 
 # Elevation Band Heatmap
-def elevation_band_heat(avg_elevation_month, show: bool = False):
+def elevation_band_heat(avg_elevation_month, show: bool = False, alpha: float = 0.05, months=None, bands=None):
     import numpy as np
     import plotly.express as px
     import plotly.graph_objects as go
 
-    month_order = ['Nov','Dec','Jan','Feb','Mar','Apr','May']
-    y_order = ['Low Elevation','Mid Elevation','High Elevation']  # adjust if you prefer a different order
+    month_order = list(months) if months is not None else ['Nov','Dec','Jan','Feb','Mar','Apr','May']
+    y_order = list(bands) if bands is not None else ['Low Elevation','Mid Elevation','High Elevation']  # adjust if you prefer a different order
 
     pivot = (avg_elevation_month
             .pivot_table(index='elevation_band', columns='month_name', values='slope_per_decade')
@@ -498,7 +603,7 @@ def elevation_band_heat(avg_elevation_month, show: bool = False):
         zmin=-np.nanmax(np.abs(Z.values)),
         zmax= np.nanmax(np.abs(Z.values)),
         labels=dict(color='Slope (cm/decade)'),
-        title='Macro Theil–Sen slope by elevation band × month (● = macro p ≤ 0.05)'
+        title=f'Macro Theil–Sen slope by elevation band × month (● = macro p ≤ {alpha:g})'
     )
 
     # ---- attach custom p-values to the HEATMAP and format its hover ----
@@ -518,7 +623,7 @@ def elevation_band_heat(avg_elevation_month, show: bool = False):
     )
 
     # ---- optional: overlay significance dots (and show p to 4 dp) ----
-    sig = avg_elevation_month.query('p <= 0.05')
+    sig = avg_elevation_month[avg_elevation_month['p'] <= alpha]
     fig.add_trace(go.Scatter(
         x=sig['month_name'],
         y=sig['elevation_band'],
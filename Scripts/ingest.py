@@ -0,0 +1,236 @@
+# 01_Data_Cleaning
+
+# Raw data ingestion
+#
+# Python replacement for the provider-by-provider load in 01_Data_Cleaning.sql.
+# Every data_monthly_*.csv is streamed in chunks with an explicit schema (only
+# Name / Year / Month / HNsum are parsed), station names are resolved against
+# meta_all.csv through the station index (Scripts/stations.py: normalised-key
+# hash map, then blocked fuzzy matching), and each provider is written to a
+# narrow part file by its own process. The parts are then appended in file
+# order to monthly_snowpack.csv with serial ids, weather_stations_list.csv
+# keeps the stations that received data and station_match_report.csv lists
+# how every provider name was resolved.
+#
+#   python -m Scripts.ingest --workers 8
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+from Scripts.metrics import log_spans, stage
+from Scripts.stations import StationIndex, summarize_matches
+
+# Files
+RAW_DIR = 'Data/Raw/European Alps Snow Depth Observations Data'
+META_FILE = 'meta_all.csv'
+MONTHLY_PATTERN = 'data_monthly_*.csv'
+CLEANED_DIR = 'Data/Cleaned'
+MONTHLY_SNOWPACK = 'monthly_snowpack.csv'
+WEATHER_STATIONS = 'weather_stations_list.csv'
+MATCH_REPORT = 'station_match_report.csv'
+
+# Explicit schemas (lower-case column name -> dtype); headers are matched case-insensitively
+META_SCHEMA = {
+    'name': 'string',
+    'latitude': 'float64',
+    'longitude': 'float64',
+    'elevation': 'float64',
+    'country': 'string',
+    'provider': 'string',
+}
+MONTHLY_SCHEMA = {
+    'name': 'string',
+    'year': 'int16',
+    'month': 'int8',
+    'hnsum': 'float64',
+}
+
+# monthly_snowpack.hnsum is NUMERIC(5,2) in the SQL schema
+HNSUM_DECIMALS = 2
+
+# Rows per streamed chunk
+CHUNK_ROWS = 200_000
+
+
+# Schema
+
+def _header_map(path: Path, schema: dict) -> dict:
+    """Actual header name of every schema column (case / whitespace-insensitive)."""
+    header = pd.read_csv(path, nrows=0).columns
+    found = {column.strip().lower(): column for column in header}
+    missing = [column for column in schema if column not in found]
+    if missing:
+        raise ValueError(f'{path.name} is missing columns {missing}; found {list(header)}')
+    return {column: found[column] for column in schema}
+
+
+def read_schema_csv(path: Path, schema: dict, **kwargs):
+    """read_csv of only the schema columns, typed and renamed to lower case."""
+    columns = _header_map(path, schema)
+    reader = pd.read_csv(path, usecols=list(columns.values()),
+                         dtype={columns[c]: dtype for c, dtype in schema.items()}, **kwargs)
+    rename = {actual: column for column, actual in columns.items()}
+    if kwargs.get('chunksize'):
+        return (chunk.rename(columns=rename)[list(schema)] for chunk in reader)
+    return reader.rename(columns=rename)[list(schema)]
+
+
+def provider_of(path: Path) -> str:
+    """Provider code of a monthly file: data_monthly_AT_HZB.csv -> AT_HZB"""
+    return path.stem.removeprefix('data_monthly_')
+
+
+# Stations
+
+def load_stations(meta_path: Path) -> pd.DataFrame:
+    """meta_all.csv with serial station ids (1..n in file order, as the SERIAL key)."""
+    stations = read_schema_csv(meta_path, META_SCHEMA)
+    stations.insert(0, 'station_id', np.arange(1, len(stations) + 1, dtype='int32'))
+    return stations
+
+
+# Providers
+
+def ingest_provider(path: Path, index: StationIndex, part_path: Path, chunk_rows: int = CHUNK_ROWS) -> dict:
+    """
+    Stream one provider file into a narrow part CSV (station_id, year, month,
+    hnsum). Rows whose name resolves to no station are dropped.
+    """
+    provider = provider_of(path)
+    rows = matched = 0
+    reports, lookup, station_ids = [], pd.Series(dtype='int32'), set()
+    seen = set()                                                    # every name resolved so far, matched or not
+
+    with open(part_path, 'w', newline='') as part:
+        for chunk in read_schema_csv(path, MONTHLY_SCHEMA, chunksize=chunk_rows):
+            new_names = chunk['name'].dropna().drop_duplicates()
+            new_names = new_names[~new_names.isin(seen)]
+            if len(new_names):                                      # resolve each distinct name once
+                seen.update(new_names.tolist())
+                report = index.resolve(new_names, provider)
+                reports.append(report)
+                lookup = pd.concat([lookup, index.lookup(report)])
+
+            station_id = chunk['name'].map(lookup)
+            ok = station_id.notna().to_numpy()
+            rows += len(chunk)
+            matched += int(ok.sum())
+            station_ids.update(station_id[ok].astype('int32').unique().tolist())
+
+            out = pd.DataFrame({
+                'station_id': station_id[ok].astype('int32'),
+                'year': chunk['year'][ok],
+                'month': chunk['month'][ok],
+                'hnsum': chunk['hnsum'][ok].round(HNSUM_DECIMALS),
+            })
+            out.to_csv(part, header=False, index=False)
+
+    report = pd.concat(reports, ignore_index=True) if reports else index.resolve([], provider)
+    return {'file': path.name, 'rows': rows, 'matched': matched,
+            'report': report, 'station_ids': sorted(station_ids)}
+
+
+def _ingest_job(job: tuple) -> dict:
+    """Worker: (monthly file, meta_all.csv, part file, chunk rows)."""
+    path, meta_path, part_path, chunk_rows = job
+    return ingest_provider(path, StationIndex(load_stations(meta_path)), part_path, chunk_rows)
+
+
+# Unified table
+
+def write_monthly_snowpack(part_paths: list, out_path: Path) -> int:
+    """
+    Append provider parts to monthly_snowpack.csv line by line, prefixing a
+    serial id (rows are copied as text, never re-parsed). Returns the row count.
+    """
+    next_id = 1
+    with open(out_path, 'w', newline='') as out:
+        out.write('id,station_id,year,month,hnsum\n')
+        for part_path in part_paths:
+            with open(part_path, newline='') as part:
+                for line in part:
+                    out.write(f'{next_id},{line}')
+                    next_id += 1
+    return next_id - 1
+
+
+def run(raw_dir: Path = REPO_ROOT / RAW_DIR, out_dir: Path = REPO_ROOT / CLEANED_DIR,
+        workers: int = 1, chunk_rows: int = CHUNK_ROWS) -> list:
+    """Ingest every monthly provider file; returns one report per file."""
+    timings = {}
+    raw_dir, out_dir = Path(raw_dir), Path(out_dir)
+    meta_path = raw_dir / META_FILE
+    files = sorted(raw_dir.glob(MONTHLY_PATTERN))
+    if not files:
+        raise FileNotFoundError(f'No {MONTHLY_PATTERN} files in {raw_dir}')
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=out_dir) as tmp:
+        part_paths = [Path(tmp) / f'{path.stem}.part' for path in files]
+        jobs = [(path, meta_path, part, chunk_rows) for path, part in zip(files, part_paths)]
+
+        with stage(f'providers ({len(files)} files, {workers} workers)', timings):
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                    reports = list(pool.map(_ingest_job, jobs))
+            else:
+                reports = [_ingest_job(job) for job in jobs]
+
+        with stage(MONTHLY_SNOWPACK, timings):
+            tmp_out = Path(tmp) / MONTHLY_SNOWPACK
+            write_monthly_snowpack(part_paths, tmp_out)
+            shutil.move(tmp_out, out_dir / MONTHLY_SNOWPACK)
+
+    # Drop weather_stations records without monthly_snowpack data
+    station_ids = sorted(set().union(*(report['station_ids'] for report in reports)))
+    with stage(WEATHER_STATIONS, timings):
+        stations = load_stations(meta_path)
+        stations[stations['station_id'].isin(station_ids)].to_csv(out_dir / WEATHER_STATIONS, index=False)
+
+    # How every provider name was resolved
+    match_report = pd.concat([report['report'] for report in reports], ignore_index=True)
+    match_report.to_csv(out_dir / MATCH_REPORT, index=False)
+
+    for report in reports:
+        print(f'{report["file"]:<36}{report["matched"]:>10,} of {report["rows"]:>10,} rows matched')
+    print(f'\nStation names resolved per provider: \n{summarize_matches(match_report)} \n\n'
+          f'Number of Weather Stations : {len(station_ids):,} \n'
+          f'CSVs Exported To: {out_dir}')
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m Scripts.ingest',
+                                     description='Load every data_monthly_*.csv into monthly_snowpack.csv.')
+    parser.add_argument('--raw', type=Path, default=REPO_ROOT / RAW_DIR,
+                        help='folder holding meta_all.csv and the data_monthly_*.csv files')
+    parser.add_argument('--out', type=Path, default=REPO_ROOT / CLEANED_DIR,
+                        help='directory the monthly, station and match report CSVs are written to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='provider files ingested in parallel (default: all cores)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help='rows per streamed chunk')
+    parser.add_argument('--span-log', type=Path, default=None,
+                        help='append every stage as a JSON line (timing span) to this file')
+    args = parser.parse_args(argv)
+
+    if args.span_log:
+        log_spans(args.span_log)
+
+    run(args.raw, args.out, max(args.workers, 1), max(args.chunk_rows, 1))
+
+
+if __name__ == '__main__':
+    main()
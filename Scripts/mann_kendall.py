@@ -0,0 +1,276 @@
+# 03_Statistical_Testing
+
+# Batched Mann–Kendall / Hamed–Rao engine
+#
+# Every series is packed into one padded (series × years) array and the test
+# statistics are computed for all series at once. Results follow
+# pymannkendall's original_test / hamed_rao_modification_test.
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from Scripts.theil_sen import theil_sen_batch
+
+# Minimum number of data years require for each Weather Station to be considered for testing
+MIN_YEARS = 30
+
+# If no (extreme minimal) rate of change is identified, weather station not utilised.
+EPS = 1e-12
+
+# Station-month series keys used by notebook 03
+STATION_MONTH_KEYS = ['country', 'country_abr', 'station_id', 'month', 'month_name']
+
+
+# Packing
+
+def pad_series(df, keys, value: str = 'hnsum', order: str = 'year'):
+    """
+    Pack a long table into one padded batch, one row per group of `keys`.
+
+    Within each group rows are sorted by `order`, non-finite values dropped and
+    the remainder left-aligned, so column i holds the i-th valid observation.
+    Returns (groups, Y, X, n): group keys in order of first appearance,
+    values and `order` values padded with NaN, and valid counts per row.
+    """
+    gid = df.groupby(keys, sort=False).ngroup().to_numpy()
+    first = ~pd.Series(gid).duplicated().to_numpy() & (gid >= 0)
+    groups = df.loc[first, keys].reset_index(drop=True)
+    m = len(groups)
+
+    y = pd.to_numeric(df[value], errors='coerce').to_numpy(dtype=float)
+    x = pd.to_numeric(df[order], errors='coerce').to_numpy(dtype=float)
+    ok = np.isfinite(x) & np.isfinite(y) & (gid >= 0)
+    gid, x, y = gid[ok], x[ok], y[ok]
+
+    idx = np.lexsort((x, gid))                      # by group, then year
+    gid, x, y = gid[idx], x[idx], y[idx]
+
+    n = np.bincount(gid, minlength=m)
+    starts = np.concatenate(([0], np.cumsum(n)[:-1]))
+    pos = np.arange(gid.size) - starts[gid]        # position within group
+
+    L = int(n.max()) if m else 0
+    Y = np.full((m, L), np.nan)
+    X = np.full((m, L), np.nan)
+    Y[gid, pos] = y
+    X[gid, pos] = x
+
+    return groups, Y, X, n
+
+
+def _valid(Y, n):
+    """Boolean mask of the left-aligned valid cells of a padded batch."""
+    return np.arange(Y.shape[1]) < np.asarray(n)[:, None]
+
+
+def _runs(vals, rows):
+    """
+    Run starts / ends of equal values in a flattened, row-major sorted batch.
+    A run never crosses a row boundary.
+    """
+    new = np.ones(vals.size, dtype=bool)
+    new[1:] = (vals[1:] != vals[:-1]) | (rows[1:] != rows[:-1])
+    starts = np.flatnonzero(new)
+    ends = np.append(starts[1:], vals.size)
+    return new, starts, ends
+
+
+# Statistics
+
+def mk_score_batch(Y):
+    """Mann–Kendall S for every row of a padded batch (NaN padding ignored)."""
+    s = np.zeros(Y.shape[0])
+    with np.errstate(invalid='ignore'):
+        for k in range(1, Y.shape[1]):
+            s += np.nansum(np.sign(Y[:, k:] - Y[:, :-k]), axis=1)
+    return s
+
+
+def variance_s_batch(Y, n):
+    """Tie-corrected variance of S for every row of a padded batch."""
+    n = np.asarray(n)
+    Ys = np.sort(Y, axis=1)                         # NaN padding sorts last
+    rows, cols = np.nonzero(_valid(Ys, n))
+    _, starts, ends = _runs(Ys[rows, cols], rows)
+
+    t = (ends - starts).astype(float)               # tie group sizes
+    ties = np.bincount(rows[starts], weights=t * (t - 1) * (2 * t + 5), minlength=len(n))
+
+    return (n * (n - 1) * (2 * n + 5) - ties) / 18
+
+
+def rank_batch(Y, n):
+    """Average ranks (as scipy.stats.rankdata) of the valid cells of each row."""
+    n = np.asarray(n)
+    valid = _valid(Y, n)
+    order = np.argsort(np.where(valid, Y, np.inf), axis=1, kind='stable')
+    Ys = np.take_along_axis(Y, order, axis=1)
+
+    rows, cols = np.nonzero(valid)
+    new, starts, ends = _runs(Ys[rows, cols], rows)
+    run = np.cumsum(new) - 1
+    avg = (cols[starts] + 1 + cols[ends - 1] + 1) / 2   # mean of ranks a+1 .. b
+
+    ranks_sorted = np.full(Y.shape, np.nan)
+    ranks_sorted[rows, cols] = avg[run]
+    R = np.full(Y.shape, np.nan)
+    np.put_along_axis(R, order, ranks_sorted, axis=1)
+    return R
+
+
+def acf_batch(R, n):
+    """Autocorrelation of each row for lags 0 .. L-1 (lags ≥ n are NaN)."""
+    n = np.asarray(n)
+    m, L = R.shape
+    valid = _valid(R, n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, R, 0.0).sum(axis=1) / n
+        Yc = np.where(valid, R - mean[:, None], 0.0)
+
+        acov = np.full((m, L), np.nan)
+        for k in range(L):
+            acov[:, k] = (Yc[:, :L - k] * Yc[:, k:]).sum(axis=1) / n
+        acov[~valid] = np.nan
+        return acov / acov[:, :1]
+
+
+def sens_slope_batch(Y, n=None):
+    """Sen's slope per index step for every row of a padded batch."""
+    return theil_sen_batch(Y, n=n)['slope']
+
+
+def z_score_batch(s, var_s):
+    """Standardized MK statistic with continuity correction."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sd = np.sqrt(var_s)
+        z = np.where(s > 0, (s - 1) / sd, (s + 1) / sd)
+    return np.where(s == 0, 0.0, z)
+
+
+def p_value_batch(z, alpha: float = 0.05):
+    """Two-sided p-value, significance flag and trend label for each z."""
+    from scipy.stats import norm
+
+    p = 2 * (1 - norm.cdf(np.abs(z)))
+    h = np.abs(z) > norm.ppf(1 - alpha / 2)
+    trend = np.where((z < 0) & h, 'decreasing',
+                     np.where((z > 0) & h, 'increasing', 'no trend')).astype(object)
+    return p, h, trend
+
+
+def original_test_batch(Y, n, alpha: float = 0.05):
+    """Mann–Kendall original test for every row of a padded batch."""
+    n = np.asarray(n)
+    s = mk_score_batch(Y)
+    var_s = variance_s_batch(Y, n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tau = s / (.5 * n * (n - 1))
+    z = z_score_batch(s, var_s)
+    p, h, trend = p_value_batch(z, alpha)
+    return {'s': s, 'var_s': var_s, 'z': z, 'p': p, 'h': h, 'trend': trend,
+            'tau': tau, 'slope': sens_slope_batch(Y, n)}
+
+
+def hamed_rao_batch(Y, n, alpha: float = 0.05, lag: int | None = None, original: dict | None = None):
+    """
+    Hamed–Rao (1998) modified Mann–Kendall test for every row of a padded batch.
+
+    Ranks of the Sen-detrended series give a batched autocorrelation function;
+    significant lags inflate var(S) by n/n*. `lag` limits the lags considered
+    (None = all, as in pymannkendall). Pass `original` to reuse S / var(S).
+    """
+    from scipy.stats import norm
+
+    n = np.asarray(n)
+    res = original if original is not None else original_test_batch(Y, n, alpha)
+    s, var_s, slope = res['s'], res['var_s'], res['slope']
+    L = Y.shape[1]
+
+    detrend = Y - np.arange(1, L + 1) * slope[:, None]
+    acf = acf_batch(rank_batch(detrend, n), n)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        interval = norm.ppf(1 - alpha / 2) / np.sqrt(n)
+        max_lag = n if lag is None else np.minimum(lag + 1, n)
+
+        sni = np.zeros(len(n))
+        for i in range(1, L):
+            r = acf[:, i]
+            outside = ~((r <= interval) & (r >= -interval))     # NaN counts as outside
+            use = (i < max_lag) & outside
+            sni += np.where(use, (n - i) * (n - i - 1) * (n - i - 2) * r, 0.0)
+
+        n_ns = 1 + (2 / (n * (n - 1) * (n - 2))) * sni
+        var_s_hr = var_s * n_ns
+
+    z = z_score_batch(s, var_s_hr)
+    p, h, trend = p_value_batch(z, alpha)
+    return {'s': s, 'var_s': var_s_hr, 'var_s_original': var_s, 'n_ns': n_ns,
+            'z': z, 'p': p, 'h': h, 'trend': trend, 'tau': res['tau'], 'slope': slope}
+
+
+def mk_test_batch(Y, n, alpha: float = 0.05, lag: int | None = None, fallback: bool = True) -> pd.DataFrame:
+    """
+    Hamed–Rao MK with per-row fallback to the original test where the
+    corrected result is not finite (as mk_monthly_with_theil does). With
+    fallback=False a non-finite correction is kept, as pymannkendall's
+    hamed_rao_modification_test returns it (p NaN, trend 'no trend').
+    """
+    n = np.asarray(n)
+    orig = original_test_batch(Y, n, alpha)
+    hr = hamed_rao_batch(Y, n, alpha, lag, original=orig)
+
+    ok = np.isfinite(hr['p']) & np.isfinite(hr['tau']) & np.isfinite(hr['slope'])
+    if not fallback:
+        ok = np.ones(len(n), dtype=bool)
+    pick = lambda k: np.where(ok, hr[k], orig[k])
+
+    return pd.DataFrame({
+        'variant': np.where(ok, 'hamed_rao', 'original_fallback'),
+        'n': n,
+        's': orig['s'],
+        'var_s': orig['var_s'],
+        'var_s_hr': hr['var_s'],
+        'z': pick('z'),
+        'p': pick('p'),
+        'h': pick('h'),
+        'trend': pick('trend'),
+        'tau': orig['tau'],
+        'slope': orig['slope'],
+    })
+
+
+# Station-Month application
+
+def mk_monthly_with_theil_batch(monthly: pd.DataFrame, keys=STATION_MONTH_KEYS,
+                                min_years: int = MIN_YEARS, eps: float = EPS) -> pd.DataFrame:
+    """
+    Batched equivalent of looping mk_monthly_with_theil over
+    monthly.groupby(keys, sort=False): one row per series, same columns and order.
+    """
+    groups, Y, X, n = pad_series(monthly, keys)
+
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)            # rows without values
+        std = np.nanstd(Y, axis=1)
+    Ys = np.sort(Y, axis=1)
+    distinct = ((Ys[:, 1:] != Ys[:, :-1]) & _valid(Ys[:, 1:], np.maximum(n - 1, 0))).any(axis=1)   # ≥ 2 unique values
+    test = (n >= min_years) & ~(std <= eps) & distinct
+
+    out = pd.DataFrame({'variant': 'skip', 'n_years': n, 'trend': 'insufficient',
+                        'p': np.nan, 'tau': np.nan, 'slope_sen': np.nan, 'slope_theil': np.nan})
+
+    if test.any():
+        Yt, Xt, nt = Y[test], X[test], n[test]
+        width = int(nt.max())
+        res = mk_test_batch(Yt[:, :width], nt)
+        out.loc[test, 'variant'] = res['variant'].to_numpy()
+        out.loc[test, 'trend'] = res['trend'].to_numpy()
+        out.loc[test, 'p'] = res['p'].to_numpy()
+        out.loc[test, 'tau'] = res['tau'].to_numpy()
+        out.loc[test, 'slope_sen'] = res['slope'].to_numpy()
+        out.loc[test, 'slope_theil'] = theil_sen_batch(Yt[:, :width], Xt[:, :width], nt)['slope']   # Theil–Sen per YEAR
+
+    return pd.concat([out, groups], axis=1)
@@ -0,0 +1,351 @@
+# Instrumentation
+
+# Timing spans, counters and histograms
+#
+# One process-wide registry of named metrics, rendered in the Prometheus text
+# exposition format (served at /metrics by app/app.py). `span(name)` times a
+# block, observes it in the snowpack_span_seconds histogram and emits one
+# JSON line on the `snowpack.spans` logger; the pipeline CLIs time each stage
+# as one such span (`stage`) and write those lines to a file with --span-log.
+#
+# Under a pre-fork server every worker keeps its own registry. With
+# SNOWPACK_METRICS_DIR set, each worker writes a snapshot of its registry to
+# <dir>/<pid>-<token>.json (every FLUSH_SECONDS and on each scrape), the
+# token being drawn once per process so a recycled pid never overwrites an
+# earlier worker's totals. render() sums the live snapshots and the retired
+# totals: snapshots of processes that have exited are added to
+# <dir>/retired.json and deleted, under a lock, so counters stay monotonic
+# across worker restarts and the directory holds one file per live worker.
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+span_logger = logging.getLogger('snowpack.spans')
+
+# Histogram upper bounds (seconds), as the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Seconds between snapshot writes in multi-process mode
+FLUSH_SECONDS = 10
+
+# Totals of exited processes, and the lock serialising their retirement, in the snapshot directory
+RETIRED_FILE = 'retired.json'
+LOCK_FILE = 'retired.lock'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _alive(pid: int) -> bool:
+    """True while a process with this pid exists (a recycled pid only delays retiring a snapshot)."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _snapshot_pid(path: Path) -> int | None:
+    """pid of a <pid>-<token>.json snapshot; None for any other file."""
+    pid, _, token = path.stem.partition('-')
+    return int(pid) if pid.isdigit() and token else None
+
+
+def _read_json(path: Path) -> dict | None:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: Path, data) -> None:
+    """Write `data` as JSON to path (atomic replace)."""
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+class Metric:
+    """A named metric with a fixed set of label names; values are kept per label tuple."""
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+
+class Counter(Metric):
+    """Monotonic total."""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self, values: dict):
+        for key, value in values.items():
+            yield f'{self.name}_total{_labels(self.labelnames, key)} {value:g}'
+
+
+class Gauge(Metric):
+    """Last set value (the largest across workers)."""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+    def samples(self, values: dict):
+        for key, value in values.items():
+            yield f'{self.name}{_labels(self.labelnames, key)} {value:g}'
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, with their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self.values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += 1                                  # count (+Inf bucket)
+            state[-1] += value                              # sum
+
+    def samples(self, values: dict):
+        for key, state in values.items():
+            for bound, count in zip(self.buckets, state):
+                yield f'{self.name}_bucket{_labels(self.labelnames, key, [("le", f"{bound:g}")])} {count:g}'
+            yield f'{self.name}_bucket{_labels(self.labelnames, key, [("le", "+Inf")])} {state[-2]:g}'
+            yield f'{self.name}_sum{_labels(self.labelnames, key)} {state[-1]:g}'
+            yield f'{self.name}_count{_labels(self.labelnames, key)} {state[-2]:g}'
+
+
+class Registry:
+    """Metrics by name; get-or-create, so modules can declare the metrics they record."""
+
+    def __init__(self, directory: Path | None = None):
+        self.metrics = {}
+        self.directory = Path(directory) if directory else None
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._snapshot = None                               # (pid, snapshot file name) of this process
+
+    def _get(self, cls, name: str, documentation: str, labelnames, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f'Metric {name} is already registered with another type or labels')
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._get(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._get(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def reset(self) -> None:
+        """Drop every recorded value (e.g. in a freshly forked worker, whose parent reports its own)."""
+        for metric in list(self.metrics.values()):
+            with metric._lock:
+                metric.values.clear()
+
+    # Multi-process snapshots
+
+    def snapshot(self) -> dict:
+        """name -> {joined label values: value} of this process."""
+        snapshot = {}
+        for name, metric in list(self.metrics.items()):
+            with metric._lock:
+                snapshot[name] = {'\x1f'.join(key): value for key, value in metric.values.items()}
+        return snapshot
+
+    def snapshot_path(self) -> Path:
+        """<directory>/<pid>-<token>.json of this process (a new token after a fork)."""
+        if self._snapshot is None or self._snapshot[0] != os.getpid():
+            self._snapshot = (os.getpid(), f'{os.getpid()}-{uuid.uuid4().hex[:12]}.json')
+        return self.directory / self._snapshot[1]
+
+    def flush(self) -> None:
+        """Write this process's snapshot to its snapshot path (atomic replace)."""
+        if self.directory is None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        _write_json(self.snapshot_path(), self.snapshot())
+
+    def start_flushing(self, interval: float = FLUSH_SECONDS) -> None:
+        """Flush on a daemon thread every `interval` seconds (started once per process)."""
+        if self.directory is None or (self._flusher is not None and self._flusher[0] == os.getpid()):
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+        thread = threading.Thread(target=loop, name='metrics-flush', daemon=True)
+        thread.start()
+        self._flusher = (os.getpid(), thread)
+
+    def _add(self, merged: dict, snapshot: dict) -> None:
+        """Add a snapshot into `merged` (name -> {key: value}): counters and histograms sum, gauges keep the largest."""
+        for name, values in snapshot.items():
+            if name not in self.metrics:
+                continue
+            gauge = self.metrics[name].kind == 'gauge'
+            totals = merged.setdefault(name, {})
+            for key, value in values.items():
+                current = totals.get(key)
+                if current is None:
+                    totals[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    totals[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    totals[key] = max(current, value) if gauge else current + value
+
+    def _retire(self, snapshots: list) -> dict:
+        """
+        Add the snapshots of exited processes to the retired totals and delete
+        them; returns the retired totals. The retired file lists the snapshots
+        it holds until they are deleted, so a retirement interrupted between
+        the write and the deletes is finished by the next one, not counted twice.
+        """
+        retired = _read_json(self.directory / RETIRED_FILE) or {'metrics': {}, 'merged': []}
+        merged = [name for name in retired['merged'] if (self.directory / name).exists()]
+        for path in snapshots:
+            if path.name in merged or _alive(_snapshot_pid(path)):
+                continue
+            snapshot = _read_json(path)
+            if snapshot is not None:
+                self._add(retired['metrics'], snapshot)
+                merged.append(path.name)
+        if merged != retired['merged']:
+            retired['merged'] = merged
+            _write_json(self.directory / RETIRED_FILE, retired)
+        for name in merged:
+            (self.directory / name).unlink(missing_ok=True)
+        return retired['metrics']
+
+    def _merged(self) -> dict:
+        """Values per metric: this process, or the retired totals plus every live snapshot in the directory."""
+        if self.directory is None:
+            return {name: dict(metric.values) for name, metric in self.metrics.items()}
+        self.flush()
+        totals = {}
+        with open(self.directory / LOCK_FILE, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshots = [path for path in self.directory.glob('*.json') if _snapshot_pid(path) is not None]
+            self._add(totals, self._retire(snapshots))
+            for path in snapshots:
+                snapshot = _read_json(path) if path.exists() else None
+                if snapshot is not None:
+                    self._add(totals, snapshot)
+        return {name: {tuple(key.split('\x1f')) if key else (): value for key, value in totals.get(name, {}).items()}
+                for name in self.metrics}
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        merged = self._merged()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            lines.extend(metric.samples(merged.get(name, {})))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry(os.getenv('SNOWPACK_METRICS_DIR') or None)
+
+# Metrics recorded by more than one module
+SPAN_SECONDS = REGISTRY.histogram('snowpack_span_seconds', 'Duration of named timing spans', ['span'])
+CACHE_REQUESTS = REGISTRY.counter('snowpack_cache_requests', 'Cache lookups by cache and result (hit / miss)',
+                                  ['cache', 'result'])
+BYTES_READ = REGISTRY.counter('snowpack_bytes_read', 'Bytes of data files read, by source (csv / arrow / artifact)',
+                              ['source'])
+
+
+# Spans
+
+@contextmanager
+def span(name: str, **fields):
+    """
+    Time a block as span `name`. Yields a dict; keys added to it (e.g. rows)
+    are logged with the span, next to `fields`.
+    """
+    record = dict(fields)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        SPAN_SECONDS.observe(seconds, span=name)
+        if span_logger.isEnabledFor(logging.INFO):
+            span_logger.info(json.dumps({
+                'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+                'span': name,
+                'seconds': round(seconds, 6),
+                'pid': os.getpid(),
+                **record,
+            }, default=str))
+
+
+@contextmanager
+def stage(name: str, timings: dict):
+    """Time a pipeline stage (as a span of kind 'stage'), record it in `timings` and report it."""
+    start = time.perf_counter()
+    with span(name, kind='stage'):
+        yield
+    timings[name] = time.perf_counter() - start
+    print(f'{name:<32}{timings[name]:>9.2f} s', flush=True)
+
+
+def log_spans(path: Path) -> logging.Handler:
+    """Append span records of this process to `path` as JSON lines."""
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    span_logger.addHandler(handler)
+    span_logger.setLevel(logging.INFO)
+    span_logger.propagate = False
+    return handler
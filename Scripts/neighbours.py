@@ -0,0 +1,204 @@
+# 03_Statistical_Testing
+
+# Station neighbourhoods
+#
+# The aggregated trends group stations by country or elevation band; snow
+# climate follows geography instead. NeighbourIndex is a KD-tree over the
+# stations' EPSG:3035 (ETRS89 / LAEA Europe) coordinates, in metres, answering
+# radius and k-nearest queries. A radius query returns (station, neighbour,
+# distance) pairs within reach only - never the all-pairs distance matrix -
+# and the pairs of the largest radius asked for are kept, so smaller radii are
+# a filter of them rather than another tree walk.
+#
+# regional_trends reduces those pairs per station and radius (Scripts/segments.py):
+# the neighbourhood's median station slope, the share of significant stations
+# and the Stouffer combination of the stations' p-values. A station is part of
+# its own neighbourhood.
+#
+#   python -m Scripts.neighbours --radius 25 50 100
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+from Scripts.segments import Segments
+
+# Files
+TESTS_DIR = 'Data/Cleaned/Tests'
+PER_STATION_FILE = 'per_station_series.csv'                 # Station slopes & combined p (Scripts.trends)
+STATION_MONTH_FILE = 'station-month-time-series.csv'        # Carries each station's EPSG:3035 geometry
+NEIGHBOURHOOD_FILE = 'station-neighbourhood-trends.csv'
+
+# Neighbourhood radii (km)
+RADII_KM = (25, 50, 100)
+
+
+# Coordinates
+
+def point_xy(geometry: pd.Series) -> tuple:
+    """x / y arrays of WKT POINT strings (NaN where missing or not a point)."""
+    xy = geometry.astype('string').str.extract(r'POINT\s*\(\s*(\S+)\s+(\S+)\s*\)').astype(float)
+    return xy[0].to_numpy(), xy[1].to_numpy()
+
+
+def station_points(stations: pd.DataFrame) -> tuple:
+    """
+    EPSG:3035 x / y (metres) of every row of `stations`: from a 'geometry'
+    WKT column (already EPSG:3035, as in snow_recordings and the Tests tables)
+    or projected from 'longitude' / 'latitude'.
+    """
+    if 'geometry' in stations:
+        return point_xy(stations['geometry'])
+    from Scripts.spatial import project_stations
+
+    return project_stations(stations['longitude'].to_numpy(), stations['latitude'].to_numpy())
+
+
+# Index
+
+class NeighbourIndex:
+    """KD-tree over station coordinates in EPSG:3035 metres; rows are those of the input arrays."""
+
+    def __init__(self, x, y):
+        from scipy.spatial import KDTree
+
+        x, y = np.asarray(x, float), np.asarray(y, float)
+        self.size = len(x)
+        self.rows = np.flatnonzero(np.isfinite(x) & np.isfinite(y))      # stations without a position are left out
+        self.points = np.c_[x[self.rows], y[self.rows]]
+        self.tree = KDTree(self.points)
+        self._pairs = None                                              # (radius, pairs) of the widest query so far
+
+    @classmethod
+    def from_stations(cls, stations: pd.DataFrame) -> 'NeighbourIndex':
+        return cls(*station_points(stations))
+
+    def radius(self, radius_m: float) -> tuple:
+        """
+        (station row, neighbour row, distance m) of every pair of stations at
+        most radius_m apart, self pairs included, sorted by station then distance.
+        """
+        if self._pairs is None or radius_m > self._pairs[0]:
+            found = self.tree.sparse_distance_matrix(self.tree, radius_m, output_type='ndarray')
+            station, neighbour, distance = self.rows[found['i']], self.rows[found['j']], found['v']
+            order = np.lexsort((distance, station))
+            self._pairs = (radius_m, (station[order], neighbour[order], distance[order]))
+
+        station, neighbour, distance = self._pairs[1]
+        if radius_m == self._pairs[0]:
+            return station, neighbour, distance
+        within = distance <= radius_m
+        return station[within], neighbour[within], distance[within]
+
+    def nearest(self, k: int) -> tuple:
+        """(station row, neighbour row, distance m) of every station's k nearest stations, itself included."""
+        k = min(k, len(self.rows))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        distance, found = self.tree.query(self.points, k=k)
+        distance, found = distance.reshape(len(self.rows), k), found.reshape(len(self.rows), k)
+        station = np.repeat(self.rows, k)
+        return station, self.rows[found.ravel()], distance.ravel()
+
+
+# Regional trends
+
+def neighbourhood_summary(stations: pd.DataFrame, station: np.ndarray, neighbour: np.ndarray,
+                          alpha: float = 0.05) -> pd.DataFrame:
+    """One row per station of (station, neighbour) row pairs sorted by station (rows of `stations`)."""
+    pairs = pd.DataFrame({'station': station,
+                          'slope': stations['median_slope_theil_per_decade'].to_numpy(dtype=float)[neighbour],
+                          'p': stations['p_combined'].to_numpy(dtype=float)[neighbour]})
+    by_station = Segments(pairs, ['station'], _sorted=True)
+    rows = by_station.frame
+    return pd.DataFrame({
+        'station': by_station.groups()['station'].to_numpy(),
+        'n_stations': by_station.sizes,
+        'median_station_slope_cm_per_decade': by_station.median('slope'),
+        'mean_station_slope_cm_per_decade': by_station.mean('slope'),
+        'percent_sig_stations': by_station.percent(rows['p'].to_numpy() < alpha, rows['p'].notna()),
+        'p_combined': by_station.stouffer('p', signs='slope'),
+    })
+
+
+def regional_trends(stations: pd.DataFrame, radii_km=RADII_KM, k: int | None = None,
+                    index: NeighbourIndex | None = None) -> pd.DataFrame:
+    """
+    Neighbourhood trend of every station of a per_station_series table with
+    coordinates, at every radius and over its k nearest stations when k is
+    given: station_id, neighbourhood ('25 km', ..., 'k=8'), n_stations,
+    median / mean station slope, percent of stations with p_combined < 0.05
+    and the Stouffer combination of their p_combined (Z signed by slope).
+    Pass the same index across calls to reuse its pairs.
+    """
+    index = index if index is not None else NeighbourIndex.from_stations(stations)
+    queries = [(f'{radius:g} km', index.radius(radius * 1000.)) for radius in sorted(radii_km)]
+    if k:
+        queries.append((f'k={k}', index.nearest(k)))
+
+    tables = []
+    for name, (station, neighbour, _) in queries:
+        summary = neighbourhood_summary(stations, station, neighbour)
+        summary.insert(0, 'neighbourhood', name)
+        summary.insert(0, 'station_id', stations['station_id'].to_numpy()[summary.pop('station').to_numpy()])
+        tables.append(summary)
+
+    columns = ['station_id', 'neighbourhood', 'n_stations', 'median_station_slope_cm_per_decade',
+               'mean_station_slope_cm_per_decade', 'percent_sig_stations', 'p_combined']
+    result = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=columns)
+    return result.sort_values('station_id', kind='stable', ignore_index=True)     # radii ascending, then k
+
+
+def load_station_trends(tests_dir: Path = REPO_ROOT / TESTS_DIR) -> pd.DataFrame:
+    """per_station_series.csv with each station's geometry from the station-month table."""
+    per_station = pd.read_csv(Path(tests_dir) / PER_STATION_FILE)
+    geometry = (pd.read_csv(Path(tests_dir) / STATION_MONTH_FILE, usecols=['station_id', 'geometry'])
+                .drop_duplicates('station_id'))
+    return per_station.merge(geometry, on='station_id', how='left')
+
+
+def main(argv=None):
+    from Scripts.metrics import log_spans, stage
+
+    parser = argparse.ArgumentParser(prog='python -m Scripts.neighbours',
+                                     description='Neighbourhood-median slope and combined significance of every station.')
+    parser.add_argument('--tests', type=Path, default=REPO_ROOT / TESTS_DIR,
+                        help='directory holding per_station_series.csv and station-month-time-series.csv')
+    parser.add_argument('--radius', type=float, nargs='+', default=list(RADII_KM),
+                        help='neighbourhood radii in km (EPSG:3035)')
+    parser.add_argument('--k', type=int, default=None,
+                        help='also summarise every station\'s k nearest stations')
+    parser.add_argument('--out', type=Path, default=None,
+                        help=f'CSV written (default: <tests>/{NEIGHBOURHOOD_FILE})')
+    parser.add_argument('--span-log', type=Path, default=None,
+                        help='append every stage as a JSON line (timing span) to this file')
+    args = parser.parse_args(argv)
+
+    if args.span_log:
+        log_spans(args.span_log)
+
+    timings = {}
+    with stage('load station trends', timings):
+        stations = load_station_trends(args.tests)
+    with stage('neighbour index', timings):
+        index = NeighbourIndex.from_stations(stations)
+    with stage('neighbourhood trends', timings):
+        table = regional_trends(stations, args.radius, args.k, index)
+    out = args.out or args.tests / NEIGHBOURHOOD_FILE
+    with stage('write CSV', timings):
+        table.to_csv(out, index=False)
+
+    print(f'{"total":<32}{sum(timings.values()):>9.2f} s \n'
+          f'Stations indexed: {len(index.rows):,} of {len(stations):,} \n'
+          f'CSV Exported To: {out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+# 04_Visualisation
+
+# Station slope raster
+#
+# Interpolates the per-station Theil–Sen slopes (per_station_series.csv, or one
+# month of station-month-time-series.csv) onto a grid over the Alps perimeter
+# (Data/Artifacts/alps_mask.gpkg, EPSG:3035) by inverse distance weighting:
+# every cell takes the weighted mean of its k nearest stations within
+# max_distance (Scripts.neighbours.NeighbourIndex), weights 1 / distance^power.
+# Cells outside the perimeter, or without a station in reach, are nodata.
+#
+# The grid is processed in BLOCK x BLOCK windows across processes, so memory is
+# one window per worker whatever the resolution: a window outside the
+# perimeter's polygons is skipped, one inside them is filled whole, and the
+# rest test their cell centres against the perimeter's polygons clipped to
+# the window.
+# Windows are written to a tiled GeoTIFF as they arrive, which is then copied
+# to a Cloud-Optimized GeoTIFF with overviews (GDAL's COG driver).
+#
+#   python -m Scripts.raster --resolution 250 --workers 8
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+from Scripts.neighbours import STATION_MONTH_FILE, TESTS_DIR, NeighbourIndex, load_station_trends
+from Scripts.spatial import ALPS_MASK_PATH, MASK_CRS, load_mask
+
+# Files
+SLOPE_RASTER_PATH = 'Data/Artifacts/station_slope_idw.tif'
+
+# Grid & interpolation defaults
+RESOLUTION = 250                # cell size (m, EPSG:3035)
+BLOCK = 512                     # window / COG tile size (cells)
+NEIGHBOURS = 12                 # stations per cell
+MAX_DISTANCE = 50_000           # m; cells without a station this close are nodata
+POWER = 2                       # IDW distance exponent
+NODATA = -9999.0
+
+
+# Grid
+
+def grid_for(bounds, resolution: float) -> tuple:
+    """(x origin, y origin, width, height) of a north-up grid covering bounds, snapped to the resolution."""
+    xmin, ymin, xmax, ymax = bounds
+    x0, y0 = np.floor(xmin / resolution) * resolution, np.ceil(ymax / resolution) * resolution
+    width = int(np.ceil((xmax - x0) / resolution))
+    height = int(np.ceil((y0 - ymin) / resolution))
+    return x0, y0, width, height
+
+
+def blocks(width: int, height: int, block: int = BLOCK) -> list:
+    """(row offset, column offset, height, width) of every window, row-major."""
+    return [(row, col, min(block, height - row), min(block, width - col))
+            for row in range(0, height, block) for col in range(0, width, block)]
+
+
+# Interpolation
+
+def idw(index: NeighbourIndex, values: np.ndarray, x: np.ndarray, y: np.ndarray, k: int = NEIGHBOURS,
+        max_distance: float = MAX_DISTANCE, power: float = POWER) -> np.ndarray:
+    """
+    Inverse distance weighted value at every point from the k nearest indexed
+    stations within max_distance (values aligned to index.rows); a point on a
+    station takes its value, a point without a station in reach is NaN.
+    """
+    k = min(k, len(index.rows))
+    out = np.full(len(x), np.nan)
+    if k == 0 or len(x) == 0:
+        return out
+    distance, found = index.tree.query(np.c_[x, y], k=k, distance_upper_bound=max_distance)
+    distance, found = distance.reshape(len(x), k), found.reshape(len(x), k)
+    reach = np.isfinite(distance)                                       # missing neighbours: inf distance
+    v = np.where(reach, values[np.minimum(found, len(values) - 1)], 0.0)
+
+    with np.errstate(divide='ignore'):
+        w = np.where(reach, 1.0 / distance ** power, 0.0)
+    on_station = reach[:, 0] & (distance[:, 0] == 0)
+    w[on_station] = 0.0
+    w[on_station, 0] = 1.0
+
+    total = w.sum(axis=1)
+    with np.errstate(invalid='ignore'):
+        out[total > 0] = (w * v).sum(axis=1)[total > 0] / total[total > 0]
+    return out
+
+
+# Workers
+
+_STATE = {}
+
+
+def _init_worker(points, values, mask_wkb, x0, y0, resolution, k, max_distance, power):
+    """Worker: rebuild the neighbour index and the prepared perimeter once per process."""
+    import shapely
+
+    mask = shapely.from_wkb(mask_wkb)
+    parts = shapely.get_parts(mask)
+    shapely.prepare(parts)
+    _STATE.update(index=NeighbourIndex(points[:, 0], points[:, 1]), values=values, parts=parts,
+                  tree=shapely.STRtree(parts), grid=(x0, y0, resolution), idw=(k, max_distance, power))
+
+
+def cell_mask(window: tuple) -> np.ndarray | None:
+    """Cells of a window whose centres are inside the perimeter (None: none are)."""
+    import shapely
+
+    row, col, height, width = window
+    x0, y0, resolution = _STATE['grid']
+    left, top = x0 + col * resolution, y0 - row * resolution
+    box = shapely.box(left, top - height * resolution, left + width * resolution, top)
+
+    parts = _STATE['parts'][_STATE['tree'].query(box, predicate='intersects')]
+    if not len(parts):
+        return None
+    if shapely.contains(parts, box).any():
+        return np.ones((height, width), dtype=bool)
+
+    xs = left + (np.arange(width) + 0.5) * resolution
+    ys = top - (np.arange(height) + 0.5) * resolution
+    gx, gy = np.meshgrid(xs, ys)
+    inside = np.zeros((height, width), dtype=bool)
+    for part in shapely.clip_by_rect(parts, *shapely.bounds(box)):     # the dissolved polygons are disjoint
+        shapely.prepare(part)
+        inside |= shapely.contains_xy(part, gx, gy)
+    return inside if inside.any() else None
+
+
+def interpolate_window(window: tuple) -> tuple:
+    """Worker: (window, float32 cells) with NODATA outside the perimeter / out of reach, or None cells if all nodata."""
+    inside = cell_mask(window)
+    if inside is None:
+        return window, None
+    row, col, height, width = window
+    x0, y0, resolution = _STATE['grid']
+    rows, cols = np.nonzero(inside)
+    x = x0 + (col + cols + 0.5) * resolution
+    y = y0 - (row + rows + 0.5) * resolution
+    k, max_distance, power = _STATE['idw']
+    values = idw(_STATE['index'], _STATE['values'], x, y, k, max_distance, power)
+
+    cells = np.full((height, width), NODATA, dtype=np.float32)
+    cells[rows, cols] = np.where(np.isfinite(values), values, NODATA)
+    return window, cells
+
+
+def _windows_in_order(windows: list, initargs: tuple, workers: int):
+    """Interpolated windows, computed across processes with at most a few per worker in flight."""
+    if workers <= 1:
+        _init_worker(*initargs)
+        yield from map(interpolate_window, windows)
+        return
+
+    in_flight = 4 * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+        for start in range(0, len(windows), in_flight):
+            yield from pool.map(interpolate_window, windows[start:start + in_flight])
+
+
+# Output
+
+def station_slopes(tests_dir: Path = REPO_ROOT / TESTS_DIR, month: int | None = None) -> pd.DataFrame:
+    """
+    Stations with geometry and a 'slope' column (cm/decade): each station's
+    median station-month slope, or its slope for one month.
+    """
+    if month is None:
+        stations = load_station_trends(tests_dir)
+        return stations.assign(slope=stations['median_slope_theil_per_decade'])
+    series = pd.read_csv(Path(tests_dir) / STATION_MONTH_FILE,
+                         usecols=['station_id', 'month', 'geometry', 'slope_theil_per_decade'])
+    series = series[series['month'] == month]
+    return series.assign(slope=series['slope_theil_per_decade']).drop_duplicates('station_id')
+
+
+def write_slope_raster(stations: pd.DataFrame, out_path: Path = REPO_ROOT / SLOPE_RASTER_PATH,
+                       mask_path: Path = REPO_ROOT / ALPS_MASK_PATH, resolution: float = RESOLUTION,
+                       k: int = NEIGHBOURS, max_distance: float = MAX_DISTANCE, power: float = POWER,
+                       workers: int = 1, block: int = BLOCK) -> dict:
+    """
+    IDW raster of stations['slope'] over the perimeter, written as a COG;
+    returns the grid size, window count and windows written.
+    """
+    import rasterio
+    import rasterio.shutil
+    import shapely
+    from rasterio.transform import from_origin
+    from rasterio.windows import Window
+
+    stations = stations[np.isfinite(stations['slope'].to_numpy(dtype=float))]
+    index = NeighbourIndex.from_stations(stations)
+    values = stations['slope'].to_numpy(dtype=float)[index.rows]
+
+    mask = load_mask(mask_path)
+    x0, y0, width, height = grid_for(shapely.bounds(mask), resolution)
+    windows = blocks(width, height, block)
+    initargs = (index.points, values, shapely.to_wkb(mask), x0, y0, resolution, k, max_distance, power)
+
+    profile = {'driver': 'GTiff', 'width': width, 'height': height, 'count': 1, 'dtype': 'float32',
+               'crs': f'EPSG:{MASK_CRS}', 'transform': from_origin(x0, y0, resolution, resolution),
+               'nodata': NODATA, 'tiled': True, 'blockxsize': block, 'blockysize': block,
+               'compress': 'deflate', 'predictor': 3, 'sparse_ok': True, 'BIGTIFF': 'IF_SAFER'}
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    staging = out_path.with_suffix('.tmp.tif')
+
+    written = 0
+    with rasterio.open(staging, 'w', **profile) as dataset:
+        dataset.update_tags(units='cm/decade', method=f'IDW power={power:g} k={k} max_distance={max_distance:g} m',
+                            stations=str(len(values)))
+        for (row, col, h, w), cells in _windows_in_order(windows, initargs, workers):
+            if cells is None:
+                continue                                                  # unwritten tiles read as nodata
+            dataset.write(cells, 1, window=Window(col, row, w, h))
+            written += 1
+
+    rasterio.shutil.copy(staging, out_path, driver='COG', COMPRESS='DEFLATE', PREDICTOR='FLOATING_POINT',
+                         BLOCKSIZE=str(block), OVERVIEWS='AUTO', OVERVIEW_RESAMPLING='AVERAGE', BIGTIFF='IF_SAFER')
+    staging.unlink()
+    return {'width': width, 'height': height, 'windows': len(windows), 'written': written, 'stations': len(values)}
+
+
+def main(argv=None):
+    from Scripts.metrics import log_spans, stage
+
+    parser = argparse.ArgumentParser(prog='python -m Scripts.raster',
+                                     description='IDW raster of station slopes over the Alps perimeter (COG).')
+    parser.add_argument('--tests', type=Path, default=REPO_ROOT / TESTS_DIR,
+                        help='directory holding the Scripts.trends CSVs')
+    parser.add_argument('--month', type=int, default=None,
+                        help='interpolate one month\'s station-month slopes (default: station median slope)')
+    parser.add_argument('--mask', type=Path, default=REPO_ROOT / ALPS_MASK_PATH,
+                        help='perimeter to clip to (any CRS; reprojected to EPSG:3035)')
+    parser.add_argument('--out', type=Path, default=REPO_ROOT / SLOPE_RASTER_PATH,
+                        help='Cloud-Optimized GeoTIFF written')
+    parser.add_argument('--resolution', type=float, default=RESOLUTION, help='cell size in metres')
+    parser.add_argument('--k', type=int, default=NEIGHBOURS, help='stations per cell')
+    parser.add_argument('--max-distance', type=float, default=MAX_DISTANCE / 1000,
+                        help='km; cells without a station this close are nodata')
+    parser.add_argument('--power', type=float, default=POWER, help='IDW distance exponent')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes (default: all cores)')
+    parser.add_argument('--block', type=int, default=BLOCK,
+                        help='window / tile size in cells (multiple of 16)')
+    parser.add_argument('--span-log', type=Path, default=None,
+                        help='append every stage as a JSON line (timing span) to this file')
+    args = parser.parse_args(argv)
+
+    if args.span_log:
+        log_spans(args.span_log)
+
+    timings = {}
+    with stage('load station slopes', timings):
+        stations = station_slopes(args.tests, args.month)
+    with stage(f'IDW raster ({args.workers} workers)', timings):
+        grid = write_slope_raster(stations, args.out, args.mask, args.resolution, max(args.k, 1),
+                                  args.max_distance * 1000, args.power, max(args.workers, 1),
+                                  max(args.block // 16 * 16, 16))
+
+    print(f'{"total":<32}{sum(timings.values()):>9.2f} s \n'
+          f'Grid: {grid["width"]:,} x {grid["height"]:,} cells at {args.resolution:g} m '
+          f'({grid["written"]:,} of {grid["windows"]:,} windows inside the perimeter, {grid["stations"]:,} stations) \n'
+          f'COG Exported To: {args.out}')
+
+
+if __name__ == '__main__':
+    main()
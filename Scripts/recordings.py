@@ -0,0 +1,188 @@
+# 03_Statistical_Testing
+
+# Compact snow_recordings
+#
+# snow_recordings.csv (written by notebook 02) repeats every station attribute
+# - name, coordinates, elevation and a WKT geometry string - on each of its
+# station-month rows, and default pandas inference turns the keys into int64
+# and the labels into Python-object columns. This loader reads the file in
+# chunks with an enforced schema instead: int32 / int16 / int8 keys, float32
+# measurements and categoricals for the repeated labels, while the station
+# attributes are kept once per station in a separate table (join them back
+# with `with_stations` where a notebook cell needs them per row).
+#
+#   python -m Scripts.recordings            # memory report, default vs compact
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype, union_categoricals
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+from Scripts.functions import get_country_abr, get_month_name
+
+# Files
+SNOWPACK_RECORDINGS_PATH = 'Data/Cleaned/snow_recordings.csv'
+
+# Per-row columns (name -> dtype); absent columns are skipped
+RECORDING_SCHEMA = {
+    'id': 'int32',
+    'station_id': 'int32',
+    'year': 'int16',
+    'month': 'int8',
+    'hnsum': 'float32',
+    'winter': 'bool',
+    'country': 'category',
+    'provider': 'category',
+    'elevation_band': 'category',
+}
+
+# Per-station columns (name -> dtype), stored once per station_id
+STATION_SCHEMA = {
+    'name': 'string',
+    'latitude': 'float64',
+    'longitude': 'float64',
+    'elevation': 'float32',
+    'geometry': 'string',
+}
+
+# Calendar order of the derived month_name labels
+MONTH_NAMES = CategoricalDtype([get_month_name(m) for m in range(1, 13)], ordered=True)
+
+# Rows per streamed chunk
+CHUNK_ROWS = 500_000
+
+
+# Schema
+
+def _dtypes(header) -> tuple:
+    """read_csv dtypes of the schema columns in a header, and the header's other columns."""
+    dtypes = {}
+    for column in header:
+        if column in RECORDING_SCHEMA:
+            dtypes[column] = RECORDING_SCHEMA[column]
+        elif column in STATION_SCHEMA:
+            dtypes[column] = STATION_SCHEMA[column]
+    extra = [column for column in header if column not in dtypes]
+    return dtypes, extra
+
+
+def _downcast(frame: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """Unscheduled columns: integers / floats to their smallest type, text to categories."""
+    for column in columns:
+        values = frame[column]
+        if pd.api.types.is_integer_dtype(values):
+            frame[column] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values):
+            frame[column] = values.astype('float32')
+        elif not pd.api.types.is_bool_dtype(values):
+            frame[column] = values.astype('category')
+    return frame
+
+
+def _concat(chunks: list) -> pd.DataFrame:
+    """Concatenate chunks, unioning the categories of categorical columns."""
+    if len(chunks) == 1:
+        return chunks[0]
+    categorical = [c for c in chunks[0].columns if isinstance(chunks[0][c].dtype, CategoricalDtype)]
+    unioned = {c: union_categoricals([chunk[c] for chunk in chunks]) for c in categorical}
+    frame = pd.concat([chunk.drop(columns=categorical) for chunk in chunks], ignore_index=True)
+    for column in categorical:
+        frame[column] = unioned[column]
+    return frame[chunks[0].columns]
+
+
+# Loading
+
+def load_compact(path: Path = REPO_ROOT / SNOWPACK_RECORDINGS_PATH, chunk_rows: int = CHUNK_ROWS) -> tuple:
+    """
+    (recordings, stations) from snow_recordings.csv.
+
+    recordings holds one compact row per station-month record plus the
+    country_abr / month_name labels as categoricals; stations holds the
+    station attributes (name, coordinates, elevation, geometry) indexed by
+    station_id.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    dtypes, extra = _dtypes(header)
+    station_columns = [c for c in header if c in STATION_SCHEMA]
+    row_columns = [c for c in header if c not in STATION_SCHEMA]
+
+    row_chunks, station_chunks = [], []
+    for chunk in pd.read_csv(path, dtype=dtypes, chunksize=chunk_rows):
+        if station_columns:
+            station_chunks.append(chunk[['station_id'] + station_columns].drop_duplicates('station_id'))
+        row_chunks.append(_downcast(chunk[row_columns].copy(), extra))
+
+    if not row_chunks:                                      # header only
+        row_chunks = [_downcast(pd.read_csv(path, dtype=dtypes)[row_columns], extra)]
+    recordings = _concat(row_chunks)
+
+    if 'country' in recordings:
+        recordings['country_abr'] = recordings['country'].map(get_country_abr).astype('category')
+    if 'month' in recordings:
+        month = recordings['month'].to_numpy()
+        codes = np.where((month >= 1) & (month <= 12), month - 1, -1)
+        recordings['month_name'] = pd.Categorical.from_codes(codes, dtype=MONTH_NAMES)
+
+    stations = (pd.concat(station_chunks, ignore_index=True).drop_duplicates('station_id')
+                .set_index('station_id').sort_index()) if station_chunks else None
+    return recordings, stations
+
+
+def with_stations(recordings: pd.DataFrame, stations: pd.DataFrame, columns=None) -> pd.DataFrame:
+    """recordings with station attribute columns (default: all but geometry) joined back per row."""
+    columns = list(columns) if columns is not None else [c for c in stations.columns if c != 'geometry']
+    joined = stations[columns].reindex(recordings['station_id'].to_numpy())
+    return recordings.assign(**{c: joined[c].to_numpy() for c in columns})
+
+
+# Memory
+
+def memory_mb(*frames) -> float:
+    """Deep memory footprint of frames, in MB."""
+    return sum(frame.memory_usage(deep=True).sum() for frame in frames if frame is not None) / 1e6
+
+
+def memory_report(path: Path = REPO_ROOT / SNOWPACK_RECORDINGS_PATH) -> pd.DataFrame:
+    """Per-column memory of the default pandas read against the compact representation."""
+    default = pd.read_csv(path)
+    recordings, stations = load_compact(path)
+
+    report = pd.DataFrame({
+        'default_dtype': default.dtypes.astype(str),
+        'default_mb': default.memory_usage(deep=True, index=False) / 1e6,
+    })
+    compact = pd.DataFrame({
+        'compact_dtype': pd.concat([recordings.dtypes, stations.dtypes if stations is not None else pd.Series(dtype=object)]).astype(str),
+        'compact_mb': pd.concat([recordings.memory_usage(deep=True, index=False),
+                                 stations.memory_usage(deep=True, index=False) if stations is not None else pd.Series(dtype=float)]) / 1e6,
+    })
+    report = report.join(compact, how='outer')
+    report.loc['total'] = ['', memory_mb(default), '', memory_mb(recordings, stations)]
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m Scripts.recordings',
+                                     description='Memory footprint of snow_recordings.csv, default vs compact schema.')
+    parser.add_argument('--input', type=Path, default=REPO_ROOT / SNOWPACK_RECORDINGS_PATH,
+                        help='snow_recordings.csv written by notebook 02')
+    args = parser.parse_args(argv)
+
+    report = memory_report(args.input)
+    default_mb, compact_mb = report.loc['total', 'default_mb'], report.loc['total', 'compact_mb']
+    with pd.option_context('display.float_format', '{:,.2f}'.format):
+        print(report)
+    print(f'\nDefault read : {default_mb:,.2f} MB \n'
+          f'Compact read : {compact_mb:,.2f} MB ({default_mb / compact_mb:.1f}x smaller)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+# 03_Statistical_Testing
+
+# Segment reductions
+#
+# The station, country-month and country summaries of notebook 03 are
+# reductions of the tested station–month table over groups of rows. Instead of
+# one groupby pass per table (and a groupby.apply calling Python per station
+# for the Stouffer combination), the table is sorted once by the grouping keys
+# so every group is a contiguous run of rows, [start, stop). Counts and minima
+# are then one ufunc.reduceat over the run offsets; medians and distinct counts
+# sort each column once by (group, value) and read the run positions directly.
+# Coarser levels sharing a key prefix (station -> country) reuse the same order,
+# merging runs rather than re-sorting.
+#
+# Floating-point sums keep the arithmetic of the tables they replace, so the
+# CSVs stay byte-identical, but run over all groups at once. A loop runs over
+# positions within a group, never over groups:
+#   - means follow pandas' compensated (Kahan) group mean. Step k of the
+#     compensated sum is applied to the k-th non-missing value of every
+#     group at once, so the loop has as many steps as the largest group.
+#   - float sums follow ndarray.sum, which the per-group Stouffer combination
+#     used. That is numpy's pairwise summation: eight partial sums per block
+#     of up to 128 values, halved recursively above that. The same tree is
+#     evaluated level by level for every run.
+# ufunc.reduceat would add left to right and differ in the last bits.
+#
+# Missing values follow pandas: counts, means, medians and minima skip NaN.
+
+import numpy as np
+import pandas as pd
+
+
+def _starts(frame: pd.DataFrame, keys: list) -> np.ndarray:
+    """First row of every run of equal `keys` in a frame sorted by them."""
+    change = np.zeros(len(frame), dtype=bool)
+    if len(frame):
+        change[0] = True
+    for key in keys:
+        values = frame[key].to_numpy()
+        change[1:] |= values[1:] != values[:-1]
+    return np.flatnonzero(change)
+
+
+def _pairwise_sums(values: np.ndarray, starts: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """
+    values[starts[i]:starts[i] + sizes[i]].sum() of every run, evaluated as
+    numpy's pairwise summation (0.0 for an empty run): a sequential sum below
+    8 values, 8 interleaved partial sums up to 128, halves (multiples of 8)
+    summed recursively above.
+    """
+    sums = np.zeros(len(starts))
+    last = max(len(values) - 1, 0)
+
+    def take(index):
+        return values[np.minimum(index, last)]
+
+    short = sizes < 8
+    if short.any():
+        start, size = starts[short], sizes[short]
+        total = np.zeros(len(start))
+        for k in range(int(size.max())):
+            total = np.where(k < size, total + take(start + k), total)
+        sums[short] = total
+
+    block = (sizes >= 8) & (sizes <= 128)
+    if block.any():
+        start, size = starts[block], sizes[block]
+        lanes = start[:, None] + np.arange(8)
+        partial = take(lanes)
+        blocks = size // 8
+        for k in range(1, int(blocks.max())):
+            partial = np.where((k < blocks)[:, None], partial + take(lanes + 8 * k), partial)
+        total = ((partial[:, 0] + partial[:, 1]) + (partial[:, 2] + partial[:, 3])) + \
+                ((partial[:, 4] + partial[:, 5]) + (partial[:, 6] + partial[:, 7]))
+        tail, rest = start + 8 * blocks, size % 8
+        for k in range(int(rest.max())):
+            total = np.where(k < rest, total + take(tail + k), total)
+        sums[block] = total
+
+    split = sizes > 128
+    if split.any():
+        start, size = starts[split], sizes[split]
+        half = size // 2 - (size // 2) % 8
+        sums[split] = _pairwise_sums(values, start, half) + _pairwise_sums(values, start + half, size - half)
+    return sums
+
+
+def _compensated_sums(values: np.ndarray, starts: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """
+    Kahan sum of every run values[starts[i]:starts[i] + sizes[i]] (no NaN), step
+    for step as pandas' group sum / mean. Step k adds the k-th value of every
+    run at least k + 1 long: runs are ranked longest first and the values laid
+    out step-major, so each step reads one contiguous slice for a prefix of runs.
+    """
+    order = np.argsort(-sizes, kind='stable')
+    size = sizes[order]
+    step = np.arange(len(values)) - np.repeat(starts, sizes)               # position of every value in its run
+    rank = np.repeat(np.argsort(order), sizes)
+    bounds = np.r_[0, np.cumsum(np.bincount(step, minlength=int(size[0]) if len(size) else 0))]
+    laid_out = np.empty_like(values)
+    laid_out[bounds[step] + rank] = values                              # step k holds runs 0..n_k - 1 in rank order
+    values = laid_out
+    total, compensation = np.zeros(len(size)), np.zeros(len(size))
+    infinite = bool(np.isinf(values).any())
+
+    for k in range(len(bounds) - 1):
+        n = bounds[k + 1] - bounds[k]
+        y = values[bounds[k]:bounds[k + 1]] - compensation[:n]
+        t = total[:n] + y
+        c = (t - total[:n]) - y
+        compensation[:n] = np.where(c != c, 0.0, c) if infinite else c     # an infinite value: no correction
+        total[:n] = t
+
+    sums = np.empty(len(size))
+    sums[order] = total
+    return sums
+
+
+class Segments:
+    """
+    Rows of a frame grouped by `keys` (rows with a missing key are dropped, as
+    groupby does). Groups are in sorted key order; every reduction returns one
+    value per group.
+    """
+
+    def __init__(self, frame: pd.DataFrame, keys: list, order: list | None = None, _sorted: bool = False):
+        self.keys = list(keys)
+        if not _sorted:
+            frame = (frame.dropna(subset=self.keys)
+                     .sort_values(self.keys + list(order or []), kind='stable')
+                     .reset_index(drop=True))
+        self.frame = frame
+        self.starts = _starts(frame, self.keys)
+        self.sizes = np.diff(np.r_[self.starts, len(frame)]).astype(np.int64)
+        self.ids = np.repeat(np.arange(len(self.starts)), self.sizes)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def coarsen(self, keys: list) -> 'Segments':
+        """The same rows grouped by a prefix of `keys` (no re-sort)."""
+        if list(keys) != self.keys[:len(keys)]:
+            raise ValueError(f'{keys} is not a prefix of {self.keys}')
+        return Segments(self.frame, keys, _sorted=True)
+
+    def groups(self) -> pd.DataFrame:
+        """Key values of every group."""
+        return self.frame[self.keys].iloc[self.starts].reset_index(drop=True)
+
+    def values(self, column) -> np.ndarray:
+        return self.frame[column].to_numpy(dtype=float) if isinstance(column, str) else np.asarray(column, dtype=float)
+
+    # Reductions
+
+    def sum(self, values) -> np.ndarray:
+        """
+        Sum per group of a column or row-aligned array (NaN propagates). Counts
+        (bool / integer arrays) are exact in any order and use reduceat; float
+        sums are numpy's pairwise sum of each run (as ndarray.sum of a group).
+        """
+        if not len(self):
+            return np.empty(0)
+        if not isinstance(values, str) and np.asarray(values).dtype.kind in 'biu':
+            return np.add.reduceat(np.asarray(values, dtype=np.int64), self.starts)
+        return _pairwise_sums(self.values(values), self.starts, self.sizes)
+
+    def count(self, column) -> np.ndarray:
+        """Non-missing values per group."""
+        return self.sum(self.frame[column].notna().to_numpy()).astype(np.int64)
+
+    def mean(self, column) -> np.ndarray:
+        """Mean per group skipping NaN, as groupby().mean() (compensated sum in row order)."""
+        if not len(self):
+            return np.empty(0)
+        values = self.values(column)
+        kept = np.flatnonzero(~np.isnan(values))
+        starts = np.searchsorted(kept, self.starts)
+        n = np.diff(np.r_[starts, len(kept)])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(n > 0, _compensated_sums(values[kept], starts, n) / n, np.nan)
+
+    def min(self, column) -> np.ndarray:
+        values = self.values(column)
+        return np.fmin.reduceat(values, self.starts) if len(self) else np.empty(0)
+
+    def max(self, column) -> np.ndarray:
+        values = self.values(column)
+        return np.fmax.reduceat(values, self.starts) if len(self) else np.empty(0)
+
+    def median(self, column) -> np.ndarray:
+        """Median per group: values sorted within groups (NaN last), middle pair read at run offsets."""
+        values = self.values(column)
+        ordered = values[np.lexsort((values, self.ids))]
+        n = self.sum(np.isfinite(values)).astype(np.int64)
+        lo = self.starts + np.maximum(n - 1, 0) // 2
+        hi = self.starts + n // 2
+        return np.where(n > 0, (ordered[lo] + ordered[np.minimum(hi, len(ordered) - 1)]) / 2, np.nan)
+
+    def nunique(self, column) -> np.ndarray:
+        """Distinct non-missing values per group."""
+        values = self.frame[column]
+        codes = pd.factorize(values, use_na_sentinel=True)[0]
+        order = np.lexsort((codes, self.ids))
+        codes, ids = codes[order], self.ids[order]
+        first = np.r_[True, (codes[1:] != codes[:-1]) | (ids[1:] != ids[:-1])] & (codes >= 0)
+        return self.sum(first).astype(np.int64)
+
+    def percent(self, mask, valid=None) -> np.ndarray:
+        """100 x rows where `mask` over rows where `valid` (all rows by default), per group."""
+        mask = np.asarray(mask, dtype=bool)
+        denominator = self.sum(np.asarray(valid, dtype=bool)) if valid is not None else self.sizes
+        return 100 * self.sum(mask) / np.maximum(denominator, 1)
+
+    def stouffer(self, p, signs=None, weights=None) -> np.ndarray:
+        """
+        Weighted Stouffer combination of two-sided p-values per group, as
+        benchmarks.golden.stouffer_p: p outside (0, 1] is ignored, Z-scores take
+        the direction of `signs`, and the combined two-sided p is returned.
+        """
+        from scipy.stats import norm
+
+        p = self.values(p)
+        ok = np.isfinite(p) & (p > 0) & (p <= 1)
+        z = np.where(ok, norm.isf(np.where(ok, p, 1.0) / 2.0), 0.0)
+        if signs is not None:
+            z = np.where(ok, z * np.sign(self.values(signs)), 0.0)
+        w = np.where(ok, self.values(weights), 0.0) if weights is not None else ok.astype(float)
+        n = self.sum(ok)
+
+        # Sum over the valid p-values only, so each group adds the same terms in the same order as stouffer_p
+        kept = np.flatnonzero(ok)
+        starts = np.searchsorted(kept, self.starts)
+        sizes = np.diff(np.r_[starts, len(kept)])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            combined = (_pairwise_sums((w * z)[kept], starts, sizes)
+                        / np.sqrt(_pairwise_sums((w ** 2)[kept], starts, sizes)))
+        return np.where(n > 0, 2 * norm.sf(np.abs(combined)), np.nan)
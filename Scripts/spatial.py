@@ -0,0 +1,135 @@
+# 02_EDA
+
+# Alps perimeter membership
+#
+# Which weather stations fall inside the Alpine Convention perimeter
+# (notebook 02: `gdf_stations.within(mask_geom)`). The dissolved mask is split
+# into its polygons and indexed in an STRtree; stations are reprojected to
+# EPSG:3035 in one vectorized call, points outside the mask's bounding box
+# are rejected up front, and the rest are paired with the polygons whose
+# envelopes hold them and tested with shapely 2's vectorized predicates
+# against the prepared polygons.
+#
+# Results are cached under Data/Artifacts/.cache per mask file hash, one row
+# per station coordinate hash, so re-runs (or runs with added stations) only
+# test coordinates the cache has not seen for that mask.
+
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+from Scripts.data_cache import file_sha256
+
+# Files
+ALPS_MASK_PATH = 'Data/Artifacts/alps_mask.gpkg'        # Dissolved perimeter written by notebook 02
+MEMBERSHIP_CACHE_DIR = 'Data/Artifacts/.cache'
+
+# Coordinate Reference Systems
+STATION_CRS = 4326      # WGS84 longitude / latitude
+MASK_CRS = 3035         # EPSG:3035 (ETRS89 / LAEA Europe)
+
+
+# Mask
+
+def load_mask(mask_path: Path = REPO_ROOT / ALPS_MASK_PATH, layer: str | None = None):
+    """
+    The perimeter as one valid (multi)polygon in EPSG:3035, dissolved as in
+    notebook 02 (works for alps_geo.json and alps_mask.gpkg alike).
+    """
+    import geopandas as gpd
+    import shapely
+
+    mask = gpd.read_file(mask_path, layer=layer) if layer else gpd.read_file(mask_path)
+    mask = mask.set_crs(MASK_CRS) if mask.crs is None else mask.to_crs(MASK_CRS)
+    return shapely.union_all(mask.geometry.values).buffer(0)
+
+
+class PerimeterIndex:
+    """STRtree over the mask's polygons, with a bounding-box prefilter."""
+
+    def __init__(self, mask_geom):
+        import shapely
+
+        self.mask = mask_geom
+        self.parts = shapely.get_parts(mask_geom)
+        shapely.prepare(self.parts)
+        self.tree = shapely.STRtree(self.parts)
+        self.bounds = shapely.bounds(mask_geom)
+
+    def within(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Boolean per point: strictly within the mask (boundary points are outside)."""
+        import shapely
+
+        x, y = np.asarray(x, float), np.asarray(y, float)
+        inside = np.zeros(x.shape, dtype=bool)
+        xmin, ymin, xmax, ymax = self.bounds
+        candidates = np.flatnonzero((x > xmin) & (x < xmax) & (y > ymin) & (y < ymax))
+        if candidates.size:
+            points = shapely.points(x[candidates], y[candidates])
+            point_idx, part_idx = self.tree.query(points)               # envelope hits only
+            hit = shapely.contains(self.parts[part_idx], points[point_idx])   # prepared: within == contains
+            inside[candidates[point_idx[hit]]] = True
+        return inside
+
+
+def project_stations(longitude, latitude) -> tuple:
+    """Station longitude / latitude (EPSG:4326) -> EPSG:3035 x / y."""
+    from pyproj import Transformer
+
+    transformer = Transformer.from_crs(STATION_CRS, MASK_CRS, always_xy=True)
+    return transformer.transform(np.asarray(longitude, float), np.asarray(latitude, float))
+
+
+# Cache
+
+def coordinate_hashes(stations: pd.DataFrame) -> np.ndarray:
+    """uint64 hash of every station's (longitude, latitude)."""
+    return pd.util.hash_pandas_object(stations[['longitude', 'latitude']].astype(float), index=False).to_numpy()
+
+
+def membership_cache_path(mask_hash: str, cache_dir: Path = REPO_ROOT / MEMBERSHIP_CACHE_DIR) -> Path:
+    return Path(cache_dir) / f'alps_membership.{mask_hash[:16]}.csv'
+
+
+def stations_in_perimeter(stations: pd.DataFrame, mask_path: Path = REPO_ROOT / ALPS_MASK_PATH,
+                          cache_dir: Path | None = REPO_ROOT / MEMBERSHIP_CACHE_DIR) -> pd.Series:
+    """
+    Inside-the-Alps flag for every row of `stations` (needs 'longitude' and
+    'latitude'), aligned to its index. With a cache_dir, flags are reused for
+    coordinates already tested against the same mask file.
+    """
+    keys = coordinate_hashes(stations)
+    mask_hash = file_sha256(mask_path)
+
+    cached = pd.Series(dtype=bool)
+    cache_path = membership_cache_path(mask_hash, cache_dir) if cache_dir is not None else None
+    if cache_path is not None and cache_path.exists():
+        table = pd.read_csv(cache_path, dtype={'coordinate_hash': 'uint64', 'inside': bool})
+        cached = pd.Series(table['inside'].to_numpy(), index=table['coordinate_hash'].to_numpy())
+
+    known = pd.Index(cached.index).get_indexer(keys) >= 0 if len(cached) else np.zeros(len(keys), dtype=bool)
+    inside = np.zeros(len(keys), dtype=bool)
+    inside[known] = cached.loc[keys[known]].to_numpy()
+
+    if not known.all():
+        todo = np.flatnonzero(~known)
+        x, y = project_stations(stations['longitude'].to_numpy()[todo], stations['latitude'].to_numpy()[todo])
+        inside[todo] = PerimeterIndex(load_mask(mask_path)).within(x, y)
+
+        if cache_path is not None:
+            table = pd.DataFrame({'coordinate_hash': np.concatenate([cached.index.to_numpy(dtype=np.uint64), keys[todo]]),
+                                  'inside': np.concatenate([cached.to_numpy(dtype=bool), inside[todo]])})
+            table = table.drop_duplicates('coordinate_hash')
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cache_path.with_suffix('.tmp')
+            table.to_csv(tmp, index=False)
+            os.replace(tmp, cache_path)
+
+    return pd.Series(inside, index=stations.index, name='in_alps')
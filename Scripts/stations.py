@@ -0,0 +1,160 @@
+# 01_Data_Cleaning
+
+# Station name resolution
+#
+# Provider files name their stations; meta_all.csv assigns the ids. Names are
+# reduced to a normalised key (accents, case, punctuation, whitespace and any
+# leading provider code removed) and looked up in a hash map, first within the
+# file's provider and then across providers. Names still unmatched are
+# compared only with stations of the same provider that share character
+# trigrams with them (blocked fuzzy matching), never with every station.
+
+import unicodedata
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+import pandas as pd
+
+# Trigram blocking: candidates compared per unmatched name
+MAX_CANDIDATES = 25
+
+# Fuzzy matches need this similarity, and this lead over the runner-up
+FUZZY_MIN_SCORE = 0.85
+FUZZY_MIN_MARGIN = 0.02
+
+# Resolution methods, in order of preference
+METHODS = ('exact', 'exact_other_provider', 'fuzzy', 'unmatched')
+
+
+# Keys
+
+def _tokens(text: str) -> list:
+    """Accent-free, case-folded alphanumeric tokens."""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    return ''.join(ch if ch.isalnum() else ' ' for ch in text).split()
+
+
+def provider_prefixes(provider: str | None) -> list:
+    """Token prefixes a provider may put in front of names: AT_HZB -> [at hzb], [hzb]"""
+    tokens = _tokens(provider or '')
+    return [tokens, tokens[1:]] if len(tokens) > 1 else ([tokens] if tokens else [])
+
+
+def normalize_key(name, provider: str | None = None) -> str:
+    """Normalised station key: 'Sankt Mořitz ' / 'HZB_sankt moritz' -> 'sankt moritz'"""
+    if name is None or (isinstance(name, float) and name != name):
+        return ''
+    tokens = _tokens(name)
+    for prefix in provider_prefixes(provider):
+        if prefix and len(tokens) > len(prefix) and tokens[:len(prefix)] == prefix:
+            tokens = tokens[len(prefix):]
+            break
+    return ' '.join(tokens)
+
+
+def trigrams(key: str) -> set:
+    """Character trigrams of a padded key."""
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _provider_code(provider) -> str:
+    return '_'.join(_tokens(provider or '')).upper()
+
+
+# Index
+
+class StationIndex:
+    """
+    Name -> station_id resolution over meta_all.csv stations.
+
+    stations needs 'station_id', 'name' and 'provider' columns.
+    """
+
+    def __init__(self, stations: pd.DataFrame):
+        self.stations = stations[['station_id', 'name', 'provider']].reset_index(drop=True)
+        self.exact = {}                                 # (provider, key) -> row
+        self.any_provider = defaultdict(list)           # key -> rows
+        self.blocks = defaultdict(lambda: defaultdict(set))   # provider -> trigram -> rows
+        self.keys = []
+        self._blocks_all = None
+
+        for row, (name, provider) in enumerate(zip(self.stations['name'], self.stations['provider'])):
+            code = _provider_code(provider)
+            key = normalize_key(name, provider)
+            self.keys.append(key)
+            self.exact.setdefault((code, key), row)                 # first listed wins
+            self.any_provider[key].append(row)
+            for gram in trigrams(key):
+                self.blocks[code][gram].add(row)
+
+    def _fuzzy(self, key: str, code: str) -> tuple:
+        """Best (row, score) among stations of the block sharing trigrams with key."""
+        block = self.blocks.get(code) or self.blocks_all()
+        shared = Counter()
+        for gram in trigrams(key):
+            shared.update(block.get(gram, ()))
+        if not shared:
+            return None, 0.0
+
+        scores = sorted(((SequenceMatcher(None, key, self.keys[row]).ratio(), -row)
+                         for row, _ in shared.most_common(MAX_CANDIDATES)), reverse=True)
+        best, runner_up = scores[0], (scores[1][0] if len(scores) > 1 else 0.0)
+        if best[0] >= FUZZY_MIN_SCORE and best[0] - runner_up >= FUZZY_MIN_MARGIN:
+            return -best[1], best[0]
+        return None, best[0]
+
+    def blocks_all(self) -> dict:
+        """Trigram block over every provider (for files whose provider is not in meta_all.csv)."""
+        if self._blocks_all is None:
+            merged = defaultdict(set)
+            for block in self.blocks.values():
+                for gram, rows in block.items():
+                    merged[gram] |= rows
+            self._blocks_all = merged
+        return self._blocks_all
+
+    def resolve_one(self, name, provider: str | None = None) -> dict:
+        """Resolve one provider name; returns station_id, method, score and matched name."""
+        code = _provider_code(provider)
+        key = normalize_key(name, provider)
+        row, method, score = None, 'unmatched', 0.0
+
+        if key:
+            if (code, key) in self.exact:
+                row, method, score = self.exact[(code, key)], 'exact', 1.0
+            elif len(self.any_provider.get(key, ())) == 1:
+                row, method, score = self.any_provider[key][0], 'exact_other_provider', 1.0
+            else:
+                row, score = self._fuzzy(key, code)
+                method = 'fuzzy' if row is not None else 'unmatched'
+
+        return {
+            'name': name,
+            'provider': provider,
+            'station_id': self.stations.at[row, 'station_id'] if row is not None else pd.NA,
+            'method': method,
+            'score': round(score, 4),
+            'matched_name': self.stations.at[row, 'name'] if row is not None else pd.NA,
+        }
+
+    def resolve(self, names, provider: str | None = None) -> pd.DataFrame:
+        """Match report for the distinct names of one provider file."""
+        distinct = pd.Series(names).dropna().drop_duplicates()
+        report = pd.DataFrame([self.resolve_one(name, provider) for name in distinct],
+                              columns=['name', 'provider', 'station_id', 'method', 'score', 'matched_name'])
+        report['station_id'] = report['station_id'].astype('Int32')
+        return report
+
+    def lookup(self, report: pd.DataFrame) -> pd.Series:
+        """Name -> station_id of the resolved names of a match report."""
+        resolved = report.dropna(subset=['station_id'])
+        return pd.Series(resolved['station_id'].astype('int32').to_numpy(), index=resolved['name'].to_numpy())
+
+
+def summarize_matches(report: pd.DataFrame) -> pd.DataFrame:
+    """Names per provider and resolution method."""
+    return (report.groupby(['provider', 'method']).size()
+            .unstack(fill_value=0)
+            .reindex(columns=list(METHODS), fill_value=0))
@@ -0,0 +1,326 @@
+# 03_Statistical_Testing
+
+# Batched Theil–Sen slope estimator
+#
+# The median of the n(n-1)/2 pairwise slopes is found by selection instead of
+# materialising every slope. For a threshold t, the number of slopes ≤ t equals
+# the number of inversions of z = y - t·x along the x order, which a batched
+# merge count gives in O(n log n) per series. Randomly sampled slopes narrow
+# the interval holding the target rank; the few slopes left inside it are then
+# enumerated exactly. Results match scipy.stats.theilslopes.
+
+import warnings
+
+import numpy as np
+
+# Random pair samples per series and narrowing round (× series length),
+# grown up to MAX_SAMPLE_FACTOR as the interval narrows
+SAMPLE_FACTOR = 2
+MAX_SAMPLE_FACTOR = 8
+
+# Stop narrowing once at most CANDIDATE_FACTOR × n slopes remain in the interval
+CANDIDATE_FACTOR = 1
+
+# Narrowing rounds before the exact enumeration step
+MAX_ROUNDS = 16
+
+# Widest lo-order window enumerated exactly; wider rows use the pairwise path
+MAX_WINDOW = 128
+
+# Series longer than this use the selection path under method='auto';
+# below it materialising every slope is cheaper in NumPy
+PAIRWISE_MAX_LEN = 512
+
+# Number of series per block for the pairwise (n²) path
+CHUNK_SERIES = 256
+
+
+# Preparation
+
+def _valid(Y, n):
+    """Boolean mask of the left-aligned valid cells of a padded batch."""
+    return np.arange(Y.shape[1]) < np.asarray(n)[:, None]
+
+
+def _tie_term(V, n):
+    """Σ t(t-1)(2t+5) over tie groups of the valid cells of each row."""
+    Vs = np.sort(np.where(_valid(V, n), V, np.inf), axis=1)
+    rows, cols = np.nonzero(_valid(Vs, n))
+    vals = Vs[rows, cols]
+    new = np.ones(vals.size, dtype=bool)
+    new[1:] = (vals[1:] != vals[:-1]) | (rows[1:] != rows[:-1])
+    starts = np.flatnonzero(new)
+    t = np.diff(np.append(starts, vals.size)).astype(float)
+    return np.bincount(rows[starts], weights=t * (t - 1) * (2 * t + 5), minlength=len(n)), \
+        np.bincount(rows[starts], weights=t * (t - 1) / 2, minlength=len(n))
+
+
+def _prepare(Y, X, n):
+    """Sort the valid cells of each row by (x ascending, y descending); padding last."""
+    valid = _valid(Y, n)
+    order = np.lexsort((np.where(valid, -Y, np.inf), np.where(valid, X, np.inf)), axis=1)
+    Ys = np.take_along_axis(np.where(valid, Y, np.nan), order, axis=1)
+    Xs = np.take_along_axis(np.where(valid, X, np.nan), order, axis=1)
+    return Ys, Xs
+
+
+# Counting slopes ≤ t
+
+def _inversions(r):
+    """Inversions of each row of a batch of permutations (bottom-up merge count)."""
+    m, L = r.shape
+    size = 1 << max(L - 1, 0).bit_length()
+    a = np.concatenate([r, np.broadcast_to(np.arange(L, size), (m, size - L))], axis=1)
+
+    inv = np.zeros(m, dtype=np.int64)
+    side = np.concatenate([np.zeros(1, dtype=np.int64), np.ones(1, dtype=np.int64)])
+    w = 1
+    while w < size:
+        # tag each value with its half (0 = left, 1 = right) and merge by sorting
+        pairs = (a.reshape(-1, 2, w) * 2 + side[:, None]).reshape(-1, 2 * w)
+        pairs.sort(axis=1)
+        from_left = (pairs & 1) == 0
+        left_before = np.cumsum(from_left, axis=1) - from_left
+        # each right element is inverted with every left element not yet merged
+        inv += np.where(from_left, 0, w - left_before).reshape(m, -1).sum(axis=1)
+        a = (pairs >> 1).reshape(m, size)
+        w *= 2
+    return inv
+
+
+def _z_rank(Ys, Xs, valid, t):
+    """
+    Rank of z = y - t·x per cell; equal z rank the later position first so
+    that ties count as slope ≤ t. Padding ranks last.
+    """
+    z = np.where(valid, Ys - t[:, None] * Xs, np.inf)
+    order = np.argsort(z[:, ::-1], axis=1, kind='stable')
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.broadcast_to(np.arange(z.shape[1]), z.shape), axis=1)
+    return rank[:, ::-1]
+
+
+def _count_le(Ys, Xs, valid, t, offset):
+    """Number of pairwise slopes ≤ t in each row."""
+    return _inversions(_z_rank(Ys, Xs, valid, t)) - offset
+
+
+# Exact order statistics
+
+def _kth_pairwise(Ys, Xs, ks, chunk: int = CHUNK_SERIES):
+    """
+    Order statistics ks (m × T) of the pairwise slopes of each row by
+    materialising and sorting every slope. Out-of-range ranks give NaN.
+    """
+    m, L = Ys.shape
+    i, j = np.triu_indices(L, 1)
+    out = np.full(ks.shape, np.nan)
+    if not i.size:
+        return out
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for a in range(0, m, chunk):
+            Yb, Xb, kb = Ys[a:a + chunk], Xs[a:a + chunk], ks[a:a + chunk]
+            dx = Xb[:, j] - Xb[:, i]
+            slopes = np.where(dx > 0, (Yb[:, j] - Yb[:, i]) / dx, np.inf)
+            slopes.sort(axis=1)
+            vals = np.take_along_axis(slopes, np.clip(kb, 0, i.size - 1), axis=1)
+            out[a:a + chunk] = np.where((kb >= 0) & np.isfinite(vals), vals, np.nan)
+    return out
+
+
+def _kth_select(Ys, Xs, n, klo, khi, N, offset, rng):
+    """
+    Order statistics klo and khi (klo ≤ khi, usually equal or adjacent) of the
+    pairwise slopes of each row by randomized selection. Returns (m × 2).
+    """
+    m, L = Ys.shape
+    valid = _valid(Ys, n)
+    out = np.full((m, 2), np.nan)
+    live = (N > 0) & (klo >= 0) & (khi < N)
+    if not live.any():
+        return out
+
+    # Bracket: every slope lies strictly inside (-B, B)
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        ymax = np.nanmax(np.abs(Ys), axis=1)
+        xmax = np.nanmax(np.abs(Xs), axis=1)
+        span = np.nanmax(Ys, axis=1) - np.nanmin(Ys, axis=1)
+        gaps = np.diff(Xs, axis=1)
+        gap = np.nanmin(np.where(gaps > 0, gaps, np.nan), axis=1)
+        B = np.where(np.isfinite(span / gap), span / gap, 0.0) * 2 + 1
+    lo, hi = -B, B.copy()
+    clo, chi = np.zeros(m, dtype=np.int64), N.astype(np.int64)
+    moving = np.ones(m, dtype=bool)                                # rows still narrowing
+
+    # Narrow (lo, hi] around ranks klo .. khi: C(lo) ≤ klo and C(hi) > khi
+    for _ in range(MAX_ROUNDS):
+        act = np.flatnonzero(live & moving & (chi - clo > CANDIDATE_FACTOR * n))
+        if not act.size:
+            break
+        na = n[act][:, None]
+        lo_a, hi_a, clo_a, chi_a = lo[act], hi[act], clo[act], chi[act]
+
+        # Random pairs; keep the slopes inside the current interval. The sample
+        # grows as the interval narrows so that enough of it lands inside.
+        grow = min(float(np.max(N[act] / (chi_a - clo_a))), MAX_SAMPLE_FACTOR / SAMPLE_FACTOR)
+        S = int(SAMPLE_FACTOR * L * grow)
+        a = rng.integers(0, na, size=(act.size, S))
+        b = rng.integers(0, na - 1, size=(act.size, S))
+        b = b + (b >= a)
+        a, b = np.minimum(a, b), np.maximum(a, b)
+        r = act[:, None]
+        dx = Xs[r, b] - Xs[r, a]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            s = (Ys[r, b] - Ys[r, a]) / dx
+        inside = (dx > 0) & (s > lo_a[:, None]) & (s < hi_a[:, None])
+        s = np.sort(np.where(inside, s, np.inf), axis=1)
+        cnt = inside.sum(axis=1)
+
+        # Pivots just below rank klo and just above rank khi
+        half = np.ceil(np.sqrt(cnt)) + 1                           # ~2σ of the sample rank
+        i1 = np.floor((klo[act] - clo_a + 0.5) / (chi_a - clo_a) * cnt - half).astype(np.int64)
+        i2 = np.ceil((khi[act] - clo_a + 0.5) / (chi_a - clo_a) * cnt + half).astype(np.int64)
+        t1 = np.where(i1 >= 0, np.take_along_axis(s, np.clip(i1, 0, S - 1)[:, None], axis=1)[:, 0], lo_a)
+        t2 = np.where(i2 < cnt, np.take_along_axis(s, np.clip(i2, 0, S - 1)[:, None], axis=1)[:, 0], hi_a)
+
+        # Too few samples inside: bisect instead
+        mid = lo_a + (hi_a - lo_a) / 2
+        sparse = cnt < 8
+        t1 = np.where(sparse, mid, t1)
+        t2 = np.where(sparse, mid, t2)
+
+        # Nudge pivots off exact slope values, by at least the rounding
+        # resolution of z = y - t·x, so that z-counting is unambiguous
+        width = hi_a - lo_a
+        res = 1e-13 * (ymax[act] + xmax[act] * np.maximum(np.abs(t1), np.abs(t2))) / gap[act]
+        t1 = np.clip(t1 - np.maximum(width * 1e-9 * rng.random(act.size), res), lo_a, hi_a)
+        t2 = np.clip(t2 + np.maximum(width * 1e-9 * rng.random(act.size), res), lo_a, hi_a)
+
+        for t in (t1, t2):
+            c = _count_le(Ys[act], Xs[act], valid[act], t, offset[act])
+            up = c <= klo[act]
+            down = c > khi[act]
+            lo_a, clo_a = np.where(up & (t > lo_a), t, lo_a), np.where(up & (t > lo_a), c, clo_a)
+            hi_a, chi_a = np.where(down & (t < hi_a), t, hi_a), np.where(down & (t < hi_a), c, chi_a)
+
+        # Tied slopes stop the interval shrinking; so does float resolution
+        moving[act] = (chi_a - clo_a < chi[act] - clo[act]) & (hi_a - lo_a > 4 * res)
+        lo[act], hi[act], clo[act], chi[act] = lo_a, hi_a, clo_a, chi_a
+
+    # Exact step: slopes in (lo, hi] are the pairs whose z order flips between
+    # lo and hi. A flipped pair sits at most 2 × max displacement apart in lo order.
+    rows = np.flatnonzero(live)
+    rlo = _z_rank(Ys[rows], Xs[rows], valid[rows], lo[rows])
+    rhi = _z_rank(Ys[rows], Xs[rows], valid[rows], hi[rows])
+    W = 2 * np.where(valid[rows], np.abs(rlo - rhi), 0).max(axis=1, initial=0)
+
+    fits = W <= MAX_WINDOW
+    if fits.any():
+        fr = rows[fits]
+        elem = np.argsort(rlo[fits], axis=1)                     # x-position at each lo rank
+        Yl = np.take_along_axis(Ys[fr], elem, axis=1)
+        Xl = np.take_along_axis(Xs[fr], elem, axis=1)
+        lo_f, hi_f, n_f = lo[fr, None], hi[fr, None], n[fr, None]
+
+        # Slopes of pairs d apart in lo order; (y_q - y_p) / (x_q - x_p) is the
+        # same float whichever of the two comes first in x
+        cand_row, cand_val = [], []
+        for d in range(1, min(max(int(W[fits].max()), 1), L - 1) + 1):
+            dx = Xl[:, d:] - Xl[:, :-d]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                s = (Yl[:, d:] - Yl[:, :-d]) / dx
+            keep = (dx != 0) & (s > lo_f) & (s <= hi_f) & (np.arange(d, L) < n_f)
+            rr, _ = np.nonzero(keep)
+            cand_row.append(rr)
+            cand_val.append(s[keep])
+        cand_row = np.concatenate(cand_row) if cand_row else np.zeros(0, dtype=np.int64)
+        cand_val = np.concatenate(cand_val) if cand_val else np.zeros(0)
+
+        # Sort candidates within each row and read ranks klo, khi off the offsets
+        o = np.lexsort((cand_val, cand_row))
+        cand_row, cand_val = cand_row[o], cand_val[o]
+        found = np.bincount(cand_row, minlength=fr.size)
+        first = np.concatenate(([0], np.cumsum(found)[:-1]))
+
+        kk = np.stack([klo[fr], khi[fr]], axis=1) - clo[fr, None]
+        exact = (found == chi[fr] - clo[fr]) & (kk[:, 0] >= 0) & (kk[:, 1] < found)
+        if cand_val.size:
+            pick = cand_val[np.clip(first[:, None] + kk, 0, cand_val.size - 1)]
+            out[fr[exact]] = pick[exact]
+        fits[fits] = exact
+
+    # Anything ambiguous or too wide falls back to the pairwise path
+    rest = rows[~fits]
+    if rest.size:
+        out[rest] = _kth_pairwise(Ys[rest], Xs[rest], np.stack([klo[rest], khi[rest]], axis=1))
+    return out
+
+
+# Estimator
+
+def theil_sen_batch(Y, X=None, n=None, alpha: float = 0.95, method: str = 'auto', seed: int = 0) -> dict:
+    """
+    Theil–Sen slope, intercept and confidence bounds for every row of a padded batch.
+
+    Y (and X) are left-aligned with NaN padding as built by
+    mann_kendall.pad_series; X=None uses index positions (Sen's slope per step).
+    Returns arrays slope, intercept, low_slope, high_slope as
+    scipy.stats.theilslopes(y, x, alpha) would per row.
+    method: 'select' (O(n log n) selection), 'pairwise' (all slopes) or 'auto'.
+    """
+    from scipy.stats import norm
+
+    Y = np.asarray(Y, dtype=float)
+    m, L = Y.shape
+    X = np.broadcast_to(np.arange(L, dtype=float), (m, L)) if X is None else np.asarray(X, dtype=float)
+    n = np.isfinite(Y).sum(axis=1) if n is None else np.asarray(n)
+    Ys, Xs = _prepare(Y, X, n)
+
+    # Number of slopes (pairs with dx > 0) and Sen (1968) variance
+    ty, _ = _tie_term(Ys, n)
+    tx, xpairs = _tie_term(Xs, n)
+    nt = (n * (n - 1) // 2 - xpairs).astype(np.int64)
+
+    if alpha > 0.5:
+        alpha = 1. - alpha
+    z = norm.ppf(alpha / 2.)
+    with np.errstate(invalid='ignore'):
+        sigsq = 1/18. * (n * (n - 1) * (2 * n + 5) - tx - ty)
+        sigma = np.sqrt(sigsq)
+        ru = np.round((nt - z * sigma) / 2.)
+        rl = np.round((nt + z * sigma) / 2.)
+    ci_ok = np.isfinite(sigma) & (nt > 0)
+    Ru = np.where(ci_ok, np.minimum(np.nan_to_num(ru).astype(np.int64), nt - 1), -1)
+    Rl = np.where(ci_ok, np.maximum(np.nan_to_num(rl).astype(np.int64) - 1, 0), -1)
+    k1, k2 = (nt - 1) // 2, nt // 2                                 # middle slope(s)
+
+    if method == 'auto':
+        method = 'pairwise' if L <= PAIRWISE_MAX_LEN else 'select'
+    if method == 'pairwise':
+        vals = _kth_pairwise(Ys, Xs, np.stack([k1, k2, Rl, Ru], axis=1))
+        med, low, high = vals[:, :2], vals[:, 2], vals[:, 3]
+    else:
+        # Median pair and each bound are separate targets on stacked rows
+        _, xties = _tie_term(Xs, n)
+        pad = L - n
+        offset = (xties + pad * (pad - 1) // 2).astype(np.int64)
+        vals = _kth_select(np.tile(Ys, (3, 1)), np.tile(Xs, (3, 1)), np.tile(n, 3),
+                           np.concatenate([k1, Rl, Ru]), np.concatenate([k2, Rl, Ru]),
+                           np.tile(nt, 3), np.tile(offset, 3), np.random.default_rng(seed))
+        med, low, high = vals[:m], vals[m:2 * m, 0], vals[2 * m:, 0]
+
+    slope = np.where(nt > 0, (med[:, 0] + med[:, 1]) / 2, np.nan)
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)            # rows without values
+        intercept = np.nanmedian(Ys, axis=1) - slope * np.nanmedian(Xs, axis=1)
+
+    return {'slope': slope, 'intercept': intercept, 'low_slope': low, 'high_slope': high}
+
+
+def theil_slopes(y, x=None, alpha: float = 0.95, method: str = 'auto'):
+    """Single-series convenience wrapper: (slope, intercept, low_slope, high_slope)."""
+    y = np.asarray(y, dtype=float)[None, :]
+    x = None if x is None else np.asarray(x, dtype=float)[None, :]
+    res = theil_sen_batch(y, x, alpha=alpha, method=method)
+    return tuple(float(res[k][0]) for k in ('slope', 'intercept', 'low_slope', 'high_slope'))
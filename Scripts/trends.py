@@ -0,0 +1,335 @@
+# 03_Statistical_Testing
+
+# Trend pipeline
+#
+# Command-line equivalent of notebook 03: rebuilds the Data/Cleaned/Tests CSVs
+# read by app/app.py. The station–month Mann–Kendall / Theil–Sen stage is
+# sharded by station across a process pool; shards are contiguous and results
+# are concatenated in input order, so the output does not depend on --workers.
+# Per-series results are kept in a store keyed by a hash of each series'
+# (year, hnsum) values and the test parameters; a rerun only re-tests series
+# whose data changed and rebuilds every summary from the stored rows.
+#
+#   python -m Scripts.trends --workers 32
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+from Scripts.aggregates import GROUPING_SETS, MIN_STATIONS_PER_YEAR, aggregate_series, aggregate_trends
+from Scripts.bootstrap import add_bootstrap_ci
+from Scripts.cube import cached_cube
+from Scripts.data_cache import CACHE_DIR_NAME
+from Scripts.functions import get_month_name, get_country_abr
+from Scripts.metrics import log_spans, stage
+from Scripts.segments import Segments
+from Scripts.mann_kendall import EPS, MIN_YEARS, STATION_MONTH_KEYS, mk_monthly_with_theil_batch
+
+# Files
+SNOW_RECORDINGS_PATH = 'Data/Cleaned/snow_recordings.csv'
+TESTS_DIR = 'Data/Cleaned/Tests'
+RESULT_STORE_PATH = 'Data/Cleaned/Tests/.cache/station_month_results.feather'   # Per-series results of the last run
+
+# Bump when the per-series test changes, so every stored result is re-tested
+STORE_VERSION = 1
+
+# Artifacts written to TESTS_DIR (table name -> file name)
+OUTPUTS = {
+    'station_month': 'station-month-time-series.csv',
+    'country_month': 'station-month-time-series-by-country-month.csv',
+    'country_overall': 'station-month-time-series-by-country.csv',
+    'per_station': 'per_station_series.csv',
+    'country_month_macro': 'med_country_month_trends.csv',
+    'country_macro': 'med_country_trends.csv',
+    'month_macro': 'med_month_trends.csv',
+    'elevation_macro': 'med_elevation_month_trends.csv',
+}
+
+# Stations per work unit of the station–month stage
+CHUNK_STATIONS = 64
+
+
+# Inputs
+
+def load_snow_recordings(path: Path) -> pd.DataFrame:
+    """Read snow_recordings.csv and add the month_name / country_abr labels."""
+    snow_recordings = pd.read_csv(path)
+    snow_recordings['month_name'] = snow_recordings['month'].apply(get_month_name)
+    snow_recordings['country_abr'] = snow_recordings['country'].apply(get_country_abr)
+    return snow_recordings
+
+
+def station_month_series(snow_recordings: pd.DataFrame) -> pd.DataFrame:
+    """Median snowpack per station, year and month (one row per series point)."""
+    return (snow_recordings
+            .groupby(['country', 'country_abr', 'station_id', 'year', 'month', 'month_name'], as_index=False)
+            .agg(hnsum=('hnsum', 'median')))
+
+
+# Station–month testing
+
+def _test_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Worker: batched MK / Theil–Sen on one contiguous block of stations."""
+    return mk_monthly_with_theil_batch(chunk)
+
+
+def shard_by_station(monthly: pd.DataFrame, chunk_stations: int = CHUNK_STATIONS) -> list:
+    """Split `monthly` into contiguous row blocks holding whole stations."""
+    station = monthly['station_id'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, station[1:] != station[:-1]])     # first row of each station run
+    bounds = list(starts[::chunk_stations]) + [len(monthly)]
+    return [monthly.iloc[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def _test_series(monthly: pd.DataFrame, workers: int, chunk_stations: int) -> pd.DataFrame:
+    """Batched tests of every series in `monthly`, sharded across `workers` processes."""
+    chunks = shard_by_station(monthly, chunk_stations)
+    if not chunks:
+        return mk_monthly_with_theil_batch(monthly)
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_test_chunk, chunks))
+    else:
+        parts = [_test_chunk(chunk) for chunk in chunks]
+    return pd.concat(parts, ignore_index=True)
+
+
+# Incremental testing
+
+def series_hashes(monthly: pd.DataFrame, keys=STATION_MONTH_KEYS) -> tuple:
+    """
+    Content hash of every station–month series: its (year, hnsum) rows and the
+    test parameters. Returns (group id per row, groups in order of first
+    appearance, uint64 hash per group).
+    """
+    gid = monthly.groupby(keys, sort=False).ngroup().to_numpy()
+    first = ~pd.Series(gid).duplicated().to_numpy()
+    groups = monthly.loc[first, keys].reset_index(drop=True)
+
+    rows = pd.util.hash_pandas_object(monthly[['year', 'hnsum']], index=False).to_numpy()
+    hashes = np.zeros(len(groups), dtype=np.uint64)
+    np.add.at(hashes, gid, rows)                             # order-free: rows carry their year
+    params = pd.util.hash_pandas_object(pd.Series([f'{STORE_VERSION}:{MIN_YEARS}:{EPS!r}']), index=False).to_numpy()
+    return gid, groups, hashes + params[0]
+
+
+def load_result_store(store_path: Path) -> pd.DataFrame | None:
+    """Per-series results of the previous run (None when there is no usable store)."""
+    if store_path is None or not Path(store_path).exists():
+        return None
+    try:
+        return pd.read_feather(store_path)
+    except (OSError, ValueError, ImportError):
+        return None
+
+
+def save_result_store(store_path: Path, results: pd.DataFrame, hashes: np.ndarray) -> None:
+    """Persist per-series results with their content hash (atomic replace)."""
+    store_path = Path(store_path)
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = store_path.with_name(store_path.name + '.tmp')
+    results.assign(series_hash=hashes).to_feather(tmp)
+    os.replace(tmp, store_path)
+
+
+def test_station_months(monthly: pd.DataFrame, workers: int = 1,
+                        chunk_stations: int = CHUNK_STATIONS, store_path: Path | None = None) -> pd.DataFrame:
+    """
+    Mann–Kendall / Theil–Sen result per station–month series, as notebook 03's
+    loop over mk_monthly_with_theil (same rows, columns and order).
+
+    With a store_path, series whose content hash matches the stored result are
+    not re-tested; the store is then rewritten for the current series.
+    """
+    gid, groups, hashes = series_hashes(monthly)
+    store = load_result_store(store_path)
+
+    changed = np.ones(len(groups), dtype=bool)
+    if store is not None:
+        row = (groups.merge(store[STATION_MONTH_KEYS].assign(store_row=np.arange(len(store))),
+                            on=STATION_MONTH_KEYS, how='left')['store_row'].to_numpy())
+        known = np.isfinite(row)                             # series present in the store
+        stored_hash = store['series_hash'].to_numpy(dtype=np.uint64)[np.where(known, row, 0).astype(int)]
+        changed = ~known | (stored_hash != hashes)
+
+    parts = [] if len(groups) else [_test_series(monthly, workers, chunk_stations)]
+    if changed.any():
+        tested = _test_series(monthly[changed[gid]], workers, chunk_stations)
+        tested.index = np.flatnonzero(changed)               # subset keeps the global series order
+        parts.append(tested)
+    if not changed.all():
+        reused = groups[~changed].merge(store.drop(columns='series_hash'), on=STATION_MONTH_KEYS, how='left')
+        reused = reused[store.columns.drop('series_hash')]
+        reused.index = np.flatnonzero(~changed)
+        parts.append(reused[parts[0].columns] if parts else reused)
+
+    results = pd.concat(parts).sort_index() if len(parts) > 1 else parts[0]
+    results = results.reset_index(drop=True)
+    print(f'Station-month series re-tested: {changed.sum():,} of {len(groups):,}', flush=True)
+
+    if store_path is not None:
+        save_result_store(store_path, results, hashes)
+
+    per_station_month = results.copy()
+    per_station_month['slope_sen_per_decade'] = per_station_month['slope_sen'] * 10
+    per_station_month['slope_theil_per_decade'] = per_station_month['slope_theil'] * 10
+    return per_station_month
+
+
+# Station-Centric (micro perspective)
+
+def station_tables(snow_recordings: pd.DataFrame, per_station_month: pd.DataFrame) -> dict:
+    """Station-month, country-month, country and per-station summary tables."""
+    # Geometric data of Weather Stations
+    sr_meta = (snow_recordings[['station_id', 'geometry', 'elevation_band']]
+               .drop_duplicates()
+               .set_index('station_id')
+               [['geometry', 'elevation_band']])
+
+    # Successfully Tested Weather Stations
+    tested = per_station_month[per_station_month['trend'].isin(['increasing', 'decreasing', 'no trend'])]
+    tested_geo = tested.join(sr_meta, on='station_id', how='left')
+    tested_all = tested.copy()
+
+    # Every summary is a segment reduction over the tested series, sorted once per grouping (Scripts/segments.py)
+    significant = tested_all['p'].to_numpy(dtype=float) < 0.05
+
+    # Country_by_Month trend analysis
+    by_country_month = Segments(tested_all.assign(significant=significant),
+                                ['country', 'country_abr', 'month', 'month_name'])
+    rows = by_country_month.frame
+    country_month = by_country_month.groups().assign(
+        num_stations=by_country_month.nunique('station_id'),
+        median_years=by_country_month.median('n_years'),
+        percent_sig=by_country_month.percent(rows['significant'], rows['p'].notna()),
+        median_slope_theil_per_year=by_country_month.median('slope_theil'),
+        median_slope_theil_per_decade=by_country_month.median('slope_theil_per_decade'),
+        mean_slope_theil_per_year=by_country_month.mean('slope_theil'),
+        mean_slope_theil_per_decade=by_country_month.mean('slope_theil_per_decade'))
+
+    # Each successfully tested Weather Station's average snowpack change, with its
+    # station-month p-values combined by Stouffer's method (weights: give more weight to longer time series)
+    by_station = Segments(tested_all.assign(significant=significant), ['country', 'country_abr', 'station_id'])
+    rows = by_station.frame
+    per_station_avg = by_station.groups().assign(
+        n_months=by_station.nunique('month'),
+        median_slope_theil_per_year=by_station.median('slope_theil'),
+        median_slope_theil_per_decade=by_station.median('slope_theil_per_decade'),
+        mean_slope_theil_per_year=by_station.mean('slope_theil'),
+        mean_slope_theil_per_decade=by_station.mean('slope_theil_per_decade'),
+        p_combined=by_station.stouffer('p', signs='slope_theil', weights=np.sqrt(rows['n_years'].to_numpy(dtype=float))))
+
+    # Each Country's average station_month series (same order, station runs merged)
+    by_country = by_station.coarsen(['country', 'country_abr'])
+    country_overall = by_country.groups().assign(
+        n_station_month_series=by_country.count('station_id'),
+        n_stations=by_country.nunique('station_id'),
+        median_years=by_country.median('n_years'),
+        percent_sig_station_month_series=by_country.percent(rows['significant'], rows['p'].notna()),
+        median_station_slope_cm_per_year=by_country.median('slope_theil'),
+        median_station_slope_cm_per_decade=by_country.median('slope_theil_per_decade'),
+        mean_station_slope_cm_per_year=by_country.mean('slope_theil'),
+        mean_station_slope_cm_per_decade=by_country.mean('slope_theil_per_decade'))
+
+    return {'station_month': tested_geo,
+            'country_month': country_month,
+            'country_overall': country_overall,
+            'per_station': per_station_avg}
+
+
+# Region-Centric (macro perspective)
+
+def region_tables(snow_recordings: pd.DataFrame, sets: dict = GROUPING_SETS, cube=None) -> dict:
+    """
+    Aggregated trend table of every grouping set (country-month, country,
+    month and elevation band-month by default), from one shared sort of
+    snow_recordings - or axis reductions over the snow cube, when given - and
+    one batch of tests (Scripts/aggregates.py).
+    """
+    return aggregate_trends(aggregate_series(snow_recordings, sets, MIN_STATIONS_PER_YEAR, cube), sets)
+
+
+# Pipeline
+
+def write_tables(tables: dict, out_dir: Path) -> None:
+    """Export every table to its artifact CSV in out_dir."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, file_name in OUTPUTS.items():
+        tables[name].to_csv(out_dir / file_name, index=False)
+
+
+def run(input_path: Path = REPO_ROOT / SNOW_RECORDINGS_PATH, out_dir: Path = REPO_ROOT / TESTS_DIR,
+        workers: int = 1, chunk_stations: int = CHUNK_STATIONS,
+        store_path: Path | None = REPO_ROOT / RESULT_STORE_PATH,
+        bootstrap: int = 0, block_length: int | None = None, seed: int = 0) -> dict:
+    """Run every stage of the trend pipeline; returns the stage timings."""
+    timings = {}
+
+    with stage('load snow_recordings', timings):
+        snow_recordings = load_snow_recordings(input_path)
+    with stage('station-month series', timings):
+        monthly = station_month_series(snow_recordings)
+    with stage(f'station-month tests ({workers} workers)', timings):
+        per_station_month = test_station_months(monthly, workers, chunk_stations, store_path)
+    with stage('station summaries', timings):
+        tables = station_tables(snow_recordings, per_station_month)
+    with stage('snow cube', timings):
+        cube = cached_cube(snow_recordings, input_path, Path(input_path).parent / CACHE_DIR_NAME)
+    with stage('aggregated trends', timings):
+        tables.update(region_tables(snow_recordings, cube=cube))
+    if bootstrap:
+        with stage(f'bootstrap CIs ({bootstrap:,} resamples)', timings):
+            add_bootstrap_ci(tables, cube, n_boot=bootstrap, min_stations=MIN_STATIONS_PER_YEAR,
+                             block_length=block_length, seed=seed, workers=workers)
+    with stage('write CSVs', timings):
+        write_tables(tables, out_dir)
+
+    print(f'{"total":<32}{sum(timings.values()):>9.2f} s \n'
+          f'Station-month series tested: {len(tables["station_month"]):,} \n'
+          f'CSVs Exported To: {out_dir}')
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m Scripts.trends',
+                                     description='Rebuild the Data/Cleaned/Tests trend CSVs.')
+    parser.add_argument('--input', type=Path, default=REPO_ROOT / SNOW_RECORDINGS_PATH,
+                        help='snow_recordings.csv to analyse')
+    parser.add_argument('--out', type=Path, default=REPO_ROOT / TESTS_DIR,
+                        help='directory the CSVs are written to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes for the station-month stage (default: all cores)')
+    parser.add_argument('--chunk-stations', type=int, default=CHUNK_STATIONS,
+                        help='stations per work unit')
+    parser.add_argument('--store', type=Path, default=REPO_ROOT / RESULT_STORE_PATH,
+                        help='per-series result store; only series whose data changed are re-tested')
+    parser.add_argument('--full', action='store_true',
+                        help='re-test every series and leave the store untouched')
+    parser.add_argument('--bootstrap', type=int, default=0,
+                        help='station resamples per aggregated trend; adds slope CI columns (0: off)')
+    parser.add_argument('--block-length', type=int, default=None,
+                        help='also redraw Sen residuals in moving blocks of this many years')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the bootstrap RNG streams')
+    parser.add_argument('--span-log', type=Path, default=None,
+                        help='append every stage as a JSON line (timing span) to this file')
+    args = parser.parse_args(argv)
+
+    if args.span_log:
+        log_spans(args.span_log)
+
+    run(args.input, args.out, max(args.workers, 1), max(args.chunk_stations, 1),
+        None if args.full else args.store, max(args.bootstrap, 0), args.block_length, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+# 03_Statistical_Testing
+
+# Sliding-window trend atlas
+#
+# Notebook 03 reports one trend per station–month series over its whole
+# record. The atlas gives the trend of every series over every WINDOW-year
+# window of calendar years (1961–1990, 1962–1991, ...), to see when declines
+# started: Mann–Kendall S with its tie-corrected variance and p-value (the
+# original test; Hamed–Rao's autocorrelation correction is not updatable),
+# and the Theil–Sen slope per year.
+#
+# Series are laid on a dense calendar-year grid (NaN where a winter is
+# missing) and every window state is updated as it slides one year, in
+# batches of series:
+#   - S loses the signs of the pairs of the leaving year and gains those of
+#     the entering year (O(window) per step instead of O(window²));
+#   - the tie term of var(S) moves by the size change of the leaving and
+#     entering values' tie groups;
+#   - the pairwise-slope multiset is kept sorted, each slope tagged with its
+#     left year: the leaving year's slopes are dropped, the entering year's
+#     sorted and merged in (a two-run stable sort), and the median read at
+#     its rank.
+# Windows with fewer than MIN_WINDOW_YEARS winters are left out. Batches hold
+# series with nearby first qualifying windows and a series leaves its batch
+# after its last one, so a batch only slides over years it reports.
+#
+#   python -m Scripts.windows --window 30 --workers 8
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+from Scripts.mann_kendall import mk_score_batch, p_value_batch, variance_s_batch, z_score_batch
+from Scripts.metrics import log_spans, stage
+from Scripts.trends import SNOW_RECORDINGS_PATH, load_snow_recordings, station_month_series
+
+# Files
+ATLAS_PATH = 'Data/Cleaned/Tests/station-month-windows.feather'
+
+# Window length (years) and winters required in a window
+WINDOW = 30
+MIN_WINDOW_YEARS = 25
+
+# Series per work unit
+CHUNK_SERIES = 256
+
+# Atlas columns and dtypes (one row per station, month and window; n_years and s widened by atlas_dtypes
+# for windows they cannot hold)
+ATLAS_DTYPES = {'station_id': 'int32', 'month': 'int8', 'window_start': 'int16', 'n_years': 'int8',
+                's': 'int16', 'p': 'float32', 'slope_theil_per_decade': 'float32'}
+
+
+def atlas_dtypes(window: int) -> dict:
+    """ATLAS_DTYPES with n_years (at most window) and s (|S| at most window(window - 1) / 2) wide enough."""
+    dtypes = dict(ATLAS_DTYPES)
+    for column, bound in (('n_years', window), ('s', window * (window - 1) // 2)):
+        dtypes[column] = np.promote_types(dtypes[column], np.min_scalar_type(-bound)).name
+    return dtypes
+
+
+def _tie_size_term(t):
+    """t(t - 1)(2t + 5): a tie group's share of the var(S) correction."""
+    return t * (t - 1) * (2 * t + 5)
+
+
+# Kernel
+
+def _take_rows(values: np.ndarray, order: np.ndarray) -> np.ndarray:
+    """values[r, order[r]] for every row r (np.take_along_axis on flat offsets)."""
+    offsets = np.arange(0, values.size, values.shape[1])[:, None]
+    return np.take(values, order + offsets)
+
+
+class SlidingWindow:
+    """
+    MK S, tie term and sorted pairwise slopes of a `window`-column view of a
+    dense (series x year) batch, moved one column at a time by slide().
+    """
+
+    def __init__(self, Y: np.ndarray, window: int):
+        self.Y = np.asarray(Y, dtype=float)
+        self.window = window
+        self.start = 0
+        view = self.Y[:, :window]
+        self.n = np.isfinite(view).sum(axis=1)
+
+        # S and the tie term over the first window (from scratch)
+        self.s = mk_score_batch(view)
+        self.ties = _tie_size_term(self.n) - 18 * variance_s_batch(view, self.n)
+
+        # Pairwise slopes per year, sorted (NaN pairs of missing years last), tagged with the left year's column
+        i, j = np.triu_indices(window, 1)
+        with np.errstate(invalid='ignore'):
+            slopes = (view[:, j] - view[:, i]) / (j - i)
+        order = np.argsort(slopes, axis=1, kind='stable')
+        self.slopes = _take_rows(slopes, order)
+        self.tags = i.astype(np.int16)[order]
+
+    def slide(self) -> None:
+        """Drop the first column of the window and take in the next one."""
+        a, e = self.start, self.start + self.window
+        old, new = self.Y[:, a], self.Y[:, e]
+        inner = self.Y[:, a + 1:e]
+        old_ok, new_ok = np.isfinite(old), np.isfinite(new)
+
+        with np.errstate(invalid='ignore'):
+            self.s -= np.nansum(np.sign(inner - old[:, None]), axis=1)
+            self.s += np.nansum(np.sign(new[:, None] - inner), axis=1)
+
+        # Tie groups: the leaving value's group shrinks, the entering value's grows
+        c_old = (inner == old[:, None]).sum(axis=1) + 1
+        self.ties += np.where(old_ok, _tie_size_term(c_old - 1) - _tie_size_term(c_old), 0)
+        c_new = (inner == new[:, None]).sum(axis=1)
+        self.ties += np.where(new_ok, _tie_size_term(c_new + 1) - _tie_size_term(c_new), 0)
+        self.n += new_ok.astype(int) - old_ok.astype(int)
+
+        # Slopes: every pair (NaN where a year is missing) holds a slot, so exactly window - 1 leave
+        # and window - 1 enter; the kept slopes stay sorted and the entering ones are merged in
+        m, capacity = self.slopes.shape
+        kept = self.tags != a
+        slopes = self.slopes[kept].reshape(m, capacity - self.window + 1)
+        tags = self.tags[kept].reshape(m, capacity - self.window + 1)
+
+        left = np.arange(a + 1, e)
+        with np.errstate(invalid='ignore'):
+            incoming = (new[:, None] - inner) / (e - left)
+        entering = np.argsort(incoming, axis=1, kind='stable')
+        merged = np.concatenate([slopes, _take_rows(incoming, entering)], axis=1)
+        merged_tags = np.concatenate([tags, left.astype(np.int16)[entering]], axis=1)
+        order = np.argsort(merged, axis=1, kind='stable')                   # two sorted runs: a merge
+        self.slopes = _take_rows(merged, order)
+        self.tags = _take_rows(merged_tags, order)
+        self.start += 1
+
+    def keep(self, rows: np.ndarray) -> None:
+        """Carry on with the given rows only."""
+        for name in ('Y', 'n', 's', 'ties', 'slopes', 'tags'):
+            setattr(self, name, getattr(self, name)[rows])
+
+    def statistics(self) -> dict:
+        """n, S, var(S) and Theil–Sen slope per year of the current window."""
+        n = self.n
+        pairs = n * (n - 1) // 2
+        rows = np.arange(len(n))
+        lo = self.slopes[rows, np.maximum(pairs - 1, 0) // 2]
+        hi = self.slopes[rows, np.minimum(pairs // 2, self.slopes.shape[1] - 1)]
+        return {'n': n.copy(), 's': self.s.copy(), 'var_s': (_tie_size_term(n) - self.ties) / 18,
+                'slope': np.where(pairs > 0, (lo + hi) / 2, np.nan)}
+
+
+def window_trends(Y: np.ndarray, first_year: int, window: int = WINDOW, min_years: int = MIN_WINDOW_YEARS) -> tuple:
+    """
+    Statistics (n, s, var_s, p, slope per year) of every window of a dense
+    (series x year) batch whose columns are consecutive years from
+    first_year. Returns (series row, window start year, statistics) of the
+    windows with at least min_years values, window by window. A row leaves
+    the batch after its last such window.
+    """
+    m, T = Y.shape
+    first, last = window_spans(Y, window, min_years) if T >= window else (np.full(m, -1), np.full(m, -1))
+    alive = np.flatnonzero(first >= 0)
+    if not alive.size:
+        empty = np.empty(0)
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                {'n': empty, 's': empty, 'var_s': empty, 'p': empty, 'slope': empty})
+
+    begin = int(first[alive].min())
+    state = SlidingWindow(Y[alive, begin:], window)
+    rows, starts, parts = [], [], []
+    for a in range(begin, int(last[alive].max()) + 1):
+        if a > begin:
+            state.slide()
+        stats = state.statistics()
+        ok = stats['n'] >= min_years
+        rows.append(alive[ok])
+        starts.append(np.full(ok.sum(), first_year + a))
+        parts.append({k: v[ok] for k, v in stats.items()})
+
+        done = last[alive] <= a
+        if done.sum() * 8 >= len(alive):                                   # drop finished rows in bulk
+            state.keep(~done)
+            alive = alive[~done]
+
+    stats = {k: np.concatenate([part[k] for part in parts]) for k in parts[0]}
+    stats['p'], _, _ = p_value_batch(z_score_batch(stats['s'], stats['var_s']))
+    return np.concatenate(rows), np.concatenate(starts), stats
+
+
+# Atlas
+
+def year_grid(monthly: pd.DataFrame) -> tuple:
+    """
+    Station–month series on a dense calendar-year grid: (series keys
+    [station_id, month], Y with one column per year from first_year and NaN
+    where a year is missing, first_year).
+    """
+    series, codes = np.unique(monthly[['station_id', 'month']].to_numpy(dtype=np.int64), axis=0, return_inverse=True)
+    years = monthly['year'].to_numpy(dtype=np.int64)
+    first_year = int(years.min()) if len(years) else 0
+    Y = np.full((len(series), int(years.max()) - first_year + 1 if len(years) else 0), np.nan)
+    Y[codes.ravel(), years - first_year] = monthly['hnsum'].to_numpy(dtype=float)
+    keys = pd.DataFrame(series, columns=['station_id', 'month'])
+    return keys, Y, first_year
+
+
+def window_spans(Y: np.ndarray, window: int, min_years: int) -> tuple:
+    """
+    First and last start column of the windows holding at least min_years
+    values, per row of a dense batch (-1 for rows without such a window).
+    """
+    filled = np.cumsum(np.c_[np.zeros(len(Y), dtype=np.int64), np.isfinite(Y)], axis=1)
+    ok = (filled[:, window:] - filled[:, :-window]) >= min_years
+    first = np.where(ok.any(axis=1), ok.argmax(axis=1), -1)
+    last = np.where(ok.any(axis=1), ok.shape[1] - 1 - ok[:, ::-1].argmax(axis=1), -1)
+    return first, last
+
+
+def _atlas_chunk(task: tuple) -> tuple:
+    """Worker: every window of one block of series."""
+    rows, Y, first_year, window, min_years = task
+    block_rows, starts, stats = window_trends(Y, first_year, window, min_years)
+    return rows[block_rows], starts, stats
+
+
+def trend_atlas(monthly: pd.DataFrame, window: int = WINDOW, min_years: int = MIN_WINDOW_YEARS,
+                workers: int = 1, chunk_series: int = CHUNK_SERIES) -> pd.DataFrame:
+    """One row per station, month and window start with at least min_years winters (atlas_dtypes columns)."""
+    keys, Y, first_year = year_grid(monthly)
+
+    # Series blocked in order of their first qualifying window, so a block slides over its own years only
+    first, last = window_spans(Y, window, min_years) if Y.shape[1] >= window else (np.full(len(Y), -1),) * 2
+    series = np.flatnonzero(first >= 0)
+    series = series[np.lexsort((last[series], first[series]))]
+    tasks = []
+    for a in range(0, len(series), chunk_series):
+        rows = series[a:a + chunk_series]
+        lo, hi = int(first[rows].min()), int(last[rows].max()) + window
+        tasks.append((rows, Y[rows, lo:hi], first_year + lo, window, min_years))
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_atlas_chunk, tasks))
+    else:
+        parts = [_atlas_chunk(task) for task in tasks]
+
+    dtypes = atlas_dtypes(window)
+    if not parts:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in dtypes.items()})
+    rows = np.concatenate([rows for rows, _, _ in parts])
+    stats = {k: np.concatenate([part[k] for _, _, part in parts]) for k in ('n', 's', 'p', 'slope')}
+    atlas = pd.DataFrame({'station_id': keys['station_id'].to_numpy()[rows],
+                          'month': keys['month'].to_numpy()[rows],
+                          'window_start': np.concatenate([starts for _, starts, _ in parts]),
+                          'n_years': stats['n'],
+                          's': stats['s'],
+                          'p': stats['p'],
+                          'slope_theil_per_decade': stats['slope'] * 10})        # cm/decade
+    return (atlas.astype(dtypes)
+            .sort_values(['station_id', 'month', 'window_start'], ignore_index=True))
+
+
+def run(input_path: Path = REPO_ROOT / SNOW_RECORDINGS_PATH, out_path: Path = REPO_ROOT / ATLAS_PATH,
+        window: int = WINDOW, min_years: int = MIN_WINDOW_YEARS, workers: int = 1,
+        chunk_series: int = CHUNK_SERIES) -> dict:
+    """Build and export the sliding-window atlas; returns the stage timings."""
+    timings = {}
+
+    with stage('load snow_recordings', timings):
+        snow_recordings = load_snow_recordings(input_path)
+    with stage('station-month series', timings):
+        monthly = station_month_series(snow_recordings)
+    with stage(f'{window}-year windows ({workers} workers)', timings):
+        atlas = trend_atlas(monthly, window, min_years, workers, chunk_series)
+    with stage('write atlas', timings):
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        atlas.to_feather(out_path)
+
+    print(f'{"total":<32}{sum(timings.values()):>9.2f} s \n'
+          f'Windows tested: {len(atlas):,} '
+          f'({atlas[["station_id", "month"]].drop_duplicates().shape[0]:,} station-month series) \n'
+          f'Atlas Exported To: {out_path}')
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m Scripts.windows',
+                                     description='Trend of every station-month series over every sliding window of years.')
+    parser.add_argument('--input', type=Path, default=REPO_ROOT / SNOW_RECORDINGS_PATH,
+                        help='snow_recordings.csv to analyse')
+    parser.add_argument('--out', type=Path, default=REPO_ROOT / ATLAS_PATH,
+                        help='feather file the atlas is written to')
+    parser.add_argument('--window', type=int, default=WINDOW,
+                        help='window length in years')
+    parser.add_argument('--min-years', type=int, default=None,
+                        help=f'winters required in a window (default: {MIN_WINDOW_YEARS} of {WINDOW}, scaled to --window)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes (default: all cores)')
+    parser.add_argument('--chunk-series', type=int, default=CHUNK_SERIES,
+                        help='series per work unit')
+    parser.add_argument('--span-log', type=Path, default=None,
+                        help='append every stage as a JSON line (timing span) to this file')
+    args = parser.parse_args(argv)
+
+    if args.span_log:
+        log_spans(args.span_log)
+
+    window = max(args.window, 2)
+    min_years = args.min_years if args.min_years is not None else -(-window * MIN_WINDOW_YEARS // WINDOW)
+    run(args.input, args.out, window, min(max(min_years, 2), window), max(args.workers, 1),
+        max(args.chunk_series, 1))
+
+
+if __name__ == '__main__':
+    main()
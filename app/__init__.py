@@ -1,5 +1,10 @@
 # app/__init__.py
 
-from .app import app
-
-server = app.server  # so 'app:server' works
\ No newline at end of file
+# 'app:server' (and 'app:app') resolve on first access, so importing a submodule
+# such as app.registry or app.filters does not start the Dash app
+def __getattr__(name):
+    if name in ('app', 'server'):
+        from .app import app as dash_app
+        globals().update(app=dash_app, server=dash_app.server)
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,23 @@
+# app/build_figures.py
+
+# Render every dashboard figure to a content-hashed Plotly JSON artifact and
+# report the payload size of each
+#
+#   python -m app.build_figures
+
+import time
+
+from app.app import figures
+
+
+def main():
+    start = time.perf_counter()
+    manifest = figures.build_artifacts()
+    for name in figures:
+        print(f'{name:<28}{manifest[name]["bytes"]:>12,} B   {manifest[name]["file"]}')
+    print(f'{"total":<28}{sum(manifest[name]["bytes"] for name in figures):>12,} B')
+    print(f'Figures Exported To: {figures.artifact_dir} ({time.perf_counter() - start:.2f} s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# app/coldstart.py
+
+# Cold-start profile
+#
+# Imports the serving entry point (wsgi by default) in a fresh interpreter under
+# `python -X importtime`, prints the slowest modules and the total import time,
+# and exits with status 1 if the import exceeds the budget or loads a module
+# that serving does not need (the analysis stack: scipy, geopandas, ...).
+# Every replica pays this before it can take traffic.
+#
+#   python -m app.coldstart                         # budget from SNOWPACK_IMPORT_BUDGET (default 3 s)
+#   python -m app.coldstart --budget 2 --out coldstart.json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+
+# Seconds allowed for importing the entry point
+IMPORT_BUDGET = float(os.getenv('SNOWPACK_IMPORT_BUDGET', '3.0'))
+
+# Modules only the pipeline / notebooks / runtime figure builds need
+ANALYSIS_MODULES = ('scipy', 'sklearn', 'geopandas', 'shapely', 'rasterio', 'pymannkendall', 'matplotlib',
+                    'seaborn', 'plotly.express')
+
+
+def import_profile(module: str = 'wsgi') -> list:
+    """(module, self µs, cumulative µs, depth) of every import made by `import module`, in import order."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=REPO_ROOT,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{result.stderr[-2000:]}')
+
+    profile = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('| imported package'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        profile.append((name.strip(), int(self_us), int(cumulative_us), (len(name) - len(name.lstrip()) - 1) // 2))
+    return profile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.coldstart',
+                                     description='Profile the import of the serving entry point against a budget.')
+    parser.add_argument('--module', default='wsgi', help='entry point to import')
+    parser.add_argument('--budget', type=float, default=IMPORT_BUDGET, help='seconds allowed for the import')
+    parser.add_argument('--top', type=int, default=15, help='slowest modules to list')
+    parser.add_argument('--out', type=Path, default=None, help='write the full profile here as JSON')
+    args = parser.parse_args(argv)
+
+    profile = import_profile(args.module)
+    total = next(cumulative for name, _, cumulative, _ in reversed(profile) if name == args.module) / 1e6
+    loaded = {name for name, *_ in profile}
+    unexpected = [m for m in ANALYSIS_MODULES if m in loaded]
+
+    print(f'{"module":<48}{"self":>10}{"cumulative":>12}')
+    for name, self_us, cumulative_us, _ in sorted(profile, key=lambda row: -row[1])[:args.top]:
+        print(f'{name:<48}{self_us / 1e3:>8.1f}ms{cumulative_us / 1e3:>10.1f}ms')
+    print(f'\nModules imported: {len(profile):,} \n'
+          f'Import of {args.module}: {total:.2f} s (budget {args.budget:.2f} s)')
+    if unexpected:
+        print(f'Analysis modules loaded while serving: {", ".join(unexpected)}')
+
+    if args.out is not None:
+        args.out.write_text(json.dumps({'module': args.module, 'seconds': total, 'budget': args.budget,
+                                        'unexpected': unexpected,
+                                        'imports': [dict(zip(('module', 'self_us', 'cumulative_us', 'depth'), row))
+                                                    for row in profile]}, indent=2))
+        print(f'Profile Exported To: {args.out}')
+
+    if total > args.budget or unexpected:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+# app/filters.py
+
+# Filtered figures
+#
+# Country / month / elevation band / significance controls redraw the country
+# trends, month slope distribution and heatmap figures for a subset. The
+# station-month table is sorted once by integer-coded (country, month, band)
+# cell (np.ravel_multi_index of the per-key codes) and each cell's row range
+# recorded, so a subset is a concatenation of precomputed slices; the
+# country-month heatmap adds up per-cell counts (prefix sums per threshold)
+# and takes medians over the chosen cells only. Figures are not rebuilt through
+# Plotly on a miss: each is built once, unfiltered, as a template dict, and a
+# selection swaps its data into the template's traces (the result equals the
+# Scripts/figures.py builder's). Filtered figures are kept in a bounded LRU
+# per filter combination (and per version of the input files).
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from Scripts.figures import MAX_POINTS, decimate, decimation_note
+from Scripts.metrics import CACHE_REQUESTS, span
+
+logger = logging.getLogger(__name__)
+
+# Seasonal month order and elevation bands, as drawn by Scripts/figures.py
+MONTH_ORDER = ['Nov', 'Dec', 'Jan', 'Feb', 'Mar', 'Apr', 'May']
+BAND_ORDER = ['Low Elevation', 'Mid Elevation', 'High Elevation']
+
+# Significance thresholds offered by the controls
+ALPHAS = [0.01, 0.05, 0.10]
+DEFAULT_ALPHA = 0.05
+
+# Rendered figures kept per filter combination
+FIGURE_CACHE_SIZE = 256
+
+# Controls each filtered figure depends on (others leave it unchanged)
+FIGURE_CONTROLS = {
+    'country_trends': ('countries', 'bands', 'alpha'),
+    'month_station_distrib': ('countries', 'months', 'bands'),
+    'country_month_heatmap': ('countries', 'months', 'bands', 'alpha'),
+    'elevation_heatmap': ('months', 'bands', 'alpha'),
+}
+
+# Shown when a control has nothing selected
+EMPTY_FIGURE = {'data': [], 'layout': {'xaxis': {'visible': False}, 'yaxis': {'visible': False},
+                                       'annotations': [{'text': 'No data for this selection', 'showarrow': False,
+                                                        'font': {'size': 16}}]}}
+
+
+def _positions(levels: list, chosen) -> np.ndarray:
+    """Positions of the chosen values among `levels`, in level order (unknown values are left out)."""
+    found = pd.Index(levels).get_indexer(list(chosen))
+    return np.sort(found[found >= 0])
+
+
+def _cell_codes(frame: pd.DataFrame, keys: list, levels: list) -> np.ndarray:
+    """
+    Row-major cell of every row over the levels of each key (np.ravel_multi_index
+    of the per-key codes); rows holding a value outside the levels get the
+    trailing cell prod(shape).
+    """
+    shape = tuple(len(level) for level in levels)
+    codes = [pd.Index(level).get_indexer(frame[key]) for key, level in zip(keys, levels)]
+    known = np.logical_and.reduce([code >= 0 for code in codes])
+    cells = np.full(len(frame), int(np.prod(shape)), dtype=np.int64)
+    cells[known] = np.ravel_multi_index([code[known] for code in codes], shape)
+    return cells
+
+
+def _bounds(cells: np.ndarray, n_cells: int) -> np.ndarray:
+    """Run boundaries of rows sorted by cell: cell k is rows bounds[k]:bounds[k + 1]."""
+    return np.searchsorted(cells, np.arange(n_cells + 1))
+
+
+def _ranges(bounds: np.ndarray, cells) -> np.ndarray:
+    """Row positions of the chosen cells' runs, concatenated in the order of `cells`."""
+    cells = np.asarray(cells, dtype=np.int64).ravel()
+    starts, lengths = bounds[cells], bounds[cells + 1] - bounds[cells]
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - (ends - lengths), lengths)
+
+
+def _retitle(layout: dict, alpha: float) -> dict:
+    """A template layout whose title states `alpha` instead of DEFAULT_ALPHA."""
+    title = layout['title']
+    return {**layout, 'title': {**title, 'text': title['text'].replace(f'p ≤ {DEFAULT_ALPHA:g}', f'p ≤ {alpha:g}')}}
+
+
+def _with_note(layout: dict, shown: int, total: int) -> dict:
+    """A template layout with the decimation note of `shown` of `total` points (if any were thinned)."""
+    note = decimation_note(shown, total)
+    return {**layout, 'annotations': [*layout.get('annotations', ()), note]} if note else layout
+
+
+class FilterIndex:
+    """
+    Cell offsets, per-cell aggregates and figure templates over the Tests tables.
+
+    station_month: station-month-time-series.csv
+    per_station: per_station_series.csv
+    The aggregated (macro) tables are small and sliced from pivoted grids.
+    """
+
+    def __init__(self, station_month: pd.DataFrame, per_station: pd.DataFrame, avg_country: pd.DataFrame,
+                 avg_month: pd.DataFrame, avg_country_month: pd.DataFrame, avg_elevation_month: pd.DataFrame):
+        station_month = station_month.assign(month_name=station_month['month_name'].astype(str))
+        self.countries = sorted(station_month['country'].dropna().unique())
+        self.months = [m for m in MONTH_ORDER if m in set(station_month['month_name'])]
+        self.bands = [b for b in BAND_ORDER if b in set(station_month['elevation_band'])]
+        self.shape = (len(self.countries), len(self.months), len(self.bands))
+
+        # station_month in (country, month, band) cell order
+        cells = _cell_codes(station_month, ['country', 'month_name', 'elevation_band'],
+                            [self.countries, self.months, self.bands])
+        order = np.argsort(cells, kind='stable')
+        self.station_month = station_month.iloc[order].reset_index(drop=True)
+        self.cells = _bounds(cells[order], int(np.prod(self.shape)))
+
+        # Stations carry their band into per_station (which has no months)
+        band = self.station_month.drop_duplicates('station_id').set_index('station_id')['elevation_band']
+        per_station = per_station.assign(elevation_band=per_station['station_id'].map(band).to_numpy())
+        station_cells = _cell_codes(per_station, ['country', 'elevation_band'], [self.countries, self.bands])
+        order = np.argsort(station_cells, kind='stable')
+        self.per_station = per_station.iloc[order].reset_index(drop=True)
+        self.per_station_cells = _bounds(station_cells[order], len(self.countries) * len(self.bands))
+
+        # Country-month heatmap aggregates per cell; counts add up over bands (a station has one band)
+        self._slope = self.station_month['slope_theil_per_decade'].to_numpy(dtype=float)
+        self._p = self.station_month['p'].to_numpy(dtype=float)
+        self._finite = np.r_[0, np.cumsum(np.isfinite(self._p))]            # prefix counts of tested series
+        self._significant = {}                                               # alpha -> prefix counts of p < alpha
+        pairs = pd.DataFrame({'cell': np.sort(cells), 'station': self.station_month['station_id'].to_numpy()})
+        self._cell_stations = np.bincount(pairs.drop_duplicates()['cell'], minlength=len(self.cells))
+
+        self.avg_country = avg_country
+        self.avg_month = avg_month.assign(month_name=avg_month['month_name'].astype(str))
+        self.avg_country_month = avg_country_month
+        self.avg_elevation_month = avg_elevation_month
+        self._month_macro = self.avg_month.groupby('month_name')['slope_per_decade'].median()
+
+        # Elevation heatmap values as band x month grids
+        self._elevation = {column: avg_elevation_month.pivot_table(index='elevation_band', columns='month_name',
+                                                                   values=column)
+                                   .reindex(index=self.bands, columns=self.months).to_numpy(dtype=float)
+                           for column in ('slope_per_decade', 'p', 'n_years', 'median_stations_per_year')}
+
+        self._templates = {}                                                 # figure name -> dict
+
+    # Subsets
+
+    def cell_grid(self, countries, months, bands) -> np.ndarray:
+        """Cells of the chosen countries x months x bands (array shaped by the selection, in level order)."""
+        positions = [_positions(self.countries, countries), _positions(self.months, months),
+                     _positions(self.bands, bands)]
+        return np.ravel_multi_index(np.ix_(*positions), self.shape)
+
+    def station_months(self, countries, months, bands) -> pd.DataFrame:
+        """Station-month rows of the chosen countries, months and bands."""
+        return self.station_month.iloc[_ranges(self.cells, self.cell_grid(countries, months, bands))]
+
+    def stations(self, countries, bands) -> pd.DataFrame:
+        """per_station rows of the chosen countries and bands."""
+        grid = np.ravel_multi_index(np.ix_(_positions(self.countries, countries), _positions(self.bands, bands)),
+                                    (len(self.countries), len(self.bands)))
+        return self.per_station.iloc[_ranges(self.per_station_cells, grid)]
+
+    def _significant_prefix(self, alpha: float) -> np.ndarray:
+        if alpha not in self._significant:
+            self._significant[alpha] = np.r_[0, np.cumsum(self._p < alpha)]
+        return self._significant[alpha]
+
+    def country_month_grid(self, countries, months, bands, alpha: float) -> tuple:
+        """
+        Country x month arrays over the chosen bands: station-month rows, stations,
+        percent of tested series with p < alpha and median station slope.
+        """
+        grid = self.cell_grid(countries, months, bands)
+        starts, stops = self.cells[grid], self.cells[grid + 1]
+        significant = self._significant_prefix(alpha)
+
+        rows = (stops - starts).sum(axis=2)
+        stations = self._cell_stations[grid].sum(axis=2)
+        tested = (self._finite[stops] - self._finite[starts]).sum(axis=2)
+        percent = 100 * (significant[stops] - significant[starts]).sum(axis=2) / np.maximum(tested, 1)
+        median = np.full(rows.shape, np.nan)
+        for country, month in zip(*np.nonzero(rows)):
+            median[country, month] = np.nanmedian(self._slope[_ranges(self.cells, grid[country, month])])
+        return rows, stations, percent, median
+
+    def country_month_cells(self, countries, months, bands, alpha: float) -> pd.DataFrame:
+        """
+        Typical-station country-month summary (as station-month-time-series-by-country-month.csv)
+        over the chosen bands, with percent_sig at `alpha`.
+        """
+        rows, stations, percent, median = self.country_month_grid(countries, months, bands, alpha)
+        country, month = np.nonzero(rows)
+        return pd.DataFrame({
+            'country': np.asarray(self.countries, dtype=object)[_positions(self.countries, countries)][country],
+            'month_name': np.asarray(self.months, dtype=object)[_positions(self.months, months)][month],
+            'num_stations': stations[country, month],
+            'percent_sig': percent[country, month],
+            'median_slope_theil_per_decade': median[country, month],
+        })
+
+    # Figures
+
+    def render(self, name: str, countries, months, bands, alpha: float, max_points=MAX_POINTS):
+        """One filtered figure built from scratch by the Scripts/figures.py builders (a plotly Figure)."""
+        from Scripts.figures import country_month_heat, country_trends_fig, elevation_band_heat, month_station_slope_distrib
+
+        countries, months, bands = list(countries), list(months), list(bands)
+        if name == 'country_trends':
+            return country_trends_fig(self.stations(countries, bands),
+                                      self.avg_country[self.avg_country['country'].isin(countries)], alpha=alpha,
+                                      max_points=max_points)
+        if name == 'month_station_distrib':
+            return month_station_slope_distrib(self.station_months(countries, months, bands).copy(),
+                                               self.avg_month[self.avg_month['month_name'].isin(months)].copy(),
+                                               max_points=max_points)
+        if name == 'country_month_heatmap':
+            avg = self.avg_country_month
+            return country_month_heat(avg[avg['country'].isin(countries) & avg['month_name'].isin(months)],
+                                      self.country_month_cells(countries, months, bands, alpha),
+                                      alpha=alpha, months=months)
+        if name == 'elevation_heatmap':
+            avg = self.avg_elevation_month
+            return elevation_band_heat(avg[avg['month_name'].isin(months) & avg['elevation_band'].isin(bands)],
+                                       alpha=alpha, months=months, bands=bands)
+        raise KeyError(name)
+
+    def template(self, name: str) -> dict:
+        """The unfiltered figure at DEFAULT_ALPHA with every point, as a dict; filtered figures are patched copies."""
+        if name not in self._templates:
+            self._templates[name] = self.render(name, self.countries, self.months, self.bands, DEFAULT_ALPHA,
+                                                max_points=None).to_plotly_json()
+        return self._templates[name]
+
+    def figure(self, name: str, countries, months, bands, alpha: float) -> dict:
+        """
+        One filtered figure as a dict, equal to render(...).to_plotly_json(): the
+        template's traces and layout with the selection's data swapped in.
+        """
+        patch = {'country_trends': self._country_trends, 'month_station_distrib': self._month_station_distrib,
+                 'country_month_heatmap': self._country_month_heatmap, 'elevation_heatmap': self._elevation_heatmap}
+        if name not in patch:
+            raise KeyError(name)
+        return patch[name](countries, months, bands, alpha)
+
+    def _country_trends(self, countries, months, bands, alpha: float) -> dict:
+        template = self.template('country_trends')
+        points, averages = template['data'][0::2], template['data'][1::2]    # one pair of traces per country
+        traces = {trace['legendgroup']: pair for trace, pair in zip(points, zip(points, averages))}
+        colours = [trace['marker']['color'] for trace in points]                # palette order of the builder
+
+        stations = self.stations(countries, bands)
+        columns = ['country', 'median_slope_theil_per_decade', 'p_combined', 'station_id', 'name']
+        shown = decimate(stations[[c for c in columns if c in stations]],                 # only the plotted columns
+                         ['median_slope_theil_per_decade', 'p_combined'], by='country')
+        present = set(stations['country'])
+        data = []
+        for colour, country in zip(colours, [c for c in self.countries if c in present]):
+            point, average = traces[country]
+            part = shown[shown['country'] == country]
+            data.append({**point, 'x': part['median_slope_theil_per_decade'].to_numpy(),
+                         'y': part['p_combined'].to_numpy(), 'text': part['country'].to_numpy(),
+                         'customdata': np.c_[part['station_id'].to_numpy(),
+                                             part.get('name', part['station_id']).to_numpy()],
+                         'marker': {**point['marker'], 'color': colour}})
+            data.append({**average, 'marker': {**average['marker'], 'color': colour}})
+
+        layout = template['layout']
+        shapes = [{**shape, 'y0': alpha, 'y1': alpha} if shape['line'].get('color') == 'red' else shape
+                  for shape in layout.get('shapes', ())]                    # the p = alpha guides
+        return {'data': data, 'layout': _with_note({**layout, 'shapes': shapes}, len(shown), len(stations))}
+
+    def _month_station_distrib(self, countries, months, bands, alpha: float) -> dict:
+        template = self.template('month_station_distrib')
+        violins = {trace['name']: trace for trace in template['data'] if trace['type'] == 'violin'}
+        diamonds = template['data'][-1]
+
+        station = self.station_months(countries, months, bands)
+        shown = decimate(station[['month_name', 'slope_theil_per_decade', 'p', 'station_id', 'country']],
+                         'slope_theil_per_decade', by='month_name').round(4)
+        month = shown['month_name'].to_numpy()
+        data = []
+        for name in [m for m in self.months if m in set(month)]:
+            part = shown[month == name]
+            data.append({**violins[name], 'x': part['month_name'].to_numpy(),
+                         'y': part['slope_theil_per_decade'].to_numpy(),
+                         'customdata': part[['p', 'station_id', 'country']].to_numpy()})
+        macro = self._month_macro.reindex([m for m in self.months if m in set(months)]).dropna()
+        data.append({**diamonds, 'x': macro.index.to_numpy(dtype=object), 'y': macro.to_numpy()})
+
+        layout = template['layout']
+        xaxis = {**layout['xaxis'], 'categoryarray': [trace['name'] for trace in data[:-1]]}
+        return {'data': data, 'layout': _with_note({**layout, 'xaxis': xaxis}, len(shown), len(station))}
+
+    def _country_month_heatmap(self, countries, months, bands, alpha: float) -> dict:
+        template = self.template('country_month_heatmap')
+        rows, stations, percent, median = self.country_month_grid(countries, months, bands, alpha)
+        found = rows.any(axis=1)                                             # countries with any station-month
+        empty = rows[found] == 0
+        percent = np.where(empty, np.nan, percent[found])
+        text = np.where(empty, '', np.char.mod('%.0f%%', percent)).astype(object)
+
+        heat = {**template['data'][0],
+                'x': np.asarray(self.months, dtype=object)[_positions(self.months, months)],
+                'y': np.asarray(self.countries, dtype=object)[_positions(self.countries, countries)][found],
+                'z': np.where(empty, np.nan, median[found]),
+                'customdata': np.dstack([percent, np.where(empty, np.nan, stations[found])]),
+                'text': text}
+        return {'data': [heat], 'layout': _retitle(template['layout'], alpha)}
+
+    def _elevation_heatmap(self, countries, months, bands, alpha: float) -> dict:
+        template = self.template('elevation_heatmap')
+        band_at, month_at = _positions(self.bands, bands), _positions(self.months, months)
+        grid = {column: values[np.ix_(band_at, month_at)] for column, values in self._elevation.items()}
+        band_names = np.asarray(self.bands, dtype=object)[band_at]
+        month_names = np.asarray(self.months, dtype=object)[month_at]
+
+        avg = self.avg_elevation_month
+        sig = avg[avg['month_name'].isin(month_names) & avg['elevation_band'].isin(band_names) & (avg['p'] <= alpha)]
+        heat, dots = template['data']
+        heat = {**heat, 'x': month_names, 'y': band_names, 'z': grid['slope_per_decade'],
+                'customdata': np.dstack([grid['p'], grid['n_years'], grid['median_stations_per_year']])}
+        dots = {**dots, 'x': sig['month_name'].to_numpy(), 'y': sig['elevation_band'].to_numpy(),
+                'customdata': sig['p'].to_numpy()}
+
+        layout = template['layout']
+        labels = dict(zip(layout['yaxis']['tickvals'], layout['yaxis']['ticktext']))
+        bound = np.nanmax(np.abs(grid['slope_per_decade']))
+        layout = {**layout,
+                  'xaxis': {**layout['xaxis'], 'categoryarray': list(month_names)},
+                  'yaxis': {**layout['yaxis'], 'categoryarray': list(band_names), 'tickvals': list(band_names),
+                            'ticktext': [labels[band] for band in band_names]},
+                  'coloraxis': {**layout['coloraxis'], 'cmin': -bound, 'cmax': bound}}
+        return {'data': [heat, dots], 'layout': _retitle(layout, alpha)}
+
+
+class FilteredFigures:
+    """
+    Filtered figures of a FigureRegistry's datasets: the FilterIndex is
+    rebuilt when an input file changes, and rendered figures (as plain dicts,
+    ready for dcc.Graph) are kept in an LRU of FIGURE_CACHE_SIZE entries.
+    """
+
+    NAMES = tuple(FIGURE_CONTROLS)
+
+    def __init__(self, registry, station_month: str, per_station: str, avg_country: str, avg_month: str,
+                 avg_country_month: str, avg_elevation_month: str, cache_size: int = FIGURE_CACHE_SIZE):
+        self.registry = registry
+        self.inputs = (station_month, per_station, avg_country, avg_month, avg_country_month, avg_elevation_month)
+        self.cache_size = cache_size
+        self._index = (None, None)                  # (inputs key, FilterIndex)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def index(self) -> FilterIndex:
+        """The FilterIndex of the current input files."""
+        key = self.registry.files_key(*self.inputs)
+        if self._index[0] != key:
+            with self._lock:
+                if self._index[0] != key:
+                    start = time.perf_counter()
+                    datasets = [self.registry.dataset(path) for path in self.inputs]
+                    with span('filter_index_build'):
+                        index = FilterIndex(*datasets)
+                    self._index = (key, index)
+                    self._cache.clear()
+                    logger.info('Built filter index in %.3f s', time.perf_counter() - start)
+        return self._index[1]
+
+    def figure(self, name: str, countries, months, bands, alpha: float = DEFAULT_ALPHA) -> dict:
+        """
+        A filtered figure as a dict. The LRU is keyed on the controls the
+        figure depends on only, so e.g. a threshold change reuses every cached
+        month distribution.
+        """
+        index = self.index()
+        selection = {'countries': tuple(c for c in index.countries if c in set(countries or ())),
+                     'months': tuple(m for m in index.months if m in set(months or ())),
+                     'bands': tuple(b for b in index.bands if b in set(bands or ())),
+                     'alpha': float(alpha)}
+        controls = FIGURE_CONTROLS[name]
+        key = (self._index[0], name, *(selection[control] for control in controls))
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                CACHE_REQUESTS.inc(cache='filtered_figure', result='hit')
+                return self._cache[key]
+
+        CACHE_REQUESTS.inc(cache='filtered_figure', result='miss')
+        if all(selection[control] for control in controls if control != 'alpha'):
+            with span('filtered_figure_build', figure=name):
+                figure = index.figure(name, selection['countries'], selection['months'], selection['bands'],
+                                      selection['alpha'])
+        else:
+            figure = EMPTY_FIGURE
+        with self._lock:
+            self._cache[key] = figure
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return figure
+
+    def warm_up(self, background: bool = True) -> threading.Thread | None:
+        """Build the index (and the unfiltered figures) now, or on a daemon thread."""
+        def build():
+            try:
+                index = self.index()
+                for name in self.NAMES:
+                    self.figure(name, index.countries, index.months, index.bands)
+            except Exception:
+                logger.exception('Warm-up of the filter index failed')
+
+        if not background:
+            build()
+            return None
+        thread = threading.Thread(target=build, name='filter-warm-up', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,242 @@
+# app/registry.py
+
+# Figure registry
+#
+# Figures are declared once with the datasets they read and built the first
+# time they are requested (or by an optional warm-up thread). Each built
+# figure is memoized under a hash of its input files, so a changed CSV
+# triggers a rebuild while repeat requests are served from memory.
+#
+# `python -m app.build_figures` renders every figure ahead of time to Plotly
+# JSON named by a content hash of its inputs and code version; the app serves
+# those files as-is (the hash doubles as the HTTP ETag). Under a pre-fork
+# server, `preload` loads the inputs and figure bytes once in the master.
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+from Scripts.data_cache import file_sha256
+from Scripts.metrics import BYTES_READ, CACHE_REQUESTS, REGISTRY as METRICS, span
+
+logger = logging.getLogger(__name__)
+
+FIGURE_BUILD_SECONDS = METRICS.histogram('snowpack_figure_build_seconds', 'Plotly figure construction time',
+                                         ['figure'])
+FIGURE_PAYLOAD_BYTES = METRICS.gauge('snowpack_figure_payload_bytes', 'Serialized size of the current figure version',
+                                     ['figure'])
+
+
+@dataclass
+class FigureSpec:
+    """One registered figure: builder(*datasets) -> plotly Figure."""
+    name: str
+    builder: Callable
+    inputs: tuple
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    key: str | None = None
+    figure: object = None
+    payload: tuple | None = None                    # (content hash, JSON bytes)
+
+
+class FigureRegistry:
+    """
+    Lazy, memoized figures.
+
+    load_dataset(relative_path) reads one input; root resolves relative
+    paths for the input hash (file size and mtime). artifact_dir holds the
+    prebuilt JSON figures.
+    """
+
+    def __init__(self, load_dataset: Callable, root: Path, artifact_dir: Path | None = None):
+        self.load_dataset = load_dataset
+        self.root = Path(root)
+        self.artifact_dir = Path(artifact_dir) if artifact_dir else None
+        self.specs: dict[str, FigureSpec] = {}
+        self._datasets: dict[str, tuple] = {}       # relative path -> (file key, DataFrame)
+        self._datasets_lock = threading.Lock()
+        self._digests: dict[str, tuple] = {}        # file path -> (file key, SHA-256)
+
+    def register(self, name: str, builder: Callable, *inputs: str) -> None:
+        """Declare a figure and the datasets passed positionally to its builder."""
+        if name in self.specs:
+            raise ValueError(f'Figure {name!r} is already registered')
+        self.specs[name] = FigureSpec(name, builder, tuple(inputs))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.specs
+
+    def __iter__(self):
+        return iter(self.specs)
+
+    # Inputs
+
+    def _file_key(self, relative_path: str) -> str:
+        stat = os.stat(self.root / relative_path)
+        return f'{relative_path}:{stat.st_size}:{stat.st_mtime_ns}'
+
+    def files_key(self, *relative_paths: str) -> tuple:
+        """(path, size, mtime) key of input files; changes whenever one of them does."""
+        return tuple(self._file_key(relative_path) for relative_path in relative_paths)
+
+    def input_hash(self, name: str) -> str:
+        """Hash of a figure's input files (path, size, mtime)."""
+        spec = self.specs[name]
+        digest = hashlib.sha256(name.encode())
+        for relative_path in spec.inputs:
+            digest.update(self._file_key(relative_path).encode())
+        return digest.hexdigest()
+
+    def _file_digest(self, path: Path) -> str:
+        """SHA-256 of a file, recomputed only when its size / mtime change."""
+        stat = os.stat(path)
+        file_key = (stat.st_size, stat.st_mtime_ns)
+        cached = self._digests.get(str(path))
+        if cached is None or cached[0] != file_key:
+            cached = (file_key, file_sha256(path))
+            self._digests[str(path)] = cached
+        return cached[1]
+
+    def content_hash(self, name: str) -> str:
+        """Hash of a figure's input file contents and code version (builder source, plotly version)."""
+        import plotly
+
+        spec = self.specs[name]
+        digest = hashlib.sha256(name.encode())
+        digest.update(self._file_digest(Path(inspect.getsourcefile(spec.builder))).encode())
+        digest.update(plotly.__version__.encode())
+        for relative_path in spec.inputs:
+            digest.update(relative_path.encode())
+            digest.update(self._file_digest(self.root / relative_path).encode())
+        return digest.hexdigest()
+
+    def dataset(self, relative_path: str):
+        """Load one input once per file version; shared by every figure reading it."""
+        file_key = self._file_key(relative_path)
+        with self._datasets_lock:
+            cached = self._datasets.get(relative_path)
+            if cached is None or cached[0] != file_key:
+                cached = (file_key, self.load_dataset(relative_path))
+                self._datasets[relative_path] = cached
+        return cached[1]
+
+    # Figures
+
+    def get(self, name: str):
+        """The figure, built on first request and rebuilt only when its inputs change."""
+        spec = self.specs[name]
+        key = self.input_hash(name)
+        if spec.key == key:
+            return spec.figure
+
+        with spec.lock:                             # one build per figure at a time
+            if spec.key != key:
+                start = time.perf_counter()
+                datasets = [self.dataset(path) for path in spec.inputs]
+                with span('figure_build', figure=name):
+                    figure = spec.builder(*datasets)
+                spec.figure, spec.key = figure, key
+                FIGURE_BUILD_SECONDS.observe(time.perf_counter() - start, figure=name)
+                logger.info('Built figure %s in %.3f s', name, time.perf_counter() - start)
+        return spec.figure
+
+    # Serialized figures
+
+    def artifact_path(self, name: str, content_hash: str) -> Path:
+        """Prebuilt artifact of one figure version: <artifact_dir>/<name>.<hash[:16]>.json"""
+        return self.artifact_dir / f'{name}.{content_hash[:16]}.json'
+
+    def payload(self, name: str) -> tuple:
+        """
+        (content hash, Plotly JSON bytes) of a figure: the prebuilt artifact
+        when one matches the current inputs, otherwise built and serialized here.
+        """
+        spec = self.specs[name]
+        content_hash = self.content_hash(name)
+        if spec.payload and spec.payload[0] == content_hash:
+            CACHE_REQUESTS.inc(cache='figure_payload', result='hit')
+            return spec.payload
+
+        CACHE_REQUESTS.inc(cache='figure_payload', result='miss')
+        path = self.artifact_path(name, content_hash) if self.artifact_dir else None
+        if path is not None and path.exists():
+            body = path.read_bytes()
+            BYTES_READ.inc(len(body), source='artifact')
+        else:
+            figure = self.get(name)
+            with span('figure_serialize', figure=name) as record:
+                body = figure.to_json().encode()
+                record['bytes'] = len(body)
+            logger.info('No prebuilt artifact for figure %s; serialized at runtime', name)
+        FIGURE_PAYLOAD_BYTES.set(len(body), figure=name)
+        spec.payload = (content_hash, body)
+        return spec.payload
+
+    def build_artifacts(self, names=None) -> dict:
+        """Render figures to artifact_dir, drop superseded versions and write manifest.json."""
+        self.artifact_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.artifact_dir / 'manifest.json'
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+        for name in names or self.specs:
+            content_hash = self.content_hash(name)
+            path = self.artifact_path(name, content_hash)
+            if not path.exists():
+                tmp = path.with_suffix('.tmp')
+                tmp.write_bytes(self.get(name).to_json().encode())
+                os.replace(tmp, path)
+            for old in self.artifact_dir.glob(f'{name}.*.json'):
+                if old != path:
+                    old.unlink()
+            manifest[name] = {'file': path.name, 'hash': content_hash, 'bytes': path.stat().st_size,
+                              'inputs': list(self.specs[name].inputs)}
+
+        manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+        return manifest
+
+    def preload(self, names=None, keep_figures: bool = False) -> dict:
+        """
+        Load every input and serialized figure of `names` (default: all) now,
+        e.g. in a pre-fork server master. Built Figure objects are released
+        afterwards unless keep_figures: requests are answered from the JSON
+        bytes, and a large graph of Python objects would only be copied page by
+        page into each worker as its reference counts change. Returns
+        name -> payload bytes.
+        """
+        names = list(names or self.specs)
+        for relative_path in dict.fromkeys(path for name in names for path in self.specs[name].inputs):
+            self.dataset(relative_path)
+
+        sizes = {}
+        for name in names:
+            sizes[name] = len(self.payload(name)[1])
+            if not keep_figures:
+                spec = self.specs[name]
+                with spec.lock:
+                    spec.figure, spec.key = None, None          # rebuilt by get() if ever needed
+        return sizes
+
+    def warm_up(self, names=None, background: bool = True) -> threading.Thread | None:
+        """Load or build `names` (default: every figure) now, or on a daemon thread."""
+        names = list(names or self.specs)
+
+        def build_all():
+            for name in names:
+                try:
+                    self.payload(name)
+                except Exception:
+                    logger.exception('Warm-up of figure %s failed', name)
+
+        if not background:
+            build_all()
+            return None
+        thread = threading.Thread(target=build_all, name='figure-warm-up', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,11 @@
+# benchmarks/__main__.py
+import sys
+from pathlib import Path
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+# Run the benchmark suite
+from benchmarks.suite import main
+main()
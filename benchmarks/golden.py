@@ -0,0 +1,265 @@
+# benchmarks/golden.py
+
+# Golden outputs
+#
+# The batched engines replace tables notebook 03 built with groupby passes and
+# per-group Python, and their CSVs are meant to stay byte-identical. This check
+# keeps those reference definitions, runs them and the engines on a synthetic
+# dataset (benchmarks/synthetic.py) and compares the CSV text of every table;
+# the aggregated trends are checked on both the sorted and the cube path.
+# Differences are reported per column with the largest relative error, and the
+# command exits with status 1.
+#
+#   python -m benchmarks.golden --stations 300 800 --seed 0 1
+
+import argparse
+import contextlib
+import io
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+from benchmarks import synthetic
+
+# Scales (stations) and synthetic datasets checked by default (seed 1 at 300 stations has a
+# Hamed–Rao correction that is not finite)
+STATIONS = [300, 800]
+SEEDS = [0, 1]
+
+
+# Reference definitions (notebook 03)
+
+def pct_sig(p: pd.Series) -> float:
+    """Percent of the non-missing p-values below 0.05 (notebook 03 pct_sig)."""
+    p = p.dropna()
+    return 100 * (p < 0.05).sum() / max(len(p), 1)
+
+
+def stouffer_p(ps, signs=None, weights=None) -> float:
+    """
+    Stouffer combination of independent two-sided p-values (notebook 03
+    stouffer_p): each p in (0, 1] becomes a Z-score, signed by `signs`, the
+    weighted Z-scores are summed and the sum is turned back into a two-sided p.
+    """
+    from scipy.stats import norm
+
+    ps = np.asarray(ps, float)
+    ok = np.isfinite(ps) & (ps > 0) & (ps <= 1)
+    ps = ps[ok]
+    if ps.size == 0:
+        return np.nan
+    z = norm.isf(ps / 2.0)                 # two-sided p -> Z
+    if signs is not None:
+        signs = np.asarray(signs, float)[ok]
+        z = z * np.sign(signs)             # give Z a direction
+    if weights is None:
+        Z = z.sum() / np.sqrt(len(z))
+    else:
+        w = np.asarray(weights, float)[ok]
+        Z = (w * z).sum() / np.sqrt((w ** 2).sum())
+    return 2 * norm.sf(abs(Z))             # combined two-sided p
+
+
+def reference_station_tables(snow_recordings: pd.DataFrame, per_station_month: pd.DataFrame) -> dict:
+    """Country-month, country and per-station summaries as groupby passes and a per-station apply."""
+    tested_all = per_station_month[per_station_month['trend'].isin(['increasing', 'decreasing', 'no trend'])].copy()
+
+    country_month = (tested_all.groupby(['country', 'country_abr', 'month', 'month_name'])
+        .agg(num_stations=('station_id', 'nunique'),
+             median_years=('n_years', 'median'),
+             percent_sig=('p', pct_sig),
+             median_slope_theil_per_year=('slope_theil', 'median'),
+             median_slope_theil_per_decade=('slope_theil_per_decade', 'median'),
+             mean_slope_theil_per_year=('slope_theil', 'mean'),
+             mean_slope_theil_per_decade=('slope_theil_per_decade', 'mean'))
+        .reset_index()
+        .sort_values(['country', 'country_abr', 'month', 'month_name']))
+
+    country_overall = (tested_all.groupby(['country', 'country_abr'])
+                       .agg(n_station_month_series=('station_id', 'count'),
+                            n_stations=('station_id', 'nunique'),
+                            median_years=('n_years', 'median'),
+                            percent_sig_station_month_series=('p', pct_sig),
+                            median_station_slope_cm_per_year=('slope_theil', 'median'),
+                            median_station_slope_cm_per_decade=('slope_theil_per_decade', 'median'),
+                            mean_station_slope_cm_per_year=('slope_theil', 'mean'),
+                            mean_station_slope_cm_per_decade=('slope_theil_per_decade', 'mean'))
+                       .reset_index())
+
+    per_station_sig = (tested_all
+        .groupby(['country', 'country_abr', 'station_id'], as_index=False)
+        .apply(lambda g: pd.Series({
+            'p_combined': stouffer_p(g['p'].values, signs=np.sign(g['slope_theil'].values),
+                                     weights=np.sqrt(g['n_years'].values)),
+        }), include_groups=False)
+        .reset_index(drop=True))
+
+    per_station = (tested_all.groupby(['country', 'country_abr', 'station_id'])
+                   .agg(n_months=('month', 'nunique'),
+                        median_slope_theil_per_year=('slope_theil', 'median'),
+                        median_slope_theil_per_decade=('slope_theil_per_decade', 'median'),
+                        mean_slope_theil_per_year=('slope_theil', 'mean'),
+                        mean_slope_theil_per_decade=('slope_theil_per_decade', 'mean'))
+                   .reset_index())
+    per_station = per_station.join(per_station_sig[['station_id', 'p_combined']].set_index('station_id'),
+                                   on='station_id', how='inner')
+
+    return {'country_month': country_month, 'country_overall': country_overall, 'per_station': per_station}
+
+
+def reference_aggregate(group_df: pd.DataFrame, coverage_range: bool = False) -> pd.Series:
+    """MK (pymannkendall) on one aggregated yearly series (notebook 03 mk_country_month, ..., mk_elevation)."""
+    import pymannkendall as mk
+    from Scripts.mann_kendall import MIN_YEARS
+
+    group_df = group_df.sort_values('year')
+    y = group_df['hn_mean'].astype(float).to_numpy()
+    ok = np.isfinite(y)
+    y = y[ok]
+    n_years = len(y)
+
+    stations_median = stations_min = stations_max = np.nan
+    stations = group_df.loc[ok, 'n_stations'].to_numpy()
+    if stations.size:
+        stations_median = int(np.median(stations))
+        stations_min = int(stations.min())
+        stations_max = int(stations.max())
+
+    if n_years < MIN_YEARS:
+        record = {'n_years': n_years, 'median_stations_per_year': stations_median}
+        if coverage_range:
+            record.update({'stations_min_per_year': stations_min, 'stations_max_per_year': stations_max})
+        record.update({'p': np.nan, 'tau': np.nan, 'slope_per_year': np.nan,
+                       'slope_per_decade': np.nan, 'variant': 'insufficient'})
+        return pd.Series(record)
+
+    try:
+        with np.errstate(invalid='ignore'):                  # a negative corrected var(S) gives p NaN
+            results = mk.hamed_rao_modification_test(y)
+        variant = 'hamed_rao'
+    except Exception:
+        results = mk.original_test(y)
+        variant = 'original'
+
+    return pd.Series({
+        'n_years': n_years,
+        'median_stations_per_year': stations_median,
+        'trend': results.trend,
+        'p': results.p,
+        'tau': results.Tau,
+        'slope_per_year': results.slope,
+        'slope_per_decade': results.slope * 10,
+        'variant': variant,
+    })
+
+
+def reference_region_tables(snow_recordings: pd.DataFrame, sets: dict | None = None) -> dict:
+    """
+    Aggregated trend tables as one groupby pass per set and a pymannkendall
+    call per group. The records are collected per group rather than through
+    groupby.apply, which stacks them into an (index, 0) table as soon as one
+    group is "insufficient"; columns keep the order of a complete record.
+    """
+    from Scripts.aggregates import GROUPING_SETS, MIN_STATIONS_PER_YEAR
+
+    tables = {}
+    for name, spec in (sets or GROUPING_SETS).items():
+        keys = list(spec.keys)
+        series = (snow_recordings.groupby(keys + ['year'])
+                  .agg(n_stations=('station_id', 'nunique'), hn_mean=('hnsum', 'median'))
+                  .reset_index())
+        series = series[series['n_stations'] >= MIN_STATIONS_PER_YEAR]
+
+        records = [{**dict(zip(keys, group)), **reference_aggregate(rows, spec.coverage_range)}
+                   for group, rows in series.groupby(keys)]
+        table = pd.DataFrame(records).infer_objects()
+        columns = keys + ['n_years', 'median_stations_per_year', 'stations_min_per_year', 'stations_max_per_year',
+                          'trend', 'p', 'tau', 'slope_per_year', 'slope_per_decade', 'variant']
+        tables[name] = table[[column for column in columns if column in table]]
+    return tables
+
+
+# Comparison
+
+def compare_tables(reference: dict, engine: dict) -> list:
+    """One record per table of `reference`: whether its CSV text matches, and the columns that differ."""
+    records = []
+    for name, expected in reference.items():
+        actual = engine[name]
+        record = {'table': name, 'identical': expected.to_csv(index=False) == actual.to_csv(index=False),
+                  'differences': {}}
+        if not record['identical']:
+            if list(expected.columns) != list(actual.columns) or len(expected) != len(actual):
+                record['differences']['shape'] = (f'{len(expected)} x {list(expected.columns)} vs '
+                                                  f'{len(actual)} x {list(actual.columns)}')
+            else:
+                expected, actual = expected.reset_index(drop=True), actual.reset_index(drop=True)
+                for column in expected.columns:
+                    if expected[column].astype(str).equals(actual[column].astype(str)):
+                        continue
+                    if expected[column].dtype.kind == 'f' and actual[column].dtype.kind == 'f':
+                        a, b = expected[column].to_numpy(), actual[column].to_numpy()
+                        with np.errstate(invalid='ignore', divide='ignore'):
+                            error = np.abs(a - b) / np.maximum(np.abs(a), np.finfo(float).tiny)
+                        nan_mismatch = int((np.isnan(a) != np.isnan(b)).sum())
+                        record['differences'][column] = (f'max relative error {np.nanmax(error, initial=0):.2e}'
+                                                         + (f', {nan_mismatch} NaN mismatches' if nan_mismatch else ''))
+                    else:
+                        record['differences'][column] = f'{int((expected[column] != actual[column]).sum())} values'
+        records.append(record)
+    return records
+
+
+def check(stations: int, years: int = synthetic.YEARS, n_providers: int = synthetic.PROVIDERS, seed: int = 0) -> list:
+    """Reference vs engine tables on a synthetic dataset of `stations` stations."""
+    from Scripts.cube import build_cube
+    from Scripts.functions import get_country_abr, get_month_name
+    from Scripts.trends import region_tables, station_month_series, station_tables, test_station_months
+
+    recordings = synthetic.snow_recordings(stations, years, n_providers, seed=seed)
+    recordings = recordings.assign(month_name=recordings['month'].map(get_month_name),
+                                   country_abr=recordings['country'].map(get_country_abr))
+    with contextlib.redirect_stdout(io.StringIO()):
+        per_station_month = test_station_months(station_month_series(recordings))
+
+    region_reference = reference_region_tables(recordings)
+    by_cube = compare_tables(region_reference, region_tables(recordings, cube=build_cube(recordings)))
+    return (compare_tables(reference_station_tables(recordings, per_station_month),
+                           station_tables(recordings, per_station_month))
+            + compare_tables(region_reference, region_tables(recordings))
+            + [{**record, 'table': f'{record["table"]} (cube)'} for record in by_cube])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.golden',
+                                     description='Compare the trend engines with the notebook 03 definitions.')
+    parser.add_argument('--stations', type=int, nargs='+', default=STATIONS, help='scales to check')
+    parser.add_argument('--years', type=int, default=synthetic.YEARS, help='winters per dataset')
+    parser.add_argument('--providers', type=int, default=synthetic.PROVIDERS, help='data providers per dataset')
+    parser.add_argument('--seed', type=int, nargs='+', default=SEEDS, help='random seeds of the synthetic data')
+    args = parser.parse_args(argv)
+
+    failed = 0
+    print(f'{"table":<32}{"stations":>8}{"seed":>6}')
+    for stations in sorted(set(args.stations)):
+        for seed in args.seed:
+            for record in check(stations, args.years, args.providers, seed):
+                failed += not record['identical']
+                print(f'{record["table"]:<32}{stations:>8,}{seed:>6}  '
+                      f'{"identical" if record["identical"] else "DIFFERS"}')
+                for column, difference in record['differences'].items():
+                    print(f'    {column}: {difference}')
+
+    print(f'\nTables differing from the reference: {failed}')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+# benchmarks/suite.py
+
+# Benchmark suite
+#
+# For every requested scale (number of stations) a synthetic dataset is
+# generated (benchmarks/synthetic.py) and each stage is timed on it: the
+# station-month series and per-series Mann–Kendall / Theil–Sen tests, the
+# station summaries, the snow cube and aggregated trend rollups (with one extra
+# grouping set, to show the cost of a new breakdown), read_dataset
+# (CSV parse and memory-mapped sidecar) and every Scripts/figures.py builder.
+# Each benchmark runs `repeat` times; the fastest run is reported.
+#
+# Results are written as JSON. Given a baseline result file, benchmarks that
+# got slower than `threshold` x the baseline (by more than a noise floor) are
+# reported as regressions and the command exits with status 1.
+#
+#   python -m benchmarks --stations 800 2500 10000 --out benchmarks/results/main.json
+#   python -m benchmarks --stations 800 --baseline benchmarks/results/main.json
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+from benchmarks import synthetic
+
+# Scales (stations) and runs per benchmark
+STATIONS = [800, 2500, 10000]
+REPEAT = 3
+
+# Regression check: slower than THRESHOLD x baseline and by more than NOISE_FLOOR seconds
+THRESHOLD = 1.25
+NOISE_FLOOR = 0.005
+
+RESULTS_DIR = 'benchmarks/results'
+
+# Scripts/figures.py builder -> Tests tables it draws (Scripts.trends.OUTPUTS names), as registered in app/app.py
+FIGURES = {
+    'country_coverage': ('country_month_macro',),
+    'country_station_slope_distrib': ('station_month', 'country_month_macro'),
+    'country_trends_fig': ('per_station', 'country_macro'),
+    'month_station_slope_distrib': ('station_month', 'month_macro'),
+    'month_trends_fig': ('station_month', 'month_macro'),
+    'country_month_heat': ('country_month_macro', 'country_month'),
+    'elevation_band_heat': ('elevation_macro',),
+}
+
+
+# Timing
+
+def measure(fn, setup=None, repeat: int = REPEAT) -> dict:
+    """
+    Time fn(*setup()) `repeat` times (setup is not timed); returns the fastest
+    and median run in seconds and fn's last return value. Output printed by
+    fn is swallowed.
+    """
+    runs, value = [], None
+    for _ in range(max(repeat, 1)):
+        args = setup() if setup is not None else ()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            value = fn(*args)
+            runs.append(time.perf_counter() - start)
+    return {'seconds': min(runs), 'median': float(np.median(runs)), 'repeat': len(runs), 'value': value}
+
+
+def _record(results: list, name: str, stations: int, timing: dict, **extra) -> dict:
+    record = {'benchmark': name, 'stations': stations,
+              **{k: v for k, v in timing.items() if k != 'value'}, **extra}
+    results.append(record)
+    print(f'{name:<44}{stations:>8,}{record["seconds"]:>11.4f} s', flush=True)
+    return record
+
+
+# Benchmarks
+
+def run_scale(stations: int, work_dir: Path, repeat: int = REPEAT, years: int = synthetic.YEARS,
+              n_providers: int = synthetic.PROVIDERS, seed: int = 0) -> list:
+    """Every benchmark on a synthetic dataset of `stations` stations; returns result records."""
+    from Scripts.aggregates import GROUPING_SETS, GroupingSet
+    from Scripts.cube import build_cube
+    from Scripts.figures import payload_report
+    from Scripts.functions import get_country_abr, get_month_name
+    from Scripts.trends import (OUTPUTS, region_tables, station_month_series, station_tables,
+                                test_station_months, write_tables)
+    import Scripts.figures as figures
+
+    results = []
+    work_dir = Path(work_dir) / f'stations_{stations}'
+
+    # Data
+    timing = measure(lambda: synthetic.snow_recordings(stations, years, n_providers, seed=seed), repeat=1)
+    recordings = timing['value']
+    _record(results, 'synthetic.snow_recordings', stations, timing, rows=len(recordings))
+    recordings = recordings.assign(month_name=recordings['month'].map(get_month_name),
+                                   country_abr=recordings['country'].map(get_country_abr))
+
+    # Per-series tests
+    timing = measure(station_month_series, lambda: (recordings,), repeat)
+    monthly = timing['value']
+    _record(results, 'trends.station_month_series', stations, timing, rows=len(monthly))
+
+    timing = measure(test_station_months, lambda: (monthly,), repeat)
+    per_station_month = timing['value']
+    _record(results, 'trends.test_station_months', stations, timing, series=len(per_station_month))
+
+    # Rollups
+    timing = measure(station_tables, lambda: (recordings, per_station_month), repeat)
+    tables = timing['value']
+    _record(results, 'trends.station_tables', stations, timing)
+
+    timing = measure(build_cube, lambda: (recordings,), repeat)
+    cube = timing['value']
+    _record(results, 'cube.build_cube', stations, timing, cells=int(cube.valid.size))
+
+    timing = measure(region_tables, lambda: (recordings, GROUPING_SETS, cube), repeat)
+    tables.update(timing['value'])
+    _record(results, 'trends.region_tables[cube]', stations, timing)
+    _record(results, 'trends.region_tables[sorted]', stations,
+            measure(region_tables, lambda: (recordings,), repeat))
+    with_provider = {**GROUPING_SETS, 'provider_month_macro': GroupingSet(('provider', 'month', 'month_name'))}
+    _record(results, 'trends.region_tables[cube, +provider_month]', stations,
+            measure(region_tables, lambda: (recordings, with_provider, cube), repeat))
+
+    # read_dataset: CSV parse (+ sidecar write), then the memory-mapped sidecar
+    from app.app import read_dataset
+    from Scripts.data_cache import cache_path
+
+    write_tables(tables, work_dir / 'Tests')
+    csv_path = work_dir / 'Tests' / OUTPUTS['station_month']
+
+    def cold():
+        cache_path(csv_path).unlink(missing_ok=True)
+        return (csv_path,)
+
+    _record(results, 'read_dataset[csv]', stations, measure(read_dataset, cold, repeat),
+            bytes=csv_path.stat().st_size)
+    _record(results, 'read_dataset[arrow]', stations, measure(read_dataset, lambda: (csv_path,), repeat))
+
+    # Figures, from the tables as the app reads them
+    frames = {name: pd.read_csv(work_dir / 'Tests' / file_name) for name, file_name in OUTPUTS.items()}
+    figures.country_coverage(frames['country_month_macro'].copy())     # untimed: Plotly's lazy imports / templates
+    for builder, inputs in FIGURES.items():
+        try:
+            timing = measure(getattr(figures, builder), lambda: tuple(frames[name].copy() for name in inputs), repeat)
+        except (KeyError, ValueError) as error:         # e.g. a table left empty at a very small scale
+            print(f'{"figures." + builder:<44}{stations:>8,}    skipped: {error!r}', flush=True)
+            continue
+        _record(results, f'figures.{builder}', stations, timing, **payload_report(timing['value']))
+    return results
+
+
+# Reports
+
+def scaling(results: list) -> pd.DataFrame:
+    """Seconds per benchmark and scale, with the log-log scaling exponent between the smallest and largest scale."""
+    table = pd.DataFrame(results).pivot_table(index='benchmark', columns='stations', values='seconds', sort=False)
+    if table.shape[1] > 1:
+        n0, n1 = table.columns[0], table.columns[-1]
+        table['exponent'] = np.log(table[n1] / table[n0]) / np.log(n1 / n0)
+    return table
+
+
+def compare(results: list, baseline: list, threshold: float = THRESHOLD, noise_floor: float = NOISE_FLOOR) -> pd.DataFrame:
+    """Benchmarks present in both runs with their baseline / current seconds, ratio and regression flag."""
+    keys = ['benchmark', 'stations']
+    current = pd.DataFrame(results)[keys + ['seconds']]
+    previous = pd.DataFrame(baseline)[keys + ['seconds']]
+    merged = current.merge(previous, on=keys, suffixes=('', '_baseline'))
+    merged['ratio'] = merged['seconds'] / merged['seconds_baseline']
+    merged['regression'] = ((merged['ratio'] > threshold)
+                            & (merged['seconds'] - merged['seconds_baseline'] > noise_floor))
+    return merged
+
+
+def environment() -> dict:
+    """Versions and host details stored with every result file."""
+    import plotly
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'plotly': plotly.__version__,
+        'machine': platform.machine(),
+        'cpus': __import__('os').cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Time every pipeline stage and figure on synthetic data.')
+    parser.add_argument('--stations', type=int, nargs='+', default=STATIONS, help='scales to run')
+    parser.add_argument('--years', type=int, default=synthetic.YEARS, help='winters per dataset')
+    parser.add_argument('--providers', type=int, default=synthetic.PROVIDERS, help='data providers per dataset')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='runs per benchmark (fastest is kept)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic data')
+    parser.add_argument('--out', type=Path, default=None,
+                        help=f'result JSON (default: {RESULTS_DIR}/<timestamp>.json)')
+    parser.add_argument('--baseline', type=Path, default=None, help='result JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='slow-down factor reported as a regression')
+    parser.add_argument('--data-dir', type=Path, default=None,
+                        help='keep the generated datasets here (default: a temporary directory)')
+    args = parser.parse_args(argv)
+
+    print(f'{"benchmark":<44}{"stations":>8}{"fastest":>13}')
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for stations in sorted(set(args.stations)):
+            results += run_scale(stations, args.data_dir or Path(tmp), args.repeat, args.years, args.providers, args.seed)
+
+    out = args.out or REPO_ROOT / RESULTS_DIR / f'{datetime.now():%Y%m%d-%H%M%S}.json'
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps({'environment': environment(), 'results': results}, indent=2))
+
+    with pd.option_context('display.float_format', '{:,.4f}'.format, 'display.width', 160):
+        print('\nSeconds by number of stations \n', scaling(results), sep='')
+    print(f'\nResults Exported To: {out}')
+
+    if args.baseline is not None:
+        report = compare(results, json.loads(args.baseline.read_text())['results'], args.threshold)
+        regressions = report[report['regression']]
+        with pd.option_context('display.float_format', '{:,.4f}'.format, 'display.width', 160):
+            print(f'\nCompared with {args.baseline}: {len(report)} benchmarks, {len(regressions)} regressions')
+            if len(regressions):
+                print(regressions.to_string(index=False))
+        if len(regressions):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
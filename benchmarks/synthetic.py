@@ -0,0 +1,193 @@
+# benchmarks/synthetic.py
+
+# Synthetic snow data
+#
+# The project CSVs are Git LFS pointers, so performance work needs data that
+# can be generated anywhere. This module writes a snow_recordings.csv with the
+# columns and dtypes of the one notebook 02 exports (winter station-months of
+# monthly new snow, joined to station metadata) at any number of stations,
+# years and providers, and derives the Data/Cleaned/Tests tables from it with
+# the stages of Scripts/trends.py, so every table has the real schema.
+#
+# Stations get a country (through their provider), an elevation drawn around
+# the observed distribution, a record span with missing winters, and a
+# declining hnsum trend with station / month / elevation effects.
+#
+#   python -m benchmarks.synthetic --stations 10000 --out /tmp/snow
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Directories
+REPO_ROOT = Path(__file__).resolve().parent.parent      # Main Repo Directory
+sys.path.insert(0, str(REPO_ROOT))                      # Assign REPO ROOT as Directory 0 for Import searches
+
+from Scripts.functions import get_country_abr
+
+# Default scale: roughly the stations used by notebook 03
+STATIONS = 800
+YEARS = 74
+LAST_YEAR = 2023
+PROVIDERS = 6
+
+# One provider per country, in the order extra providers are added
+BASE_PROVIDERS = {
+    'Austria': 'AT_HZB',
+    'Switzerland': 'CH_METEOSWISS',
+    'Germany': 'DE_DWD',
+    'France': 'FR_METEOFRANCE',
+    'Slovenia': 'SI_ARSO',
+    'Italy': 'IT_BZ',
+}
+
+WINTER_MONTHS = [11, 12, 1, 2, 3, 4, 5]
+
+# Columns of snow_recordings.csv, in export order
+SNOW_RECORDINGS_COLUMNS = ['id', 'station_id', 'year', 'month', 'hnsum', 'winter', 'name', 'latitude',
+                           'longitude', 'elevation', 'country', 'provider', 'geometry', 'elevation_band']
+
+# Mean monthly new snow (cm) at 1,000 m, by month
+MONTH_HN = {11: 25, 12: 45, 1: 55, 2: 50, 3: 45, 4: 25, 5: 8}
+
+
+def providers(n: int = PROVIDERS) -> pd.DataFrame:
+    """n provider codes and their countries (base providers first, then regional ones)."""
+    countries = list(BASE_PROVIDERS)
+    rows = []
+    for i in range(max(n, 1)):
+        country = countries[i % len(countries)]
+        code = BASE_PROVIDERS[country] if i < len(countries) else f'{get_country_abr(country)}_R{i // len(countries)}'
+        rows.append({'provider': code, 'country': country})
+    return pd.DataFrame(rows)
+
+
+def elevation_band(elevation: np.ndarray) -> np.ndarray:
+    """Elevation band labels of notebook 02 (≤1,000 m, 1,001–2,000 m, >2,000 m)."""
+    return np.where(elevation <= 1000, 'Low Elevation', np.where(elevation <= 2000, 'Mid Elevation', 'High Elevation'))
+
+
+def station_table(stations: int = STATIONS, n_providers: int = PROVIDERS, seed: int = 0) -> pd.DataFrame:
+    """Station metadata: id, name, coordinates, elevation, country, provider and geometry."""
+    rng = np.random.default_rng(seed)
+    provider = providers(n_providers).iloc[rng.integers(0, max(n_providers, 1), stations)].reset_index(drop=True)
+
+    latitude = rng.uniform(44.0, 48.0, stations).round(5)
+    longitude = rng.uniform(5.5, 16.0, stations).round(5)
+    elevation = np.clip(rng.lognormal(np.log(930), 0.45, stations), 163, 2964).round().astype(int)
+
+    # ETRS89-LAEA (EPSG:3035) point strings, as the notebook's GeoDataFrame exports them
+    x = 4321000 + (longitude - 10) * 76000 + rng.normal(0, 50, stations)
+    y = 3210000 + (latitude - 52) * 111000 + rng.normal(0, 50, stations)
+    station_id = np.arange(1, stations + 1)
+    return pd.DataFrame({
+        'station_id': station_id,
+        'name': [f'Station{s}_{p}' for s, p in zip(station_id, provider['provider'])],
+        'latitude': latitude,
+        'longitude': longitude,
+        'elevation': elevation,
+        'country': provider['country'].to_numpy(),
+        'provider': provider['provider'].to_numpy(),
+        'geometry': [f'POINT ({a:.3f} {b:.3f})' for a, b in zip(x, y)],
+        'elevation_band': elevation_band(elevation),
+    })
+
+
+def snow_recordings(stations: int = STATIONS, years: int = YEARS, n_providers: int = PROVIDERS,
+                    last_year: int = LAST_YEAR, seed: int = 0) -> pd.DataFrame:
+    """A snow_recordings table (one row per station, winter year-month) at the requested scale."""
+    rng = np.random.default_rng(seed)
+    meta = station_table(stations, n_providers, seed)
+    first_year = last_year - years + 1
+
+    # Record span per station: most long-running, some short (they drop out of the tests)
+    start = first_year + np.minimum(rng.exponential(years * 0.25, stations), years - 1).astype(int)
+    length = np.maximum(rng.integers(years // 3, years + 1, stations), 5)
+    stop = np.minimum(start + length, last_year + 1)
+
+    station_years = stop - start
+    station = np.repeat(np.arange(stations), station_years)
+    year = start[station] + (np.arange(len(station)) - np.repeat(np.cumsum(station_years) - station_years, station_years))
+    keep = (rng.random(len(year)) > 0.08) | (year == start[station])    # missing winters (never the first)
+    station, year = station[keep], year[keep]
+
+    months = np.array(WINTER_MONTHS)
+    station = np.repeat(station, len(months))
+    year = np.repeat(year, len(months))
+    month = np.tile(months, len(station) // len(months))
+    keep = rng.random(len(month)) > 0.03                                # missing months
+    station, year, month = station[keep], year[keep], month[keep]
+
+    # hnsum: seasonal mean scaled by elevation, a per-station trend and gamma noise
+    elevation = meta['elevation'].to_numpy()[station]
+    mean = pd.Series(month).map(MONTH_HN).to_numpy() * (elevation / 1000) ** 0.8
+    trend = rng.normal(-0.004, 0.004, stations)[station]                # relative change per year
+    mean = mean * np.clip(1 + trend * (year - first_year), 0.05, None) * rng.lognormal(0, 0.25, stations)[station]
+    hnsum = rng.gamma(2.0, mean / 2.0).round(1)
+    hnsum[rng.random(len(hnsum)) < 0.02] = 0.0
+
+    recordings = meta.iloc[station].reset_index(drop=True)
+    recordings.insert(1, 'year', year)
+    recordings.insert(2, 'month', month)
+    recordings.insert(3, 'hnsum', hnsum)
+    recordings.insert(4, 'winter', True)
+    recordings = recordings.sort_values(['year', 'month', 'station_id'], kind='stable').reset_index(drop=True)
+    recordings.insert(0, 'id', rng.permutation(len(recordings)) + 1)
+    return recordings[SNOW_RECORDINGS_COLUMNS]
+
+
+def tests_tables(recordings: pd.DataFrame, workers: int = 1) -> dict:
+    """Every Data/Cleaned/Tests table of a snow_recordings frame (Scripts.trends.OUTPUTS names)."""
+    from Scripts.functions import get_month_name
+    from Scripts.trends import region_tables, station_month_series, station_tables, test_station_months
+
+    recordings = recordings.assign(month_name=recordings['month'].map(get_month_name),
+                                   country_abr=recordings['country'].map(get_country_abr))
+    per_station_month = test_station_months(station_month_series(recordings), workers)
+    tables = station_tables(recordings, per_station_month)
+    tables.update(region_tables(recordings))
+    return tables
+
+
+def write_dataset(out_dir: Path, stations: int = STATIONS, years: int = YEARS, n_providers: int = PROVIDERS,
+                  seed: int = 0, workers: int = 1) -> dict:
+    """
+    Write <out_dir>/snow_recordings.csv and <out_dir>/Tests/*.csv. Returns
+    table name -> path (snow_recordings plus the Scripts.trends.OUTPUTS names).
+    """
+    from Scripts.trends import OUTPUTS, write_tables
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    recordings = snow_recordings(stations, years, n_providers, seed=seed)
+    recordings.to_csv(out_dir / 'snow_recordings.csv', index=False)
+    write_tables(tests_tables(recordings, workers), out_dir / 'Tests')
+
+    paths = {'snow_recordings': out_dir / 'snow_recordings.csv'}
+    paths.update({name: out_dir / 'Tests' / file_name for name, file_name in OUTPUTS.items()})
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.synthetic',
+                                     description='Write a synthetic snow_recordings.csv and its Tests tables.')
+    parser.add_argument('--out', type=Path, required=True, help='directory the CSVs are written to')
+    parser.add_argument('--stations', type=int, default=STATIONS, help='number of stations')
+    parser.add_argument('--years', type=int, default=YEARS, help=f'winters up to {LAST_YEAR}')
+    parser.add_argument('--providers', type=int, default=PROVIDERS, help='number of data providers')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--workers', type=int, default=1, help='processes for the station-month tests')
+    args = parser.parse_args(argv)
+
+    paths = write_dataset(args.out, args.stations, args.years, args.providers, args.seed, args.workers)
+    recordings = pd.read_csv(paths['snow_recordings'], usecols=['station_id'])
+    print(f'Stations: {recordings["station_id"].nunique():,} \n'
+          f'Station-month records: {len(recordings):,} \n'
+          f'CSVs Exported To: {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+# gunicorn.conf.py
+
+# Pre-fork serving
+#
+#   gunicorn wsgi:server            # this file is read from the working directory
+#
+# The app is imported once in the master (preload_app), which then loads
+# every dataset, serialized figure and the filter index (app.app.preload)
+# before the workers are forked. Workers share those pages copy-on-write
+# instead of each loading and building their own copy, so per-worker memory
+# and boot time no longer grow with the data. SNOWPACK_PRELOAD=0 restores
+# per-worker loading.
+#
+# Metrics (Scripts/metrics.py) are per process. Set SNOWPACK_METRICS_DIR to a
+# directory writable by every worker so /metrics reports the sum over all of
+# them instead of the worker that happened to serve the scrape.
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8050')}"
+workers = int(os.getenv('WEB_CONCURRENCY', os.cpu_count() or 1))
+preload_app = os.getenv('SNOWPACK_PRELOAD', '1') == '1'
+
+
+def when_ready(server):
+    """Master, after the app import and before the first fork."""
+    if preload_app:
+        from app.app import preload
+        preload()
+
+
+def post_fork(server, worker):
+    """Worker, right after the fork: drop the metrics inherited from the master (which reports its own)."""
+    from Scripts.metrics import REGISTRY
+    REGISTRY.reset()